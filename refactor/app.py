@@ -0,0 +1,434 @@
+import os
+import glob
+import threading
+import numpy as np
+from dash import Dash, html, dcc, Input, Output, State, MATCH
+from dash.exceptions import PreventUpdate
+
+from handlers.aggregate_cube import aggregate_cube
+from handlers.data_store import DataStore, SCHEMAS
+from handlers.BiciMAD import BiciMAD
+from handlers.bus_map import BusMap
+from handlers.cercanias import CercaniasMap
+from handlers.crime_visualization import CrimeVisualization
+from handlers.density import DensityEngine, register_density_tiles
+from handlers.distances import poi_distances
+from handlers.district_visualization import DistrictVisualization
+from handlers.figure_store import FigureStore, GRAPHS_TYPE, PAYLOAD_TYPE, RENDER_GRAPHS
+from handlers.general_use import TOURIST_SPOTS_GEOJSON
+from handlers.general_visualization import GeneralVisualization
+from handlers.geometry import geometry_version, neighbourhood_topology
+from handlers.layer_registry import LayerRegistry
+from handlers.listings_index import ListingsIndex, register_listings_api
+from handlers.map_cache import MapCache
+from handlers.metro_layers import line_layers
+from handlers.metro_visualization import MetroVisualization
+from handlers.servicios_map import ServiciosMap
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Rutas por defecto (se pueden cambiar con variables de entorno)
+DATA_PATH = os.environ.get('PRVD_DATA_PATH', os.path.join(ROOT_PATH, 'data'))
+CLEAN_PATH = os.environ.get('PRVD_CLEAN_PATH', os.path.join(DATA_PATH, 'pancho_clean'))
+RAW_PATH = os.environ.get('PRVD_RAW_PATH', os.path.join(DATA_PATH, 'pancho_raw'))
+CACHE_PATH = os.environ.get('PRVD_CACHE_PATH', os.path.join(DATA_PATH, 'cache'))
+ASSETS_PATH = os.path.join(ROOT_PATH, 'assets')
+
+# Datasets del almacén limpio de los que dependen los mapas
+STORE_DATASETS = ('listings', 'neighbourhoods', 'metro', 'crimes')
+
+# Carpetas con los datos en bruto de los mapas de transporte y servicios
+SOURCES = {
+    'bus': 'bus',
+    'cercanias': 'cercanias',
+    'servicios': 'servicios',
+    'bicimad': 'bicimad',
+}
+
+TABS = [
+    ('general', 'Análisis estadístico'),
+    ('madrid', 'Mapa de Madrid'),
+    ('distrito', 'Información por distrito'),
+    ('metro', 'Metro data'),
+    ('transporte', 'Transporte'),
+    ('crimenes', 'Criminalidad'),
+    ('bicimad', 'BiciMAD'),
+    ('servicios', 'Servicios'),
+]
+
+# Pestañas que se generan en segundo plano (con progreso y cancelación)
+BACKGROUND_TABS = ('general', 'transporte')
+
+# Tiempo (s) que se guardan los resultados de los trabajos en segundo plano
+JOB_EXPIRE = 24 * 60 * 60
+
+CRIME_TYPES = [column for column in SCHEMAS['crimes'] if column != 'DISTRITOS']
+
+
+def iframe(content, height='600px'):
+    """Iframe con el HTML de un mapa; cualquier otro contenido se devuelve tal cual"""
+    if not isinstance(content, str):
+        return content
+    return html.Iframe(
+        srcDoc=content,
+        style={
+            "width": "100%",
+            "height": height,
+            "border": "none"
+        }
+    )
+
+
+def no_data(path):
+    return html.Div(f"No hay datos disponibles en {path}.")
+
+
+class AppData:
+    """Datasets y handlers que comparten todas las sesiones de la aplicación.
+
+    `precompute` lee una vez los datasets limpios y calcula los datos derivados
+    que usan varias pestañas (índice espacial, cubo de agregados, densidad,
+    topología de barrios, distancias, capas compartidas). Los handlers de las fuentes en bruto
+    (autobuses, Cercanías, BiciMAD, servicios) se crean la primera vez que se
+    abre su pestaña.
+    """
+
+    def __init__(self, clean_path=CLEAN_PATH, raw_path=RAW_PATH, cache_path=CACHE_PATH, assets_path=ASSETS_PATH):
+        self.store = DataStore(clean_path)
+        self.raw_path = raw_path
+        self.cache_path = cache_path
+
+        self.layers = LayerRegistry(assets_path)
+        self.density_path = os.path.join(assets_path, 'density')
+        self.maps = MapCache(os.path.join(cache_path, 'maps'), version=self.version)
+        self.figures = FigureStore(os.path.join(cache_path, 'figures'), version=self.version)
+
+        self.handlers = {}
+        self.results = {}
+        self.lock = threading.Lock()
+
+    def source_path(self, name):
+        return os.path.join(self.raw_path, SOURCES[name])
+
+    def version(self):
+        """Versión de los datos: almacén limpio y ficheros en bruto"""
+        parts = [self.store.version(*STORE_DATASETS)]
+        for name in SOURCES:
+            path = self.source_path(name)
+            if os.path.isdir(path):
+                stats = [os.stat(entry.path) for entry in os.scandir(path) if entry.is_file()]
+                parts.append(f'{name}:' + ','.join(f'{stat.st_mtime_ns:x}-{stat.st_size:x}' for stat in stats))
+        return '|'.join(parts)
+
+    def precompute(self):
+        """Leer los datasets limpios y calcular los datos derivados compartidos"""
+        columns = sorted(set(
+            GeneralVisualization.COLUMNS + DistrictVisualization.COLUMNS + MetroVisualization.COLUMNS
+        ))
+        listings = self.store.read('listings', columns=columns)
+        listings['log_price'] = np.log1p(listings['price'])
+        gdf = self.store.read_geo('neighbourhoods')
+        metro_data = self.store.read('metro')
+
+        gdf_version = geometry_version(gdf)
+        topology = neighbourhood_topology(gdf, gdf_version)
+        listings_index = ListingsIndex(listings)
+        cube = aggregate_cube(listings)
+        density = DensityEngine(listings, cache_dir=self.density_path)
+        density.image('price')
+        poi_distances(listings)
+        line_layers(metro_data)
+        self.layers.publish('tourist_spots', TOURIST_SPOTS_GEOJSON)
+
+        self.listings = listings
+        self.gdf = gdf
+        self.topology = topology
+        self.listings_index = listings_index
+        self.density = density
+        self.cube = cube
+        self.general = GeneralVisualization(listings, gdf, self.layers, listings_index, density, cube, self.figures, gdf_version)
+        self.district = DistrictVisualization(listings, gdf, self.layers, listings_index, density, cube, self.figures, gdf_version)
+        self.metro = MetroVisualization(listings, metro_data, gdf, self.layers, gdf_version)
+        self.distritos = sorted(listings['neighbourhood_group'].dropna().unique().astype(str))
+        return self
+
+    def _create(self, name):
+        if name == 'bus':
+            return BusMap(self.source_path('bus'), os.path.join(self.cache_path, 'gtfs'))
+        if name == 'cercanias':
+            return CercaniasMap(self.source_path('cercanias'))
+        if name == 'servicios':
+            return ServiciosMap(self.source_path('servicios'))
+        if name == 'bicimad':
+            return BiciMAD.from_files(sorted(glob.glob(os.path.join(self.source_path('bicimad'), '*.csv'))))
+        if name == 'crimenes':
+            crimes = self.store.read('crimes')
+            # Distritos en el mismo orden que las filas de los crímenes
+            districts = self.topology.districts().set_index('neighbourhood_group')
+            districts = districts.reindex(crimes['DISTRITOS'].str.upper().str.strip())
+            return CrimeVisualization(crimes, districts.rename_axis('neighbourhood_group').reset_index(), self.figures)
+        raise KeyError(name)
+
+    def handler(self, name):
+        """Handler de una pestaña, creado la primera vez que se pide"""
+        with self.lock:
+            if name not in self.handlers:
+                self.handlers[name] = self._create(name)
+            return self.handlers[name]
+
+    def available(self, name):
+        return os.path.isdir(self.source_path(name))
+
+    def memo(self, key, function):
+        """Resultado de `function` guardado por clave y versión de los datos"""
+        key = (key, self.version())
+        if key not in self.results:
+            self.results = {k: v for k, v in self.results.items() if k[1] == key[1]}
+            self.results[key] = function()
+        return self.results[key]
+
+
+def render_tab(data, tab, progress=None):
+    """Contenido de una pestaña (salvo la de distritos, que depende del desplegable).
+
+    `progress(hechos, total)` recibe el avance de las pestañas lentas.
+    """
+    maps = data.maps
+
+    if tab == 'general':
+        return data.memo('general', lambda: data.general.get_all_graphs(progress))
+
+    if tab == 'madrid':
+        return html.Div([
+            iframe(maps.html(data.general.get_madrid_cloropleth)),
+            iframe(maps.html(data.general.get_madrid_heatmap)),
+            iframe(maps.html(data.general.get_madrid_listings_map)),
+        ])
+
+    if tab == 'metro':
+        return html.Div([
+            iframe(maps.html(data.metro.get_metro_map, cloropleth=True)),
+            iframe(maps.html(data.metro.get_metro_map, cloropleth=False)),
+        ])
+
+    if tab == 'transporte':
+        children = []
+        names = ('bus', 'cercanias')
+        for i, name in enumerate(names):
+            if not data.available(name):
+                children.append(no_data(data.source_path(name)))
+            else:
+                children.append(iframe(maps.handler_html(name, lambda: data.handler(name), 'create_map')))
+            if progress is not None:
+                progress(i + 1, len(names))
+        return html.Div(children)
+
+    if tab == 'crimenes':
+        crimes = data.handler('crimenes')
+        return html.Div([
+            data.memo('crimenes', crimes.get_all_graphs),
+            html.H4('Selecciona un tipo de incidente:'),
+            dcc.Dropdown(
+                id='crimen-dropdown',
+                options=[{'label': crimen.capitalize(), 'value': crimen} for crimen in CRIME_TYPES],
+                value=CRIME_TYPES[0]
+            ),
+            html.Div(id='crimen-map', className='map-container')
+        ])
+
+    if tab == 'bicimad':
+        if not data.available('bicimad'):
+            return no_data(data.source_path('bicimad'))
+        return iframe(maps.handler_html('bicimad', lambda: data.handler('bicimad'), 'Create_Map'))
+
+    if tab == 'servicios':
+        if not data.available('servicios'):
+            return no_data(data.source_path('servicios'))
+        return iframe(maps.handler_html('servicios', lambda: data.handler('servicios'), 'generar_mapa'))
+
+    raise PreventUpdate
+
+
+def render_district(data, distrito):
+    return html.Div([
+        data.district.get_district_info(distrito),
+        iframe(data.maps.html(data.district.get_district_cloropleth, distrito)),
+        iframe(data.maps.html(data.district.get_district_heatmap, distrito)),
+    ])
+
+
+def background_manager(data, cache_path=CACHE_PATH):
+    """Gestor de callbacks en segundo plano con los trabajos guardados en disco.
+
+    Cada trabajo se ejecuta en un proceso aparte, así que los hilos del
+    servidor quedan libres para los callbacks ligeros. Los resultados se
+    guardan por pestaña y versión de los datos (los callbacks ignoran la marca
+    de tiempo de la petición con `cache_args_to_ignore`): otra sesión que abra
+    la misma pestaña recibe el resultado guardado sin volver a calcularlo.
+    """
+    import diskcache
+    from dash import DiskcacheManager
+
+    cache = diskcache.Cache(os.path.join(cache_path, 'jobs'))
+    return DiskcacheManager(cache, cache_by=[data.version], expire=JOB_EXPIRE)
+
+
+def create_layout(data):
+    lazy_tabs = [value for value, _ in TABS if value != 'distrito']
+
+    def tab(value, label):
+        if value == 'distrito':
+            children = [
+                html.H4('Selecciona un distrito:'),
+                dcc.Dropdown(
+                    id='distrito-dropdown',
+                    options=[{'label': distrito, 'value': distrito} for distrito in data.distritos],
+                    value='CENTRO' if 'CENTRO' in data.distritos else data.distritos[0]
+                ),
+                dcc.Store(id='distrito-rendered'),
+                html.Div(id='distrito-content', className='map-container')
+            ]
+        else:
+            children = [
+                # Marca de pestaña ya generada (así no se reenvía su contenido al servidor)
+                dcc.Store(id=f'{value}-rendered'),
+                dcc.Loading(html.Div(id=f'{value}-content', className='map-container'))
+            ]
+            if value in BACKGROUND_TABS:
+                children = [
+                    html.Progress(id=f'{value}-progress', value='0', max='1', style={'display': 'none'}),
+                    dcc.Store(id=f'{value}-request'),
+                    dcc.Store(id=f'{value}-left'),
+                    *children
+                ]
+        return dcc.Tab(label=label, value=value, children=children)
+
+    return html.Div(className='container', children=[
+        html.H1('Datos de AirBnB en Madrid'),
+        dcc.Tabs(id='tabs', value=lazy_tabs[0], children=[tab(value, label) for value, label in TABS])
+    ])
+
+
+def register_background_tab(app, data, value):
+    """Callback en segundo plano de una pestaña lenta.
+
+    Muestra una barra de progreso mientras se calcula y cancela el trabajo si
+    se cambia de pestaña antes de que termine; al volver se lanza de nuevo.
+    """
+    # Petición del trabajo: solo al seleccionar la pestaña si aún no se ha generado
+    app.clientside_callback(
+        f"""
+        function(selected, rendered) {{
+            return selected === '{value}' && !rendered ? Date.now() : window.dash_clientside.no_update;
+        }}
+        """,
+        Output(f'{value}-request', 'data'),
+        Input('tabs', 'value'),
+        State(f'{value}-rendered', 'data')
+    )
+
+    # Marca de salida de la pestaña, que dispara la cancelación
+    app.clientside_callback(
+        f"""
+        function(selected) {{
+            return selected === '{value}' ? window.dash_clientside.no_update : Date.now();
+        }}
+        """,
+        Output(f'{value}-left', 'data'),
+        Input('tabs', 'value')
+    )
+
+    @app.callback(
+        Output(f'{value}-content', 'children'),
+        Output(f'{value}-rendered', 'data'),
+        Input(f'{value}-request', 'data'),
+        background=True,
+        running=[(Output(f'{value}-progress', 'style'), {'display': 'block', 'width': '100%'}, {'display': 'none'})],
+        progress=[Output(f'{value}-progress', 'value'), Output(f'{value}-progress', 'max')],
+        cancel=[Input(f'{value}-left', 'data')],
+        # La marca de tiempo de la petición no forma parte de la clave del
+        # resultado: solo la pestaña y la versión de los datos (cache_by)
+        cache_args_to_ignore=[0],
+        prevent_initial_call=True
+    )
+    def update_tab(set_progress, request):
+        if not request:
+            raise PreventUpdate
+        return render_tab(data, value, lambda done, total: set_progress((str(done), str(total)))), True
+
+
+def register_callbacks(app, data, background=False):
+    # Cada pestaña se genera la primera vez que se abre y después se conserva
+    for value, _ in TABS:
+        if value == 'distrito':
+            continue
+        if background and value in BACKGROUND_TABS:
+            register_background_tab(app, data, value)
+            continue
+
+        @app.callback(
+            Output(f'{value}-content', 'children'),
+            Output(f'{value}-rendered', 'data'),
+            Input('tabs', 'value'),
+            State(f'{value}-rendered', 'data')
+        )
+        def update_tab(selected, rendered, value=value):
+            if selected != value or rendered:
+                raise PreventUpdate
+            return render_tab(data, value), True
+
+    @app.callback(
+        Output('distrito-content', 'children'),
+        Output('distrito-rendered', 'data'),
+        Input('tabs', 'value'),
+        Input('distrito-dropdown', 'value'),
+        State('distrito-rendered', 'data')
+    )
+    def update_distrito(selected, distrito, rendered):
+        if selected != 'distrito' or not distrito or distrito == rendered:
+            raise PreventUpdate
+        return render_district(data, distrito), distrito
+
+    # Gráficos del FigureStore: el navegador decodifica el JSON guardado
+    app.clientside_callback(
+        RENDER_GRAPHS,
+        Output({'type': GRAPHS_TYPE, 'index': MATCH}, 'children'),
+        Input({'type': PAYLOAD_TYPE, 'index': MATCH}, 'data')
+    )
+
+    @app.callback(
+        Output('crimen-map', 'children'),
+        Input('crimen-dropdown', 'value')
+    )
+    def update_crimen_map(crimen):
+        if not crimen:
+            raise PreventUpdate
+        return iframe(data.maps.html(data.handler('crimenes').get_map, crimen))
+
+
+def create_app(data=None, background=True):
+    """Aplicación Dash con los datos precalculados y las pestañas bajo demanda.
+
+    Con `background` las pestañas de BACKGROUND_TABS se calculan en procesos
+    aparte (requiere `dash[diskcache]`).
+    """
+    data = data or AppData().precompute()
+    manager = background_manager(data, data.cache_path) if background else None
+
+    app = Dash(
+        __name__,
+        assets_folder=ASSETS_PATH,
+        suppress_callback_exceptions=True,
+        background_callback_manager=manager
+    )
+    app.title = 'Datos de AirBnB en Madrid'
+    app.layout = create_layout(data)
+
+    register_callbacks(app, data, background)
+    register_listings_api(app.server, lambda: data.listings_index)
+    register_density_tiles(app.server, lambda: data.density)
+    return app
+
+
+if __name__ == '__main__':
+    create_app().run(debug=os.environ.get('PRVD_DEBUG') == '1')
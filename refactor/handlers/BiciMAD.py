@@ -3,104 +3,115 @@ from .general_use import add_tourist_spots
 import pandas as pd
 import folium
 import matplotlib.pyplot as plt
-import matplotlib.colors as mcolors  # Para convertir colores RGBA a hexadecimal
-from matplotlib.colors import LinearSegmentedColormap
 from IPython.display import display, HTML
 from folium.plugins import Search
+from .color_scale import ColorScale
 
-class BiciMAD:
-    def __init__(self,data):
-        self.dfbike=data
-    
+# Columnas de los ficheros de viajes que se usan para la actividad por estación
+COLUMNS = [
+    'station_unlock', 'unlock_station_name', 'geolocation_unlock', 'address_unlock',
+    'station_lock', 'lock_station_name', 'geolocation_lock', 'address_lock'
+]
 
-    def obtener_color(self,valor, min_valor, max_valor):
-        # Normalizar valor entre 0 y 1
-        rango_normalizado = (valor - min_valor) / (max_valor - min_valor) if max_valor > min_valor else 0
-        # Crear un mapa de colores personalizado (de verde a rojo)
-        cmap = LinearSegmentedColormap.from_list("verde_rojo", ["green", "yellow", "red"])
-        # Obtener el color correspondiente (en formato RGBA y convertir a hexadecimal)
-        color = cmap(rango_normalizado)
-        return mcolors.rgb2hex(color[:3])
-    
-    def extraer_coordenadas(self,geolocation):
-        
-        
-        if pd.isnull(geolocation):
-            return None, None
-        try:
-            # Extraer la parte de las coordenadas
-            start = geolocation.find('[') + 1
-            end = geolocation.find(']')
-            coords = geolocation[start:end].split(',')
-            # Convertir las coordenadas a float
-            lon = float(coords[0].strip())
-            lat = float(coords[1].strip())
-            return lat, lon
-        except (ValueError, IndexError):
-            # Si ocurre algún error, devolver None
-            return None, None
-    
-    def Create_Map(self):
+# Las geolocalizaciones contienen las coordenadas como "[lon, lat]"
+COORDINATES_PATTERN = r'\[\s*([-+]?\d*\.?\d+(?:[eE][-+]?\d+)?)\s*,\s*([-+]?\d*\.?\d+(?:[eE][-+]?\d+)?)'
+
+
+def extraer_coordenadas(geolocation):
+    """Extraer latitud y longitud de una columna de geolocalizaciones (vectorizado)"""
+    coords = geolocation.astype('string').str.extract(COORDINATES_PATTERN)
+    lon = pd.to_numeric(coords[0], errors='coerce')
+    lat = pd.to_numeric(coords[1], errors='coerce')
+    return lat, lon
+
+
+def actividad_estaciones(chunks):
+    """Desbloqueos y bloqueos de cada estación, acumulados bloque a bloque.
+
+    `chunks` es cualquier iterable de DataFrames de viajes (por ejemplo los
+    bloques de `pd.read_csv(..., chunksize=...)`), de forma que los conteos son
+    exactos sin cargar todo el histórico en memoria.
+    """
+    estaciones = None
+    conteo_desbloqueos = None
+    conteo_bloqueos = None
+
+    for chunk in chunks:
         # Filtrar address y station
-        dfbike_filtered = self.dfbike[ 
-            self.dfbike['station_unlock'].notnull() & (self.dfbike['station_unlock'] != "") &
-            self.dfbike['station_lock'].notnull() & (self.dfbike['station_lock'] != "") &
-            self.dfbike['address_unlock'].notnull() & (self.dfbike['address_unlock'] != "") &
-            self.dfbike['address_lock'].notnull() & (self.dfbike['address_lock'] != "")
+        chunk = chunk[
+            chunk['station_unlock'].notnull() & (chunk['station_unlock'] != "") &
+            chunk['station_lock'].notnull() & (chunk['station_lock'] != "") &
+            chunk['address_unlock'].notnull() & (chunk['address_unlock'] != "") &
+            chunk['address_lock'].notnull() & (chunk['address_lock'] != "")
         ]
 
-        # Seleccionar 1000 registros del dataset filtrado
-        dfbike_sample = dfbike_filtered.sample(n=20000, random_state=42)
+        lat_unlock, lon_unlock = extraer_coordenadas(chunk['geolocation_unlock'])
+        lat_lock, lon_lock = extraer_coordenadas(chunk['geolocation_lock'])
 
-
-        dfbike_sample[['lat_unlock', 'lon_unlock']] = dfbike_sample['geolocation_unlock'].apply(
-            lambda x: pd.Series(self.extraer_coordenadas(x))
-        )
-        dfbike_sample[['lat_lock', 'lon_lock']] = dfbike_sample['geolocation_lock'].apply(
-            lambda x: pd.Series(self.extraer_coordenadas(x))
-        )
+        # Convertir stations a int
+        station_unlock = chunk['station_unlock'].astype(float).astype(int)
+        station_lock = chunk['station_lock'].astype(float).astype(int)
 
         # Coordenadas únicas para estaciones
-        estaciones_unlock = dfbike_sample[['station_unlock', 'unlock_station_name', 'lat_unlock', 'lon_unlock']].rename(
-            columns={'station_unlock': 'station_id', 'unlock_station_name': 'station_name', 'lat_unlock': 'lat', 'lon_unlock': 'lon'}
-        )
-        estaciones_lock = dfbike_sample[['station_lock', 'lock_station_name', 'lat_lock', 'lon_lock']].rename(
-            columns={'station_lock': 'station_id', 'lock_station_name': 'station_name', 'lat_lock': 'lat', 'lon_lock': 'lon'}
-        )
+        estaciones_chunk = pd.concat([
+            pd.DataFrame({'station_id': station_unlock, 'station_name': chunk['unlock_station_name'], 'lat': lat_unlock, 'lon': lon_unlock}),
+            pd.DataFrame({'station_id': station_lock, 'station_name': chunk['lock_station_name'], 'lat': lat_lock, 'lon': lon_lock}),
+        ]).dropna().drop_duplicates(subset=['station_id'])
+        estaciones = pd.concat([estaciones, estaciones_chunk]).drop_duplicates(subset=['station_id'])
 
-        # Convertir stations a int
-        dfbike_sample['station_lock'] = dfbike_sample['station_lock'].astype(float).astype(int)
-        dfbike_sample['station_unlock'] = dfbike_sample['station_unlock'].astype(float).astype(int)
+        # Sumar los conteos del bloque
+        desbloqueos = station_unlock.value_counts()
+        bloqueos = station_lock.value_counts()
+        conteo_desbloqueos = desbloqueos if conteo_desbloqueos is None else conteo_desbloqueos.add(desbloqueos, fill_value=0)
+        conteo_bloqueos = bloqueos if conteo_bloqueos is None else conteo_bloqueos.add(bloqueos, fill_value=0)
 
+    if estaciones is None:
+        return pd.DataFrame(columns=['station_id', 'station_name', 'lat', 'lon', 'desbloqueos', 'bloqueos', 'total_actividad'])
 
-        # Combinar y eliminar duplicados
-        estaciones = pd.concat([estaciones_unlock, estaciones_lock]).drop_duplicates(subset=['station_id']).dropna()
+    # Unir conteos
+    estaciones = estaciones.set_index('station_id')
+    estaciones = estaciones.join(conteo_desbloqueos.rename("desbloqueos")).join(conteo_bloqueos.rename("bloqueos")).fillna(0).reset_index()
 
-        # Calcular conteos
-        conteo_desbloqueos = dfbike_sample.groupby('station_unlock').size().rename("desbloqueos")
-        conteo_bloqueos = dfbike_sample.groupby('station_lock').size().rename("bloqueos")
+    # Calcular la actividad total por estación
+    estaciones['total_actividad'] = estaciones['desbloqueos'] + estaciones['bloqueos']
+    return estaciones
 
-        # Unir conteos
-        estaciones = estaciones.set_index('station_id')
-        estaciones = estaciones.join(conteo_desbloqueos).join(conteo_bloqueos).fillna(0).reset_index()
 
-        # Calcular la actividad total por estación
-        estaciones['total_actividad'] = estaciones['desbloqueos'] + estaciones['bloqueos']
+class BiciMAD:
+    # Escala de verde a rojo según la actividad total de la estación
+    escala_actividad = ColorScale(['green', 'yellow', 'red'])
+
+    def __init__(self, data=None, estaciones=None):
+        self.dfbike = data
+        self.estaciones = estaciones
+
+    @classmethod
+    def from_files(cls, paths, chunksize=200_000, **read_csv_kwargs):
+        """Calcular la actividad de las estaciones recorriendo por bloques los ficheros mensuales"""
+        chunks = (
+            chunk
+            for path in paths
+            for chunk in pd.read_csv(path, usecols=COLUMNS, chunksize=chunksize, **read_csv_kwargs)
+        )
+        return cls(estaciones=actividad_estaciones(chunks))
 
-        # Calcular los valores mínimo y máximo de actividad total
-        min_total_actividad = estaciones['total_actividad'].min()
-        max_total_actividad = estaciones['total_actividad'].max()
+    def get_station_activity(self):
+        """Actividad por estación, calculada sobre todos los viajes (sin muestreo)"""
+        if self.estaciones is None:
+            self.estaciones = actividad_estaciones([self.dfbike])
+        return self.estaciones
+    
+    def Create_Map(self):
+        estaciones = self.get_station_activity()
 
-        # Función para normalizar valores y asignar un color
+        # Color de todas las estaciones de una vez, de verde (poca actividad) a rojo
+        colores = self.escala_actividad(estaciones['total_actividad'])
 
         # Madrid map
         mapa = folium.Map(location=[40.4168, -3.7038], zoom_start=12)
 
         # Añadir marcadores con colores basados en actividad total
-        for _, row in estaciones.iterrows():
-            # Determinar color según el total de actividad
-            color = self.obtener_color(row['total_actividad'], min_total_actividad, max_total_actividad)
-            
+        for row, color in zip(estaciones.to_dict('records'), colores):
             # Contenido del popup con bloqueos y desbloqueos separados
             popup_text = f"""
             <b>Estación:</b> {row['station_name']}<br>
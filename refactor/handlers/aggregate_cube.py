@@ -0,0 +1,203 @@
+import hashlib
+import numpy as np
+import pandas as pd
+from .quantile_sketch import RELATIVE_ACCURACY, QuantileSketch, bucket_index, gamma_for
+
+# Niveles del cubo, del más general al más detallado
+KEYS = ['neighbourhood_group', 'neighbourhood', 'room_type']
+
+# Valor de los niveles inferiores vacíos: esos alojamientos siguen contando
+# en su distrito aunque no tengan barrio o tipo de habitación
+MISSING = '(sin dato)'
+
+# Cubos ya calculados por versión de los datos (se guardan solo los últimos)
+_CUBES = {}
+_MAX_VERSIONS = 4
+
+
+def data_version(listings, keys=KEYS):
+    """Versión de las columnas que usa el cubo a partir de su contenido.
+
+    Depende también del índice y del orden de las filas, porque el cubo guarda
+    posiciones de filas (`rows`).
+    """
+    columns = [column for column in keys + ['price', 'minimum_nights', 'latitude', 'longitude'] if column in listings]
+    hashes = pd.util.hash_pandas_object(listings[columns], index=True).to_numpy()
+    return hashlib.sha1(hashes.tobytes()).hexdigest()
+
+
+class AggregateCube:
+    """Agregados de los alojamientos por distrito, barrio y tipo de habitación.
+
+    Cada celda (distrito, barrio, tipo) guarda medidas sumables: número de
+    alojamientos, suma y suma de cuadrados del precio, noches mínimas,
+    coordenadas y los contadores de un QuantileSketch de precios (cuantiles
+    con error relativo acotado). Cualquier consulta por distrito o barrio suma
+    solo las celdas que le corresponden, que se localizan con un diccionario.
+    """
+
+    def __init__(self, listings, keys=KEYS, accuracy=RELATIVE_ACCURACY):
+        self.keys = list(keys)
+        # Solo se descartan las filas sin el nivel superior (distrito)
+        key_frame = listings[self.keys].astype(object)
+        key_frame[self.keys[1:]] = key_frame[self.keys[1:]].fillna(MISSING)
+        groups = key_frame.groupby(self.keys, sort=True, dropna=True)
+        cell = groups.ngroup().to_numpy()
+        self.cells = groups.size().index.to_frame(index=False)
+        self.cells[self.keys] = self.cells[self.keys].astype(str)
+        n = len(self.cells)
+
+        # ngroup da NaN (y tipo float) a las filas sin distrito
+        valid = cell >= 0
+        cell = np.where(valid, cell, 0).astype(np.intp)
+
+        def total(values, where=None):
+            where = valid if where is None else valid & where
+            return np.bincount(cell[where], weights=values[where], minlength=n)
+
+        price = listings['price'].to_numpy(dtype='float64')
+        priced = ~np.isnan(price)
+        self.count = np.bincount(cell[valid], minlength=n)
+        self.price_count = total(np.ones(len(price)), priced)
+        self.price_sum = total(price, priced)
+        self.price_sumsq = total(price ** 2, priced)
+
+        nights = listings['minimum_nights'].to_numpy(dtype='float64') if 'minimum_nights' in listings else np.full(len(price), np.nan)
+        self.nights_count = total(np.ones(len(nights)), ~np.isnan(nights))
+        self.nights_sum = total(nights, ~np.isnan(nights))
+
+        lat = listings['latitude'].to_numpy(dtype='float64')
+        lon = listings['longitude'].to_numpy(dtype='float64')
+        located = ~np.isnan(lat) & ~np.isnan(lon)
+        self.located = total(np.ones(len(lat)), located)
+        self.lat_sum = total(lat, located)
+        self.lon_sum = total(lon, located)
+
+        # Precios extremos exactos de cada celda
+        self.price_min = np.full(n, np.inf)
+        self.price_max = np.full(n, -np.inf)
+        np.minimum.at(self.price_min, cell[valid & priced], price[valid & priced])
+        np.maximum.at(self.price_max, cell[valid & priced], price[valid & priced])
+
+        # Contadores del resumen de cuantiles de cada celda: precios <= 0 aparte
+        # y cubos logarítmicos (desde `offset`) para el resto
+        self.accuracy = accuracy
+        positive = valid & priced & (price > 0)
+        self.zeros = np.bincount(cell[valid & priced & (price <= 0)], minlength=n)
+        buckets = bucket_index(price[positive], gamma_for(accuracy))
+        self.offset = int(buckets.min()) if len(buckets) else 0
+        self.buckets = int(buckets.max()) - self.offset + 1 if len(buckets) else 0
+        flat = cell[positive] * self.buckets + buckets - self.offset
+        self.histogram = np.bincount(flat, minlength=n * self.buckets).reshape(n, self.buckets).astype(np.int32)
+
+        # Celdas de cada prefijo de claves: (), (distrito,), (distrito, barrio)...
+        self._index = {(): np.arange(n)}
+        for level in range(1, len(self.keys) + 1):
+            for key, members in self.cells.groupby(self.keys[:level], sort=False).indices.items():
+                self._index[key if isinstance(key, tuple) else (key,)] = members
+
+        # Filas de listings ordenadas por celda, para devolver las de una consulta
+        self._order = np.argsort(np.where(valid, cell, n), kind='stable')
+        sorted_cells = np.where(valid, cell, n)[self._order]
+        self._starts = np.searchsorted(sorted_cells, np.arange(n), side='left')
+        self._ends = np.searchsorted(sorted_cells, np.arange(n), side='right')
+
+    def _cells(self, *key):
+        """Celdas de un prefijo de claves: (), (distrito,), (distrito, barrio)..."""
+        return self._index.get(tuple(str(value) for value in key), np.empty(0, dtype=int))
+
+    def rows(self, *key):
+        """Posiciones en listings de los alojamientos de un prefijo de claves"""
+        cells = self._cells(*key)
+        if not len(cells):
+            return np.empty(0, dtype=int)
+        return np.sort(np.concatenate([self._order[self._starts[i]:self._ends[i]] for i in cells]))
+
+    def _sketch(self, cells):
+        if not len(cells):
+            return QuantileSketch(self.accuracy)
+        return QuantileSketch(
+            self.accuracy, self.histogram[cells].sum(axis=0), self.offset, self.zeros[cells].sum(),
+            self.price_min[cells].min(), self.price_max[cells].max()
+        )
+
+    def _known(self, cells, levels):
+        """Celdas con valor en `levels` (como groupby, no se desglosan los vacíos)"""
+        levels = [levels] if isinstance(levels, str) else list(levels)
+        known = (self.cells.loc[cells, levels] != MISSING).all(axis=1).to_numpy()
+        return cells[known]
+
+    def sketch(self, *key):
+        """Resumen de cuantiles del precio de un prefijo de claves (suma de sus celdas)"""
+        return self._sketch(self._cells(*key))
+
+    def sketches(self, levels, *key):
+        """Resumen de cuantiles por cada valor de `levels` (uno o varios niveles) dentro de un prefijo de claves"""
+        cells = self._known(self._cells(*key), levels)
+        groups = self.cells.iloc[cells].reset_index(drop=True).groupby(levels, sort=False).indices
+        return {name: self._sketch(cells[positions]) for name, positions in groups.items()}
+
+    def quantiles(self, q, *key):
+        """Cuantiles aproximados del precio de un prefijo de claves"""
+        return self.sketch(*key).quantile(q)
+
+    def stats(self, *key):
+        """Número de alojamientos, precio medio/mediano/desviación/p5/p95, noches mínimas y centro"""
+        cells = self._cells(*key)
+        p5, median, p95 = self._sketch(cells).quantile([0.05, 0.5, 0.95])
+        price_count = self.price_count[cells].sum()
+        price_sum = self.price_sum[cells].sum()
+        located = self.located[cells].sum()
+        nights_count = self.nights_count[cells].sum()
+
+        mean = price_sum / price_count if price_count else np.nan
+        variance = self.price_sumsq[cells].sum() / price_count - mean ** 2 if price_count else np.nan
+        return {
+            'count': int(self.count[cells].sum()),
+            'mean_price': mean,
+            'median_price': float(median),
+            'std_price': float(np.sqrt(max(variance, 0))) if price_count else np.nan,
+            'p5_price': float(p5),
+            'p95_price': float(p95),
+            'mean_minimum_nights': self.nights_sum[cells].sum() / nights_count if nights_count else np.nan,
+            'latitude': self.lat_sum[cells].sum() / located if located else np.nan,
+            'longitude': self.lon_sum[cells].sum() / located if located else np.nan,
+        }
+
+    def breakdown(self, level, *key):
+        """Agregados por los valores de `level` dentro de un prefijo de claves.
+
+        Por ejemplo `breakdown('neighbourhood', 'Centro')` da una fila por barrio
+        de Centro con count, price_count, mean_price y median_price.
+        """
+        cells = self._known(self._cells(*key), level)
+        frame = pd.DataFrame({
+            level: self.cells.loc[cells, level].to_numpy(),
+            'count': self.count[cells],
+            'price_count': self.price_count[cells],
+            'price_sum': self.price_sum[cells],
+        })
+        grouped = frame.groupby(level, sort=False)
+        result = grouped[['count', 'price_count', 'price_sum']].sum()
+        result['mean_price'] = result['price_sum'] / result['price_count'].replace(0, np.nan)
+
+        sketches = {name: self._sketch(cells[positions]) for name, positions in grouped.indices.items()}
+        result['median_price'] = [sketches[name].median() for name in result.index]
+        return result.drop(columns='price_sum').reset_index()
+
+    def room_type_counts(self, *key):
+        """Número de alojamientos por tipo de habitación (solo los que tienen alguno)"""
+        counts = self.breakdown('room_type', *key)[['room_type', 'count']]
+        return counts[counts['count'] > 0].sort_values('count', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def aggregate_cube(listings, version=None):
+    """Cubo de agregados de los alojamientos, memoizado por versión de los datos"""
+    if version is None:
+        version = data_version(listings)
+
+    if version not in _CUBES:
+        if len(_CUBES) >= _MAX_VERSIONS:
+            del _CUBES[next(iter(_CUBES))]
+        _CUBES[version] = AggregateCube(listings)
+    return _CUBES[version]
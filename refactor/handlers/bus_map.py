@@ -1,66 +1,21 @@
 import folium
 from folium import plugins
 from dash import html
+import numpy as np
 import pandas as pd
-import os
+from .gtfs_loader import GTFSFeed, format_gtfs_time
 
 class BusMap:
-    def __init__(self, base_path):
+    def __init__(self, base_path, compiled_path=None):
         self.base_path = base_path
+        self.compiled_path = compiled_path
         self.data = self._load_data()
         self.colors = self._setup_colors()
+        self._build_indexes()
         
     def _load_data(self):
         """Cargar todos los archivos GTFS necesarios"""
-        # Inicializar DataFrames vacíos
-        all_stops = pd.DataFrame()
-        all_routes = pd.DataFrame()
-        all_trips = pd.DataFrame()
-        all_stop_times = pd.DataFrame()
-        
-        # Buscar todas las subcarpetas
-        subdirs = [d for d in os.listdir(self.base_path) if os.path.isdir(os.path.join(self.base_path, d))]
-        
-        # Leer archivos de cada subcarpeta
-        for subdir in subdirs:
-            subdir_path = os.path.join(self.base_path, subdir)
-            
-            # Leer stops.txt si existe
-            stops_path = os.path.join(subdir_path, 'stops.txt')
-            if os.path.exists(stops_path):
-                stops_df = pd.read_csv(stops_path)
-                all_stops = pd.concat([all_stops, stops_df], ignore_index=True)
-            
-            # Leer routes.txt si existe
-            routes_path = os.path.join(subdir_path, 'routes.txt')
-            if os.path.exists(routes_path):
-                routes_df = pd.read_csv(routes_path)
-                all_routes = pd.concat([all_routes, routes_df], ignore_index=True)
-            
-            # Leer trips.txt si existe
-            trips_path = os.path.join(subdir_path, 'trips.txt')
-            if os.path.exists(trips_path):
-                trips_df = pd.read_csv(trips_path)
-                all_trips = pd.concat([all_trips, trips_df], ignore_index=True)
-            
-            # Leer stop_times.txt si existe
-            stop_times_path = os.path.join(subdir_path, 'stop_times.txt')
-            if os.path.exists(stop_times_path):
-                stop_times_df = pd.read_csv(stop_times_path)
-                all_stop_times = pd.concat([all_stop_times, stop_times_df], ignore_index=True)
-        
-        # Eliminar duplicados
-        all_stops = all_stops.drop_duplicates()
-        all_routes = all_routes.drop_duplicates()
-        all_trips = all_trips.drop_duplicates()
-        all_stop_times = all_stop_times.drop_duplicates()
-        
-        return {
-            'stops': all_stops,
-            'routes': all_routes,
-            'trips': all_trips,
-            'stop_times': all_stop_times
-        }
+        return GTFSFeed(self.base_path, self.compiled_path).load()
     
     def _setup_colors(self):
         """Configurar colores para las rutas"""
@@ -80,11 +35,11 @@ class BusMap:
         diurnas_index = 0
         nocturnas_index = 0
         
-        # Obtener nombres únicos de ruta
-        unique_route_names = self.data['routes']['route_short_name'].unique()
+        # Agrupar las rutas por nombre, en orden de aparición
+        routes_by_name = self.data['routes'].groupby('route_short_name', sort=False, observed=True)['route_id']
         
         # Asignar colores a cada ruta
-        for route_name in unique_route_names:
+        for route_name, route_ids in routes_by_name:
             if str(route_name).startswith('N'):
                 color = colores_nocturnos[nocturnas_index % len(colores_nocturnos)]
                 nocturnas_index += 1
@@ -93,12 +48,48 @@ class BusMap:
                 diurnas_index += 1
             
             # Asignar el mismo color a todas las rutas con el mismo nombre
-            route_ids = self.data['routes'][self.data['routes']['route_short_name'] == route_name]['route_id']
             for route_id in route_ids:
                 route_colors[route_id] = color
         
         return route_colors
     
+    def _build_indexes(self):
+        """Precalcular los índices de rutas, viajes y paradas"""
+        routes = self.data['routes']
+        stops = self.data['stops'].drop_duplicates(subset='stop_id')
+        
+        # route_id -> nombre corto de la ruta
+        self.route_names = dict(zip(routes['route_id'], routes['route_short_name']))
+        
+        # Paradas de todos los viajes ordenadas por viaje y número de parada, de
+        # forma que las de cada viaje queden en un tramo contiguo
+        stop_times = self.data['stop_times']
+        trip_ids = stop_times['trip_id'].astype(str).to_numpy()
+        order = np.lexsort((stop_times['stop_sequence'].to_numpy(), trip_ids))
+        stop_times = stop_times.iloc[order]
+        trip_ids = trip_ids[order]
+        self.trip_index, trip_starts = np.unique(trip_ids, return_index=True)
+        self.trip_offsets = np.append(trip_starts, len(trip_ids))
+        
+        # Posición en `stops` de cada parada de stop_times (-1 si no existe)
+        self.stop_times_arrival = stop_times['arrival_time'].to_numpy()
+        self.stop_times_position = pd.Index(stops['stop_id']).get_indexer(stop_times['stop_id'])
+        
+        self.stops_lat = stops['stop_lat'].to_numpy()
+        self.stops_lon = stops['stop_lon'].to_numpy()
+        self.stops_name = stops['stop_name'].to_numpy()
+        if 'stop_desc' in stops.columns:
+            self.stops_desc = stops['stop_desc'].fillna('N/A').to_numpy()
+        else:
+            self.stops_desc = np.full(len(stops), 'N/A', dtype=object)
+    
+    def _trip_slice(self, trip_id):
+        """Tramo de stop_times (ya ordenado) que corresponde a un viaje"""
+        i = np.searchsorted(self.trip_index, str(trip_id))
+        if i == len(self.trip_index) or self.trip_index[i] != str(trip_id):
+            return slice(0, 0)
+        return slice(self.trip_offsets[i], self.trip_offsets[i + 1])
+    
     def create_map(self):
         """Crear el mapa con todas las rutas y paradas"""
         # Crear el mapa base
@@ -111,47 +102,44 @@ class BusMap:
         grupo_diurnas = folium.FeatureGroup(name="Líneas Diurnas")
         grupo_nocturnas = folium.FeatureGroup(name="Líneas Nocturnas")
         
-        # Agrupar los viajes por ruta
-        grouped_trips = self.data['trips'].groupby('route_id')
+        # Un viaje representativo por ruta
+        sample_trips = self.data['trips'].groupby('route_id', observed=True)['trip_id'].first()
         
         # Para cada ruta
-        for route_id, trips in grouped_trips:
+        for route_id, trip_id in sample_trips.items():
             color = self.colors.get(route_id, '#FF0000')
-            route_name = self.data['routes'][self.data['routes']['route_id'] == route_id]['route_short_name'].iloc[0]
-            
-            # Obtener un viaje representativo
-            sample_trip = trips.iloc[0]
+            route_name = self.route_names.get(route_id, route_id)
             
-            # Obtener todas las paradas de este viaje en orden
-            trip_stops = self.data['stop_times'][
-                self.data['stop_times']['trip_id'] == sample_trip['trip_id']
-            ].sort_values('stop_sequence')
+            # Paradas de este viaje en orden
+            trip_slice = self._trip_slice(trip_id)
+            positions = self.stop_times_position[trip_slice]
+            arrivals = self.stop_times_arrival[trip_slice][positions >= 0]
+            positions = positions[positions >= 0]
             
-            coordinates = []
+            coordinates = np.column_stack([self.stops_lat[positions], self.stops_lon[positions]]).tolist()
             
-            for _, stop_time in trip_stops.iterrows():
-                stop = self.data['stops'][self.data['stops']['stop_id'] == stop_time['stop_id']].iloc[0]
-                coordinates.append([stop['stop_lat'], stop['stop_lon']])
+            for (lat, lon), position, arrival in zip(coordinates, positions, arrivals):
+                stop_name = self.stops_name[position]
                 
                 # Crear contenido HTML para el popup
                 popup_content = f"""
                 <div style="width: 200px">
                     <h4 style="color:{color}">Línea {route_name}</h4>
-                    <b>Parada:</b> {stop['stop_name']}<br>
-                    <b>Hora:</b> {stop_time['arrival_time']}<br>
-                    <b>Dirección:</b> {stop.get('stop_desc', 'N/A')}<br>
+                    <b>Parada:</b> {stop_name}<br>
+                    <b>Hora:</b> {format_gtfs_time(arrival)}<br>
+                    <b>Dirección:</b> {self.stops_desc[position]}<br>
                 </div>
                 """
                 
                 # Agregar marcador para la parada
                 marker = folium.CircleMarker(
-                    location=[stop['stop_lat'], stop['stop_lon']],
+                    location=[lat, lon],
                     radius=5,
                     color=color,
                     fill=True,
                     fillOpacity=0.7,
                     popup=folium.Popup(popup_content, max_width=300),
-                    tooltip=stop['stop_name']
+                    tooltip=stop_name
                 )
                 
                 # Añadir al grupo correspondiente
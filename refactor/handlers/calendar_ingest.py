@@ -0,0 +1,92 @@
+import pandas as pd
+
+class CalendarIngest:
+    """Lectura por bloques de calendar.csv con agregación sobre la marcha.
+
+    El calendario tiene una fila por alojamiento y día, así que nunca se carga
+    entero: cada bloque se reduce a sumas parciales que se van acumulando. La
+    memoria usada depende del tamaño del bloque y del número de alojamientos,
+    no del número de filas del fichero.
+    """
+
+    COLUMNS = ['listing_id', 'date', 'available', 'price']
+
+    def __init__(self, path, listings, chunksize=500_000):
+        self.path = path
+        self.chunksize = chunksize
+        # Distrito de cada alojamiento, para agregar por distrito y día
+        self.districts = listings.set_index('id')['neighbourhood_group'].astype(str)
+
+    def _read_chunks(self):
+        try:
+            return pd.read_csv(
+                self.path,
+                usecols=self.COLUMNS,
+                dtype={'listing_id': 'int64', 'date': 'string', 'available': 'string', 'price': 'string'},
+                chunksize=self.chunksize
+            )
+        except pd.errors.EmptyDataError:
+            # Fichero vacío (sin cabecera): no hay bloques
+            return []
+
+    def _parse_chunk(self, chunk):
+        """Convertir fechas, disponibilidad y precios de un bloque"""
+        chunk['date'] = pd.to_datetime(chunk['date'], errors='coerce')
+        chunk['available'] = (chunk['available'] == 't').astype('int8')
+        chunk['price'] = pd.to_numeric(chunk['price'].str.replace(r'[\$,]', '', regex=True), errors='coerce')
+        chunk['neighbourhood_group'] = chunk['listing_id'].map(self.districts)
+        return chunk
+
+    @staticmethod
+    def _partial(chunk, keys):
+        """Sumas parciales de un bloque, combinables con las de otros bloques"""
+        return chunk.groupby(keys).agg(
+            days=('available', 'size'),
+            available_days=('available', 'sum'),
+            price_sum=('price', 'sum'),
+            price_days=('price', 'count')
+        ).astype('float64')
+
+    @staticmethod
+    def _combine(total, partial):
+        if total is None:
+            return partial
+        return total.add(partial, fill_value=0)
+
+    # Tipos de las claves de agregación, para los resultados vacíos
+    KEY_DTYPES = {'listing_id': 'int64', 'neighbourhood_group': 'str', 'date': 'datetime64[ns]'}
+
+    @classmethod
+    def _finalize(cls, sums, keys):
+        """Pasar de sumas acumuladas a tasas y medias (sin bloques, un DataFrame vacío)"""
+        if sums is None:
+            return pd.DataFrame({
+                **{key: pd.Series(dtype=cls.KEY_DTYPES[key]) for key in keys},
+                **{col: pd.Series(dtype='float64') for col in ('days', 'availability_rate', 'mean_price')}
+            })
+        return pd.DataFrame({
+            'days': sums['days'],
+            'availability_rate': sums['available_days'] / sums['days'],
+            'mean_price': sums['price_sum'] / sums['price_days']
+        }).reset_index()
+
+    def run(self):
+        """Recorrer el calendario y devolver los agregados por alojamiento y por distrito y día"""
+        listing_keys = ['listing_id']
+        district_keys = ['neighbourhood_group', 'date']
+        by_listing = None
+        by_district = None
+
+        for chunk in self._read_chunks():
+            chunk = self._parse_chunk(chunk)
+            by_listing = self._combine(by_listing, self._partial(chunk, listing_keys))
+            by_district = self._combine(by_district, self._partial(chunk, district_keys))
+
+        return self._finalize(by_listing, listing_keys), self._finalize(by_district, district_keys)
+
+    def write(self, store):
+        """Guardar los agregados del calendario en el almacén de datos"""
+        by_listing, by_district = self.run()
+        store.write('calendar_listing', by_listing)
+        store.write('calendar_district', by_district)
+        return by_listing, by_district
@@ -1,9 +1,10 @@
 import folium
 from folium import plugins
 import pandas as pd
-from scipy.spatial.distance import cdist
-import numpy as np
 import os
+from .gtfs_loader import read_gtfs_table
+from .line_ordering import longest_trip_stops, order_nearest_neighbour
+from .station_index import StationIndex
 
 class CercaniasMap:
     def __init__(self, base_path):
@@ -11,12 +12,21 @@ class CercaniasMap:
         self.data = self._load_data()
         self.stations_by_line = self._setup_stations()
         self.colors = self._setup_colors()
+        self.stops_by_line = self._match_stops()
+        self.line_sequences = self._line_sequences()
         
     def _load_data(self):
         """Cargar datos de Cercanías"""
         df_stops = pd.read_csv(os.path.join(self.base_path, 'stops.txt'))
         df_routes = pd.read_csv(os.path.join(self.base_path, 'routes.txt'))
-        return {'stops': df_stops, 'routes': df_routes}
+        data = {'stops': df_stops, 'routes': df_routes}
+        
+        # Los viajes, si existen, dan el orden real de las estaciones de cada línea
+        for table in ('trips', 'stop_times'):
+            path = os.path.join(self.base_path, f'{table}.txt')
+            if os.path.exists(path):
+                data[table] = read_gtfs_table(table, path)
+        return data
     
     def _setup_stations(self):
         """Configurar estaciones por línea"""
@@ -86,23 +96,62 @@ class CercaniasMap:
                     colores_linea[route['route_short_name']] = '#664422'  # Marrón oscuro
         return colores_linea
     
-    def _order_coordinates(self, coordinates):
-        """Ordenar coordenadas para conectar estaciones cercanas"""
-        if len(coordinates) <= 2:
-            return coordinates
+    def _match_stops(self):
+        """Asignar cada parada a las líneas a las que pertenece, en una sola pasada"""
+        stops = self.data['stops']
         
-        ordered = [coordinates[0]]
-        remaining = coordinates[1:]
+        # Solo paradas, no estaciones padre
+        if 'location_type' in stops.columns:
+            stops = stops[stops['location_type'].fillna(0) == 0]
         
-        while remaining:
-            last_point = np.array([ordered[-1]])
-            remaining_points = np.array(remaining)
-            distances = cdist(last_point, remaining_points).flatten()
-            nearest_idx = np.argmin(distances)
-            ordered.append(remaining[nearest_idx])
-            remaining.pop(nearest_idx)
+        index = StationIndex(self.stations_by_line)
+        positions_by_line = index.match(stops['stop_name'].tolist())
         
-        return ordered
+        return {
+            line: stops.iloc[positions]
+            for line, positions in positions_by_line.items()
+        }
+    
+    def _line_sequences(self):
+        """Coordenadas de cada línea en el orden de su viaje más largo, si el feed trae viajes"""
+        if 'trips' not in self.data or 'stop_times' not in self.data:
+            return {}
+        
+        stops = self.data['stops']
+        routes = self.data['routes']
+        stop_positions = pd.Index(stops['stop_id'].astype(str))
+        
+        # Solo las paradas de Madrid del índice de estaciones: en el feed nacional
+        # hay líneas C1, C2... en varios núcleos y así no se mezclan sus viajes
+        madrid_stops = {str(stop_id) for line_stops in self.stops_by_line.values() for stop_id in line_stops['stop_id']}
+        stop_times = self.data['stop_times']
+        stop_ids = stop_times['stop_id'].astype(str)
+        madrid_times = pd.DataFrame({
+            'trip_id': stop_times['trip_id'].astype(str),
+            'stop_id': stop_ids,
+            'stop_sequence': stop_times['stop_sequence']
+        })[stop_ids.isin(madrid_stops).to_numpy()]
+        
+        # Línea de cada viaje, uniendo trips y routes una sola vez
+        trips = self.data['trips']
+        lines = routes.assign(route_id=routes['route_id'].astype(str)).set_index('route_id')['route_short_name']
+        trip_lines = pd.Series(
+            trips['route_id'].astype(str).map(lines).to_numpy(),
+            index=trips['trip_id'].astype(str)
+        )
+        trip_lines = trip_lines[trip_lines.isin(list(self.stations_by_line))]
+        
+        sequences = {}
+        for route_name, stop_ids in longest_trip_stops(trip_lines, madrid_times).items():
+            positions = stop_positions.get_indexer(stop_ids)
+            positions = positions[positions >= 0]
+            if len(positions) > 1:
+                sequences[route_name] = stops.iloc[positions][['stop_lat', 'stop_lon']].values.tolist()
+        return sequences
+    
+    def _order_coordinates(self, coordinates):
+        """Ordenar coordenadas para conectar estaciones cercanas"""
+        return order_nearest_neighbour(coordinates)
     
     def create_map(self):
         """Crear el mapa de Cercanías"""
@@ -113,40 +162,42 @@ class CercaniasMap:
         )
         
         # Procesar cada línea
-        for route_name, stations in self.stations_by_line.items():
+        for route_name in self.stations_by_line:
             line_group = folium.FeatureGroup(name=f'Línea {route_name}')
             color = self.colors[route_name]
             
             # Lista para almacenar las coordenadas de las estaciones de esta línea
             line_coordinates = []
             
-            # Filtramos las estaciones que pertenecen a esta línea
-            for _, stop in self.data['stops'].iterrows():
-                if stop['location_type'] == 0:  # Solo paradas, no estaciones padre
-                    if any(station in stop['stop_name'].upper() for station in stations):
-                        # Añadimos las coordenadas para la línea
-                        line_coordinates.append([stop['stop_lat'], stop['stop_lon']])
-                        
-                        # Creamos el marcador para la estación
-                        folium.CircleMarker(
-                            location=[stop['stop_lat'], stop['stop_lon']],
-                            radius=8,
-                            popup=f"""
-                                <b>{stop['stop_name']}</b><br>
-                                {stop['stop_desc']}<br>
-                                Zona: {stop['zone_id']}
-                            """,
-                            color=color,
-                            fill=True,
-                            fill_color=color,
-                            fill_opacity=0.2,
-                            weight=2,
-                            tooltip=stop['stop_name']
-                        ).add_to(line_group)
+            # Estaciones que pertenecen a esta línea, ya calculadas en el índice
+            line_stops = self.stops_by_line.get(route_name, self.data['stops'].iloc[0:0])
+            line_stops = line_stops.reindex(columns=['stop_name', 'stop_desc', 'zone_id', 'stop_lat', 'stop_lon'])
+            
+            for name, desc, zone, lat, lon in line_stops.itertuples(index=False, name=None):
+                # Añadimos las coordenadas para la línea
+                line_coordinates.append([lat, lon])
+                
+                # Creamos el marcador para la estación
+                folium.CircleMarker(
+                    location=[lat, lon],
+                    radius=8,
+                    popup=f"""
+                        <b>{name}</b><br>
+                        {desc}<br>
+                        Zona: {zone}
+                    """,
+                    color=color,
+                    fill=True,
+                    fill_color=color,
+                    fill_opacity=0.2,
+                    weight=2,
+                    tooltip=name
+                ).add_to(line_group)
             
             # Ordenamos las coordenadas y dibujamos las líneas
             if len(line_coordinates) > 1:
-                ordered_coordinates = self._order_coordinates(line_coordinates)
+                # Orden real del feed si lo hay; si no, por cercanía
+                ordered_coordinates = self.line_sequences.get(route_name) or self._order_coordinates(line_coordinates)
                 folium.PolyLine(
                     locations=ordered_coordinates,
                     weight=3,
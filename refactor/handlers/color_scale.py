@@ -0,0 +1,89 @@
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+import matplotlib.colors as mcolors
+from matplotlib.colors import LinearSegmentedColormap
+
+@lru_cache(maxsize=None)
+def _rgb_table(colors, size):
+    """Tabla RGB (uint8) de una paleta, calculada una vez por paleta"""
+    cmap = LinearSegmentedColormap.from_list('_'.join(colors), list(colors), N=size)
+    return np.rint(cmap(np.arange(size))[:, :3] * 255).astype(np.uint8)
+
+
+@lru_cache(maxsize=None)
+def _lookup_table(colors, size):
+    """Tabla de colores hexadecimales de una paleta, calculada una vez por paleta"""
+    return np.array([mcolors.rgb2hex(rgb / 255) for rgb in _rgb_table(colors, size)])
+
+
+def normalize(values, norm='linear', vmin=None, vmax=None):
+    """Llevar valores a [0, 1].
+
+    - 'linear': proporcional entre el mínimo y el máximo.
+    - 'log': igual, pero sobre log(1 + x); útil con distribuciones muy sesgadas.
+    - 'quantile': posición de cada valor en la distribución (percentil).
+
+    Si todos los valores son iguales se devuelve 0. Los NaN se mantienen.
+    """
+    values = np.asarray(values, dtype='float64')
+
+    if norm == 'quantile':
+        ranks = pd.Series(values).rank(method='average').to_numpy()
+        count = np.count_nonzero(~np.isnan(values))
+        if count <= 1:
+            return np.where(np.isnan(values), np.nan, 0.0)
+        return (ranks - 1) / (count - 1)
+
+    if norm == 'log':
+        values = np.log1p(np.clip(values, 0, None))
+        vmin = None if vmin is None else np.log1p(max(vmin, 0))
+        vmax = None if vmax is None else np.log1p(max(vmax, 0))
+    elif norm != 'linear':
+        raise ValueError(f"Normalización desconocida: {norm}")
+
+    if np.all(np.isnan(values)):
+        return values
+
+    low = np.nanmin(values) if vmin is None else vmin
+    high = np.nanmax(values) if vmax is None else vmax
+    if high <= low:
+        return np.where(np.isnan(values), np.nan, 0.0)
+    return np.clip((values - low) / (high - low), 0, 1)
+
+
+def scale_range(values, out_min, out_max, norm='linear', vmin=None, vmax=None):
+    """Escalar valores al rango [out_min, out_max] (por ejemplo, radios de marcadores)"""
+    return out_min + normalize(values, norm, vmin, vmax) * (out_max - out_min)
+
+
+class ColorScale:
+    """Escala de colores reutilizable que convierte arrays de valores en colores hex.
+
+    La paleta se interpola una sola vez en una tabla de `size` colores y cada
+    llamada solo calcula índices sobre esa tabla.
+    """
+
+    def __init__(self, colors=('green', 'yellow', 'red'), norm='linear', size=256, nan_color='#808080'):
+        self.colors = tuple(colors)
+        self.norm = norm
+        self.size = size
+        self.nan_color = nan_color
+        self.table = _lookup_table(self.colors, size)
+
+    def _indices(self, values, vmin=None, vmax=None):
+        normalized = normalize(values, self.norm, vmin, vmax)
+        # Mismo criterio que matplotlib para pasar de [0, 1] a una entrada de la tabla
+        index = np.clip((np.nan_to_num(normalized) * self.size).astype(int), 0, self.size - 1)
+        return index, np.isnan(normalized)
+
+    def __call__(self, values, vmin=None, vmax=None):
+        index, missing = self._indices(values, vmin, vmax)
+        colors = self.table[index]
+        colors[missing] = self.nan_color
+        return colors
+
+    def rgb(self, values, vmin=None, vmax=None):
+        """Colores como array RGB uint8 (mismas dimensiones que `values` más una)"""
+        index, _ = self._indices(np.ravel(values), vmin, vmax)
+        return _rgb_table(self.colors, self.size)[index].reshape(np.shape(values) + (3,))
@@ -2,21 +2,29 @@ import plotly.graph_objects as go
 import seaborn as sns
 import matplotlib.pyplot as plt
 import plotly.express as px
-from dash import html, dcc
+from dash import html
 import folium
 from folium.plugins import MarkerCluster
+from .figure_store import graphs
 
 class CrimeVisualization:
-    def __init__(self, crime_data, gdf):
+    # Radio de los círculos por incidente (metros)
+    METROS_POR_INCIDENTE = 10
+
+    def __init__(self, crime_data, gdf, figure_store=None):
         self.crimes_data = crime_data
         self.gdf = gdf
+        # FigureStore opcional con las figuras ya serializadas
+        self.figure_store = figure_store
 
     def get_all_graphs(self):
+        return html.Div(graphs(self.figure_store, self.get_figures))
+
+    def get_figures(self):
         numeric_columns = self.crimes_data.select_dtypes(include=['int64', 'float64'])
 
         correlation_matrix = numeric_columns.corr()
         fig_corr = px.imshow(correlation_matrix, text_auto=True, title="Matriz de Correlación entre Tipos de Incidentes")
-        fig_corr.show()
 
         fig1 = px.bar(
             self.crimes_data,
@@ -57,39 +65,42 @@ class CrimeVisualization:
             barmode="stack"
         )
 
-        return html.Div([
-            dcc.Graph(figure=fig_corr),
-            dcc.Graph(figure=fig1),
-            dcc.Graph(figure=fig2),
-            dcc.Graph(figure=fig3)
-        ])
+        return fig_corr, fig1, fig2, fig3
     
     def get_map(self, crimen):
-        if self.gdf.crs is None or self.gdf.crs.to_string() != "EPSG:4326":
-            self.gdf = self.gdf.to_crs(epsg=4326)
-
-        self.gdf["TOTAL INCIDENTES FILTRADOS"] = self.crimes_data[crimen]
-
-        self.gdf["centroid"] = self.gdf.geometry.centroid
-        self.gdf["latitude"] = self.gdf["centroid"].y
-        self.gdf["longitude"] = self.gdf["centroid"].x
+        # Copia local: el handler se comparte entre peticiones y no se modifica
+        gdf = self.gdf
+        if gdf.crs is None or gdf.crs.to_string() != "EPSG:4326":
+            gdf = gdf.to_crs(epsg=4326)
+
+        centroid = gdf.geometry.centroid
+        gdf = gdf.assign(**{
+            "TOTAL INCIDENTES FILTRADOS": self.crimes_data[crimen],
+            "latitude": centroid.y,
+            "longitude": centroid.x
+        })
 
         map_center = [
-            self.gdf["latitude"].mean(),
-            self.gdf["longitude"].mean()
+            gdf["latitude"].mean(),
+            gdf["longitude"].mean()
         ]
 
         folium_map = folium.Map(location=map_center, zoom_start=12)
 
-        for _, row in self.gdf.iterrows():
-            if not (row["latitude"] and row["longitude"]) or row["TOTAL INCIDENTES FILTRADOS"] <= 0:
-                continue
-            
-            scaled_radius = max(row["TOTAL INCIDENTES FILTRADOS"], 1) * 10
+        valores = gdf["TOTAL INCIDENTES FILTRADOS"]
+        visibles = gdf[
+            gdf["latitude"].notna() & (gdf["latitude"] != 0)
+            & gdf["longitude"].notna() & (gdf["longitude"] != 0)
+            & (valores > 0)
+        ]
+
+        # Radio proporcional a los incidentes (METROS_POR_INCIDENTE por incidente)
+        radios = visibles["TOTAL INCIDENTES FILTRADOS"].clip(lower=1).to_numpy(dtype=float) * self.METROS_POR_INCIDENTE
 
+        for row, radio in zip(visibles.to_dict('records'), radios):
             folium.Circle(
                 location=[row["latitude"], row["longitude"]],
-                radius=scaled_radius,
+                radius=radio,
                 color="red",
                 fill=True,
                 fill_color="red",
@@ -0,0 +1,137 @@
+import os
+import pandas as pd
+import geopandas as gpd
+import pyarrow.parquet as pq
+
+# Tipos de cada dataset limpio. Las columnas de texto con pocos valores
+# distintos se guardan como categorías y las coordenadas como float32.
+SCHEMAS = {
+    'listings': {
+        'id': 'int64',
+        'row_hash': 'uint64',
+        'host_id': 'int64',
+        'neighbourhood': 'category',
+        'neighbourhood_group': 'category',
+        'room_type': 'category',
+        'property_type': 'category',
+        'latitude': 'float32',
+        'longitude': 'float32',
+        'price': 'float64',
+        'minimum_nights': 'int32',
+        'maximum_nights': 'int32',
+        'number_of_reviews': 'int32',
+        'availability_365': 'int16',
+        'accommodates': 'int16',
+        'm2': 'float32',
+        'review_scores_rating': 'float32',
+    },
+    'district_stats': {
+        'neighbourhood_group': 'category',
+        'neighbourhood': 'category',
+        'listings': 'int32',
+        'price_sum': 'float64',
+        'price_count': 'int32',
+        'mean_price': 'float32',
+    },
+    'calendar_listing': {
+        'listing_id': 'int64',
+        'days': 'int32',
+        'availability_rate': 'float32',
+        'mean_price': 'float32',
+    },
+    'calendar_district': {
+        'neighbourhood_group': 'category',
+        'date': 'datetime64[ns]',
+        'days': 'int32',
+        'availability_rate': 'float32',
+        'mean_price': 'float32',
+    },
+    'text_features': {
+        'text_key': 'uint64',
+        'm2': 'float32',
+    },
+    'crimes': {
+        'DISTRITOS': 'string',
+        'RELACIONADAS CON LAS PERSONAS': 'int64',
+        'RELACIONADAS CON EL PATRIMONIO': 'int64',
+        'POR TENENCIA DE ARMAS': 'int64',
+        'POR TENENCIA DE DROGAS': 'int64',
+        'POR CONSUMO DE DROGAS': 'int64',
+    },
+    'metro': {
+        'Line': 'category',
+        'Station': 'string',
+        'Latitude': 'float32',
+        'Longitude': 'float32',
+        'Traffic': 'int64',
+        'Order of Points': 'int32',
+    },
+}
+
+
+def apply_schema(df, name):
+    """Convertir las columnas de un dataset a los tipos de su esquema"""
+    schema = SCHEMAS.get(name, {})
+    dtypes = {col: dtype for col, dtype in schema.items() if col in df.columns}
+    for col, dtype in dtypes.items():
+        if dtype.startswith('datetime'):
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+        elif dtype.startswith('int') and df[col].isna().any():
+            # Las columnas enteras con nulos se quedan como float
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float32')
+        else:
+            df[col] = df[col].astype(dtype)
+    return df
+
+
+class DataStore:
+    """Almacén columnar (Parquet) de los datasets limpios"""
+
+    def __init__(self, base_path):
+        self.base_path = base_path
+        os.makedirs(self.base_path, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.base_path, f'{name}.parquet')
+
+    def exists(self, name):
+        return os.path.exists(self.path(name))
+
+    def write(self, name, df):
+        """Guardar un dataset con los tipos de su esquema"""
+        if isinstance(df, gpd.GeoDataFrame):
+            df.to_parquet(self.path(name), index=False)
+            return
+
+        df = apply_schema(df.copy(), name)
+        df.to_parquet(self.path(name), index=False, engine='pyarrow')
+
+    def read(self, name, columns=None):
+        """Leer un dataset, opcionalmente solo las columnas indicadas"""
+        if columns is not None:
+            # Solo pedimos las columnas que existan en el fichero
+            available = self.columns(name)
+            columns = [col for col in columns if col in available]
+        return pd.read_parquet(self.path(name), columns=columns, engine='pyarrow')
+
+    def read_geo(self, name, columns=None):
+        """Leer un GeoDataFrame guardado como GeoParquet"""
+        return gpd.read_parquet(self.path(name), columns=columns)
+
+    def columns(self, name):
+        return pq.read_schema(self.path(name)).names
+
+    def version(self, *names):
+        """Identificador de la versión de los datasets indicados.
+
+        Cambia cada vez que alguno de ellos se vuelve a escribir, por lo que
+        sirve como clave de las cachés de resultados derivados.
+        """
+        parts = []
+        for name in names:
+            if not self.exists(name):
+                parts.append(f'{name}:0')
+                continue
+            stat = os.stat(self.path(name))
+            parts.append(f'{name}:{stat.st_mtime_ns:x}-{stat.st_size:x}')
+        return '|'.join(parts)
@@ -0,0 +1,299 @@
+import base64
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import folium
+import matplotlib.image as mpimg
+from flask import Response
+from scipy.ndimage import gaussian_filter
+from .color_scale import ColorScale
+
+# Píxeles del lado mayor de la imagen superpuesta
+GRID_SIZE = 512
+
+# Desenfoque gaussiano en píxeles (parecido a radius/blur de Leaflet.heat)
+SIGMA = 4
+
+TILE_SIZE = 256
+MAX_TILES = 1024
+
+# Gradiente por defecto de Leaflet.heat
+HEAT_COLORS = ('blue', 'cyan', 'lime', 'yellow', 'red')
+
+# Valores que se pueden representar
+VALUES = ('price', 'count', 'mean_price')
+
+
+def mercator_y(lat):
+    return np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+
+
+def tile_bounds(z, x, y):
+    """(oeste, sur, este, norte) de una tesela XYZ"""
+    n = 2 ** z
+
+    def lat(row):
+        return float(np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * row / n)))))
+
+    return x / n * 360 - 180, lat(y + 1), (x + 1) / n * 360 - 180, lat(y)
+
+
+def density_grid(lon, lat, weights, bounds, shape, sigma=SIGMA):
+    """Suma de pesos por píxel, suavizada, con el norte en la primera fila.
+
+    Las filas son equidistantes en coordenada Mercator para que la imagen
+    coincida con el mapa de Leaflet sin deformarse.
+    """
+    west, south, east, north = bounds
+    grid, _, _ = np.histogram2d(
+        mercator_y(lat), lon,
+        bins=shape,
+        range=[[mercator_y(south), mercator_y(north)], [west, east]],
+        weights=weights
+    )
+    grid = grid[::-1]
+    return gaussian_filter(grid, sigma) if sigma else grid
+
+
+def encode_png(rgba):
+    buffer = io.BytesIO()
+    mpimg.imsave(buffer, rgba, format='png')
+    return buffer.getvalue()
+
+
+class DensityEngine:
+    """Densidad de alojamientos calculada en el servidor.
+
+    Los alojamientos se agrupan en una rejilla ponderada (por número o por
+    precio), se suavizan con un filtro gaussiano y se colorean con la tabla de
+    ColorScale. El resultado se sirve como imagen superpuesta o como teselas
+    XYZ; en ambos casos el peso de la página no depende del número de
+    alojamientos. Imágenes y teselas se guardan en caché.
+
+    - 'price': densidad ponderada por precio (lo que pintaba Leaflet.heat).
+    - 'count': número de alojamientos.
+    - 'mean_price': precio medio local; la transparencia sigue a la densidad.
+    """
+
+    def __init__(self, listings, colors=HEAT_COLORS, grid_size=GRID_SIZE, sigma=SIGMA,
+                 cache_dir=None, url_prefix='/assets/density'):
+        data = listings[['latitude', 'longitude', 'price', 'neighbourhood_group']].dropna(subset=['latitude', 'longitude'])
+        self.lat = data['latitude'].to_numpy(dtype='float64')
+        self.lon = data['longitude'].to_numpy(dtype='float64')
+        self.price = np.nan_to_num(data['price'].to_numpy(dtype='float64'))
+        self.priced = (data['price'].notna() & (data['price'] > 0)).to_numpy(dtype='float64')
+        self.district = data['neighbourhood_group'].astype(str).to_numpy()
+
+        self.scale = ColorScale(colors)
+        self.grid_size = grid_size
+        self.sigma = sigma
+        self.cache_dir = cache_dir
+        self.url_prefix = url_prefix.rstrip('/')
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        self.version = hashlib.sha1(
+            pd.util.hash_pandas_object(data[['latitude', 'longitude', 'price']], index=False).to_numpy().tobytes()
+        ).hexdigest()[:12]
+
+        self._images = {}
+        self._levels = {}
+        self._tiles = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _weights(self, value):
+        if value == 'count':
+            return np.ones_like(self.lat)
+        return self.price
+
+    def _grids(self, value, mask, bounds, shape):
+        """Rejilla del valor y rejilla de densidad que controla la transparencia"""
+        lon, lat = self.lon[mask], self.lat[mask]
+        if value == 'mean_price':
+            price_sum = density_grid(lon, lat, self.price[mask] * self.priced[mask], bounds, shape, self.sigma)
+            count = density_grid(lon, lat, self.priced[mask], bounds, shape, self.sigma)
+            mean = np.divide(price_sum, count, out=np.zeros_like(count), where=count > 1e-3)
+            return mean, count
+        grid = density_grid(lon, lat, self._weights(value)[mask], bounds, shape, self.sigma)
+        return grid, grid
+
+    @staticmethod
+    def _pixel_area(bounds, shape):
+        west, south, east, north = bounds
+        return (east - west) * (mercator_y(north) - mercator_y(south)) / (shape[0] * shape[1])
+
+    def _colorize(self, grid, alpha_grid, levels):
+        """RGBA: color según el valor y opacidad según la densidad"""
+        (vmin, vmax), alpha_max = levels
+        rgba = np.zeros(grid.shape + (4,), dtype=np.uint8)
+        rgba[..., :3] = self.scale.rgb(np.clip(grid, vmin, vmax), vmin, vmax)
+        alpha = np.sqrt(np.clip(alpha_grid / alpha_max, 0, 1)) if alpha_max > 0 else np.zeros(grid.shape)
+        rgba[..., 3] = np.rint(alpha * 255).astype(np.uint8)
+        return rgba
+
+    @staticmethod
+    def _levels_for(grid, alpha_grid):
+        """Rango de color y densidad máxima (percentiles para ignorar extremos)"""
+        visible = alpha_grid > alpha_grid.max() * 1e-3 if alpha_grid.max() > 0 else np.zeros(grid.shape, bool)
+        if not visible.any():
+            return (0.0, 1.0), 0.0
+        values = grid[visible]
+        vmin = float(np.percentile(values, 1)) if grid is not alpha_grid else 0.0
+        vmax = float(np.percentile(values, 99.5)) or float(values.max()) or 1.0
+        return (vmin, vmax), float(np.percentile(alpha_grid[visible], 99.5)) or float(alpha_grid.max())
+
+    def _bounds(self, mask):
+        lon, lat = self.lon[mask], self.lat[mask]
+        # Margen de tres veces el desenfoque para que no se corte
+        pad_lon = (lon.max() - lon.min()) * 3 * self.sigma / self.grid_size or 0.01
+        pad_lat = (lat.max() - lat.min()) * 3 * self.sigma / self.grid_size or 0.01
+        return (
+            float(lon.min() - pad_lon), float(lat.min() - pad_lat),
+            float(lon.max() + pad_lon), float(lat.max() + pad_lat)
+        )
+
+    def _shape(self, bounds):
+        west, south, east, north = bounds
+        width = east - west
+        height = np.degrees(mercator_y(north) - mercator_y(south))
+        if width >= height:
+            return max(1, int(round(self.grid_size * height / width))), self.grid_size
+        return self.grid_size, max(1, int(round(self.grid_size * width / height)))
+
+    def image(self, value='price', district=None):
+        """PNG y límites [[sur, oeste], [norte, este]] de la densidad (de un distrito)"""
+        key = (value, district)
+        with self.lock:
+            if key in self._images:
+                return self._images[key]
+
+        if value not in VALUES:
+            raise ValueError(f"Valor de densidad desconocido: {value}")
+
+        mask = np.ones(len(self.lat), bool) if district is None else self.district == district
+        if not mask.any():
+            return None
+
+        bounds = self._bounds(mask)
+        shape = self._shape(bounds)
+        grid, alpha_grid = self._grids(value, mask, bounds, shape)
+        levels = self._levels_for(grid, alpha_grid)
+
+        png = encode_png(self._colorize(grid, alpha_grid, levels))
+        west, south, east, north = bounds
+        result = (png, [[south, west], [north, east]])
+
+        with self.lock:
+            self._images[key] = result
+            if district is None:
+                # Niveles de color por unidad de área para que las teselas coincidan
+                area = self._pixel_area(bounds, shape)
+                self._levels[value] = (levels[0] if value == 'mean_price' else tuple(v / area for v in levels[0]), levels[1] / area)
+        return result
+
+    def _image_url(self, png, value, district):
+        """URL del PNG en caché de disco, o data URL si no hay directorio de caché"""
+        if not self.cache_dir:
+            return 'data:image/png;base64,' + base64.b64encode(png).decode('ascii')
+
+        name = hashlib.sha1(f'{self.version}|{value}|{district}'.encode('utf-8')).hexdigest()[:16]
+        path = os.path.join(self.cache_dir, f'{name}.png')
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(png)
+        return f'{self.url_prefix}/{name}.png'
+
+    def overlay(self, value='price', district=None, name='Densidad', opacity=0.8):
+        """Capa ImageOverlay con la densidad; None si no hay alojamientos"""
+        result = self.image(value, district)
+        if result is None:
+            return None
+        png, bounds = result
+        layer = folium.raster_layers.ImageOverlay(
+            image='data:,',
+            bounds=bounds,
+            opacity=opacity,
+            name=name,
+            interactive=False,
+            zindex=1
+        )
+        # folium intentaría abrir como fichero una URL relativa; se asigna después
+        layer.url = self._image_url(png, value, district)
+        return layer
+
+    def tile(self, z, x, y, value='price'):
+        """Tesela PNG de 256x256 píxeles, con los mismos colores a cualquier zoom"""
+        key = (value, z, x, y)
+        with self.lock:
+            if key in self._tiles:
+                self._tiles.move_to_end(key)
+                return self._tiles[key]
+
+        if value not in self._levels:
+            self.image(value)
+        if value not in self._levels:
+            # Sin alojamientos no hay niveles de color: tesela transparente
+            return encode_png(np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8))
+
+        # Se calcula sobre la tesela ampliada con un margen para el desenfoque
+        west, south, east, north = tile_bounds(z, x, y)
+        pad = 3 * self.sigma
+        step_x = (east - west) / TILE_SIZE
+        step_y = (mercator_y(north) - mercator_y(south)) / TILE_SIZE
+        size = TILE_SIZE + 2 * pad
+        padded_south = float(np.degrees(np.arctan(np.sinh(mercator_y(south) - pad * step_y))))
+        padded_north = float(np.degrees(np.arctan(np.sinh(mercator_y(north) + pad * step_y))))
+        bounds = (west - pad * step_x, padded_south, east + pad * step_x, padded_north)
+
+        mask = (
+            (self.lon >= bounds[0]) & (self.lon <= bounds[2])
+            & (self.lat >= bounds[1]) & (self.lat <= bounds[3])
+        )
+        grid, alpha_grid = self._grids(value, mask, bounds, (size, size))
+        grid, alpha_grid = grid[pad:-pad, pad:-pad], alpha_grid[pad:-pad, pad:-pad]
+
+        area = self._pixel_area(bounds, (size, size))
+        color_levels, alpha_level = self._levels[value]
+        if value != 'mean_price':
+            color_levels = tuple(v * area for v in color_levels)
+        png = encode_png(self._colorize(grid, alpha_grid, (color_levels, alpha_level * area)))
+
+        with self.lock:
+            self._tiles[key] = png
+            while len(self._tiles) > MAX_TILES:
+                self._tiles.popitem(last=False)
+        return png
+
+    def tile_layer(self, value='price', route='/tiles/density', name='Densidad', opacity=0.8):
+        """Capa de teselas servidas por `register_density_tiles`"""
+        return folium.TileLayer(
+            tiles=f'{route}/{value}/{{z}}/{{x}}/{{y}}.png?v={self.version}',
+            attr='Inside Airbnb',
+            name=name,
+            overlay=True,
+            opacity=opacity
+        )
+
+
+def register_density_tiles(server, engine, route='/tiles/density'):
+    """Registrar en el servidor Flask de Dash las teselas de densidad.
+
+    `engine` es un DensityEngine o una función que lo devuelve. El parámetro
+    `v` de la URL es la versión de los datos, así que las teselas se pueden
+    guardar en la caché del navegador.
+    """
+    get_engine = engine if callable(engine) else (lambda: engine)
+
+    @server.route(f'{route}/<value>/<int:z>/<int:x>/<int:y>.png')
+    def density_tile(value, z, x, y):
+        if value not in VALUES:
+            return Response(f'Valor de densidad desconocido: {value}', status=404)
+        response = Response(get_engine().tile(z, x, y, value), content_type='image/png')
+        response.headers['Cache-Control'] = 'public, max-age=86400'
+        return response
+
+    return density_tile
@@ -0,0 +1,90 @@
+import re
+import unicodedata
+import numpy as np
+import pandas as pd
+from .general_use import TOURIST_SPOTS
+
+# Radio medio de la Tierra (IUGG); en Madrid la diferencia con la distancia
+# geodésica sobre el elipsoide WGS84 es menor del 0,5 %
+EARTH_RADIUS_KM = 6371.0088
+
+# Columnas con nombre propio que ya usan los gráficos
+DISTANCE_COLUMNS = {
+    'Puerta del Sol': 'distance_to_sol',
+    'Parque del Retiro': 'distance_to_retiro',
+    'Gran Vía': 'distance_to_gran_via',
+}
+
+# Matrices ya calculadas por versión de los datos (se guardan solo las últimas)
+_DISTANCES = {}
+_MAX_VERSIONS = 4
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Distancia en km entre puntos (en grados); los argumentos se combinan por broadcasting"""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(value, dtype='float64')) for value in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def distance_column(name):
+    """Nombre de la columna de distancia a un punto ('Plaza Mayor' -> 'distance_to_plaza_mayor')"""
+    if name in DISTANCE_COLUMNS:
+        return DISTANCE_COLUMNS[name]
+    ascii_name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode('ascii')
+    return 'distance_to_' + re.sub(r'[^a-z0-9]+', '_', ascii_name.lower()).strip('_')
+
+
+def data_version(listings):
+    """Versión de las posiciones de los alojamientos a partir de su contenido"""
+    return int(pd.util.hash_pandas_object(listings[['latitude', 'longitude']], index=True).sum())
+
+
+class POIDistances:
+    """Matriz de distancias (km) alojamientos x puntos de interés.
+
+    Se calcula de una vez con la fórmula del haversine en float64; los
+    alojamientos sin coordenadas tienen distancia NaN.
+    """
+
+    def __init__(self, listings, spots=TOURIST_SPOTS):
+        self.index = listings.index
+        self.names = [spot['name'] for spot in spots]
+        self.columns = [distance_column(name) for name in self.names]
+
+        lat = listings['latitude'].to_numpy(dtype='float64')[:, None]
+        lon = listings['longitude'].to_numpy(dtype='float64')[:, None]
+        spot_lat = np.array([spot['lat'] for spot in spots], dtype='float64')[None, :]
+        spot_lon = np.array([spot['lon'] for spot in spots], dtype='float64')[None, :]
+        self.matrix = haversine(lat, lon, spot_lat, spot_lon)
+
+    def frame(self):
+        """DataFrame con una columna de distancia por punto de interés"""
+        return pd.DataFrame(self.matrix, index=self.index, columns=self.columns)
+
+    def column(self, name):
+        """Distancias a un punto de interés, por nombre"""
+        return pd.Series(self.matrix[:, self.names.index(name)], index=self.index, name=distance_column(name))
+
+    def nearest(self):
+        """Punto de interés más cercano y su distancia"""
+        valid = ~np.isnan(self.matrix).all(axis=1)
+        position = np.argmin(np.where(np.isnan(self.matrix), np.inf, self.matrix), axis=1)
+        names = np.array(self.names, dtype=object)[position]
+        return pd.DataFrame({
+            'nearest_spot': np.where(valid, names, None),
+            'distance_to_nearest_spot': np.where(valid, self.matrix[np.arange(len(self.matrix)), position], np.nan)
+        }, index=self.index)
+
+
+def poi_distances(listings, spots=TOURIST_SPOTS, version=None):
+    """Distancias a los puntos de interés, memoizadas por versión de los datos"""
+    if version is None:
+        version = data_version(listings)
+
+    key = (version, tuple((spot['name'], spot['lat'], spot['lon']) for spot in spots))
+    if key not in _DISTANCES:
+        if len(_DISTANCES) >= _MAX_VERSIONS:
+            del _DISTANCES[next(iter(_DISTANCES))]
+        _DISTANCES[key] = POIDistances(listings, spots)
+    return _DISTANCES[key]
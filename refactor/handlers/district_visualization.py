@@ -1,27 +1,50 @@
-from dash import html, dcc
+from dash import html
 import numpy as np
-from dash import html, dcc
+from dash import html
 import numpy as np
 import plotly.express as px
-from folium.plugins import HeatMap
 import folium
 from branca.colormap import LinearColormap
 
+from .aggregate_cube import aggregate_cube
+from .density import DensityEngine
+from .figure_store import graphs
 from .general_use import add_tourist_spots
+from .geometry import geometry_version, simplified
+from .listings_index import ListingsIndex, viewport_frame
 
 class DistrictVisualization:
-    def __init__(self, listings, gdf):
+    # Columnas de listings que usa esta visualización
+    COLUMNS = [
+        'name', 'neighbourhood', 'neighbourhood_group', 'latitude', 'longitude',
+        'room_type', 'price', 'minimum_nights'
+    ]
+
+    def __init__(self, listings, gdf, layers=None, listings_index=None, density=None, cube=None, figure_store=None, gdf_version=None):
         self.listings = listings
         self.gdf = gdf
+        # LayerRegistry opcional con las capas estáticas compartidas
+        self.layers = layers
+        # Índice espacial de los alojamientos (se crea al usarlo si no se pasa)
+        self.listings_index = listings_index
+        # Densidad rasterizada de los mapas de calor (se crea al usarla si no se pasa)
+        self.density = density
+        # Cubo de agregados por distrito, barrio y tipo de habitación
+        self.cube = cube
+        # FigureStore opcional con las figuras ya serializadas
+        self.figure_store = figure_store
+        # Versión de la geometría de gdf para las cachés de geometry (se calcula al usarla si no se pasa)
+        self.gdf_version = gdf_version
 
     def get_district_info(self, distrito):
-        df_filtered = self.listings[self.listings['neighbourhood_group'] == distrito]
-        avg_price = df_filtered['price'].mean()
-        median_price = df_filtered['price'].median()
-        avg_min_nights = df_filtered['minimum_nights'].mean()
-        avg_n_listings = df_filtered.shape[0]
-        room_type_counts = df_filtered['room_type'].value_counts().reset_index()
-        room_type_counts.columns = ['room_type', 'count']
+        cube = self.get_cube()
+        stats = cube.stats(distrito)
+        avg_price = stats['mean_price']
+        median_price = stats['median_price']
+        p5_price, p95_price = stats['p5_price'], stats['p95_price']
+        avg_min_nights = stats['mean_minimum_nights']
+        avg_n_listings = stats['count']
+        room_type_counts = cube.room_type_counts(distrito)
 
         data = html.Div([
             html.H4(f'Estadísticas para el distrito {distrito}', style={
@@ -51,6 +74,12 @@ class DistrictVisualization:
                             'border': '1px solid #ddd', 
                             'padding': '10px',
                             'background-color': '#f4f4f4'
+                        }),
+                        html.Th('Rango de precios (p5-p95)', style={
+                            'color': '#000', 
+                            'border': '1px solid #ddd', 
+                            'padding': '10px',
+                            'background-color': '#f4f4f4'
                         })
                     ]),
                     html.Tr([
@@ -63,6 +92,11 @@ class DistrictVisualization:
                             'color': '#000', 
                             'border': '1px solid #ddd', 
                             'padding': '10px'
+                        }),
+                        html.Td(f'{p5_price:.2f}€ - {p95_price:.2f}€', style={
+                            'color': '#000', 
+                            'border': '1px solid #ddd', 
+                            'padding': '10px'
                         })
                     ])
                 ], style={
@@ -157,7 +191,13 @@ class DistrictVisualization:
             ])
         ])
 
-        
+        return html.Div([data, *graphs(self.figure_store, self.get_district_figures, distrito)])
+
+    def get_district_figures(self, distrito):
+        """Distribución, precio medio por barrio, histograma y mapa de un distrito"""
+        cube = self.get_cube()
+        # Las distribuciones necesitan las filas del distrito, que el cubo localiza sin recorrer listings
+        df_filtered = self.listings.iloc[cube.rows(distrito)]
         log_price = np.log1p(df_filtered['price'])
 
         fig_violin = px.violin(df_filtered, 
@@ -186,7 +226,7 @@ class DistrictVisualization:
             yaxis=dict(title='Log(Precio)'),
         )
 
-        average = df_filtered.groupby(['neighbourhood'])['price'].mean().reset_index()
+        average = cube.breakdown('neighbourhood', distrito)[['neighbourhood', 'mean_price']].rename(columns={'mean_price': 'price'})
         fig_bar = px.bar(
             average,
             x='neighbourhood',
@@ -234,47 +274,100 @@ class DistrictVisualization:
             yaxis=dict(title='Frecuencia')
         )
 
-        fig_map = px.scatter_mapbox(
-            df_filtered,
-            lat='latitude',
-            lon='longitude',
-            color='price',
-            size='price',
-            hover_name='name',
-            hover_data=['price', 'room_type', 'minimum_nights'],
-            title=f'Mapa de listados en: {distrito}',
-            labels={'price': 'Precio (€)', 'room_type': 'Tipo de habitación', 'minimum_nights': 'Noches mínimas'},
-            zoom=10
-        )
+        fig_map = self.get_district_map_figure(distrito)
+
+        return fig_violin, fig_bar, fig_hist, fig_map
+    
+    def get_gdf_version(self):
+        if self.gdf_version is None:
+            self.gdf_version = geometry_version(self.gdf)
+        return self.gdf_version
+
+    @staticmethod
+    def _center(stats, gdf_filtered):
+        """Centro de los alojamientos del distrito; si ninguno tiene coordenadas, el de sus barrios"""
+        if not (np.isnan(stats['latitude']) or np.isnan(stats['longitude'])):
+            return [stats['latitude'], stats['longitude']]
+        if not gdf_filtered.empty:
+            west, south, east, north = gdf_filtered.total_bounds
+            return [(south + north) / 2, (west + east) / 2]
+        return [40.416775, -3.703790]
+
+    def get_cube(self):
+        if self.cube is None:
+            self.cube = aggregate_cube(self.listings)
+        return self.cube
+
+    def get_density(self):
+        if self.density is None:
+            self.density = DensityEngine(self.listings)
+        return self.density
+
+    def get_listings_index(self):
+        if self.listings_index is None:
+            self.listings_index = ListingsIndex(self.listings)
+        return self.listings_index
+
+    def get_district_map_figure(self, distrito, bbox=None, zoom=10):
+        """Mapa de alojamientos del distrito con solo lo que cae en la vista.
+
+        Sin `bbox` se usa el rectángulo del distrito. Si en la vista hay
+        demasiados alojamientos para el zoom se muestran celdas agregadas.
+        """
+        index = self.get_listings_index()
+        bbox = bbox or index.bounds(distrito)
+        if bbox is None:
+            return px.scatter_mapbox(self.listings.iloc[:0], lat='latitude', lon='longitude', title=f'Mapa de listados en: {distrito}', zoom=zoom)
+
+        mode, visible = viewport_frame(index, self.listings, bbox, zoom, distrito)
+
+        if mode == 'points':
+            fig_map = px.scatter_mapbox(
+                visible,
+                lat='latitude',
+                lon='longitude',
+                color='price',
+                size='price',
+                hover_name='name',
+                hover_data=['price', 'room_type', 'minimum_nights'],
+                title=f'Mapa de listados en: {distrito}',
+                labels={'price': 'Precio (€)', 'room_type': 'Tipo de habitación', 'minimum_nights': 'Noches mínimas'},
+                zoom=zoom
+            )
+        else:
+            fig_map = px.scatter_mapbox(
+                visible,
+                lat='latitude',
+                lon='longitude',
+                color='price',
+                size='count',
+                hover_data=['count', 'price'],
+                title=f'Mapa de listados en: {distrito}',
+                labels={'price': 'Precio medio (€)', 'count': 'Alojamientos'},
+                zoom=zoom
+            )
 
         fig_map.update_layout(
             mapbox_style="open-street-map",
             margin={"r": 0, "t": 30, "l": 0, "b": 0}
         )
+        return fig_map
 
-        return html.Div([
-            data,
-            dcc.Graph(figure=fig_violin),
-            dcc.Graph(figure=fig_bar),
-            dcc.Graph(figure=fig_hist),
-            dcc.Graph(figure=fig_map)
-        ])
-    
     def get_district_cloropleth(self, distrito):
-        # Filtrar los datos por distrito
-        df_filtered = self.listings[self.listings['neighbourhood_group'] == distrito]
-
-        # Calcular el precio promedio por barrio
-        avg_price_by_neighbourhood = df_filtered.groupby('neighbourhood')['price'].mean().reset_index()
-
-        # Filtrar el GeoDataFrame por distrito y unirlo con los precios promedio
-        gdf_filtered = self.gdf[self.gdf['neighbourhood_group'] == distrito]
+        # Precio promedio por barrio y centro del distrito, del cubo de agregados
+        cube = self.get_cube()
+        stats = cube.stats(distrito)
+        avg_price_by_neighbourhood = cube.breakdown('neighbourhood', distrito)[['neighbourhood', 'mean_price']].rename(columns={'mean_price': 'price'})
+
+        # Filtrar el GeoDataFrame (simplificado para el zoom del mapa) por distrito y unirlo con los precios promedio
+        gdf = simplified(self.gdf, zoom=13, version=self.get_gdf_version())
+        gdf_filtered = gdf[gdf['neighbourhood_group'] == distrito]
         gdf_filtered = gdf_filtered.merge(avg_price_by_neighbourhood, left_on='neighbourhood', right_on='neighbourhood')
         gdf_filtered['price'] = gdf_filtered['price'].round(2)
 
         # Crear el mapa base
         m = folium.Map(
-            location=[df_filtered['latitude'].mean(), df_filtered['longitude'].mean()],
+            location=self._center(stats, gdf_filtered),
             zoom_start=13,
             tiles="CartoDB positron"
         )
@@ -287,8 +380,8 @@ class DistrictVisualization:
         '''.format(distrito=distrito)
         m.get_root().html.add_child(folium.Element(title_html))
 
-        # Crear el choropleth usando folium
-        folium.Choropleth(
+        # Crear el choropleth usando folium, con el borde negro de los polígonos
+        choropleth = folium.Choropleth(
             geo_data=gdf_filtered,
             name='choropleth',
             data=gdf_filtered,
@@ -296,31 +389,21 @@ class DistrictVisualization:
             key_on='feature.properties.neighbourhood',
             fill_color='YlGnBu',  # Esquema de colores
             fill_opacity=0.7,
-            line_opacity=0.2,
+            line_opacity=1,
             legend_name='Precio Promedio (€/noche)',
             highlight=True
         ).add_to(m)
 
-        # Agregar un GeoJson con tooltips para mostrar información detallada
-        folium.GeoJson(
-            gdf_filtered,
-            name='Barrios',
-            style_function=lambda feature: {
-                'fillColor': 'transparent',  # Sin relleno adicional
-                'color': 'black',  # Borde de los polígonos
-                'weight': 1,
-                'fillOpacity': 0  # Sin relleno
-            },
-            tooltip=folium.features.GeoJsonTooltip(
-                fields=['neighbourhood', 'price'],
-                aliases=['Barrio:', 'Precio promedio (€/noche):'],
-                localize=True,
-                sticky=True
-            )
-        ).add_to(m)
+        # Tooltips con información detallada sobre la misma capa (la geometría va una sola vez)
+        folium.features.GeoJsonTooltip(
+            fields=['neighbourhood', 'price'],
+            aliases=['Barrio:', 'Precio promedio (€/noche):'],
+            localize=True,
+            sticky=True
+        ).add_to(choropleth.geojson)
 
         # Agregar puntos turísticos
-        add_tourist_spots(m)
+        add_tourist_spots(m, self.layers)
 
         # Agregar control de capas
         folium.LayerControl(collapsed=False).add_to(m)
@@ -328,14 +411,16 @@ class DistrictVisualization:
         return m
 
     def get_district_heatmap(self, distrito):
-        df_filtered = self.listings[self.listings['neighbourhood_group'] == distrito]
-        gdf_filtered = self.gdf[self.gdf['neighbourhood_group'] == distrito]
+        cube = self.get_cube()
+        stats = cube.stats(distrito)
+        gdf = simplified(self.gdf, zoom=13, version=self.get_gdf_version())
+        gdf_filtered = gdf[gdf['neighbourhood_group'] == distrito]
 
-        if df_filtered.empty:
+        if stats['count'] == 0:
             return html.Div(f"No hay datos disponibles para el distrito: {distrito}.")
         
         m = folium.Map(
-            location=[df_filtered['latitude'].mean(), df_filtered['longitude'].mean()],
+            location=self._center(stats, gdf_filtered),
             zoom_start=13,
             tiles="CartoDB positron"
         )
@@ -348,15 +433,11 @@ class DistrictVisualization:
 
         m.get_root().html.add_child(folium.Element(title_html))
         
-        HeatMap(
-            data=df_filtered[['latitude', 'longitude', 'price']].groupby(['latitude', 'longitude']).mean().reset_index().values.tolist(),
-            radius=10,
-            blur=15,
-            max_zoom=1,
-            min_opacity=0.5,
-        ).add_to(m)
+        overlay = self.get_density().overlay('price', district=distrito, name='Mapa de calor')
+        if overlay is not None:
+            overlay.add_to(m)
 
-        avg_price_by_neighbourhood = df_filtered.groupby('neighbourhood')['price'].mean().reset_index()
+        avg_price_by_neighbourhood = cube.breakdown('neighbourhood', distrito)[['neighbourhood', 'mean_price']].rename(columns={'mean_price': 'price'})
         gdf_filtered = gdf_filtered.merge(avg_price_by_neighbourhood, on='neighbourhood')
         gdf_filtered['price'] = gdf_filtered['price'].round(2)
 
@@ -376,6 +457,8 @@ class DistrictVisualization:
             )
         ).add_to(m)
 
-        add_tourist_spots(m)
+        add_tourist_spots(m, self.layers)
+
+        folium.LayerControl().add_to(m)
 
         return m
@@ -0,0 +1,74 @@
+import plotly.io as pio
+from dash import dcc, html
+from .map_cache import MapCache
+
+# Tipos de los id (con patrón) del JSON de las figuras y de su contenedor
+PAYLOAD_TYPE = 'figure-payload'
+GRAPHS_TYPE = 'figure-graphs'
+
+# Callback de cliente que crea los dcc.Graph a partir del JSON guardado: el
+# servidor envía el texto tal cual, sin decodificarlo y volver a codificarlo
+RENDER_GRAPHS = """
+function(payload) {
+    if (!payload) {
+        return window.dash_clientside.no_update;
+    }
+    return JSON.parse(payload).map(function(figure) {
+        return {namespace: 'dash_core_components', type: 'Graph', props: {figure: figure}};
+    });
+}
+"""
+
+class FigureStore(MapCache):
+    """Caché de las figuras de Plotly ya serializadas.
+
+    Cada llamada (handler, método, argumentos, versión de los datos) se
+    construye una sola vez y se guarda como JSON, codificado con orjson si está
+    instalado y con los arrays numéricos en base64 (formato binario de Plotly).
+    Los dos niveles (memoria y disco) son los de MapCache, así que los procesos
+    de los callbacks en segundo plano comparten las figuras. Los argumentos que
+    son funciones (por ejemplo `progress`) no forman parte de la clave. El JSON
+    se envía al navegador sin decodificar (ver `graphs`).
+    """
+
+    def key(self, handler, method, args, kwargs):
+        kwargs = {name: value for name, value in kwargs.items() if not callable(value)}
+        return super().key(handler, method, args, kwargs)
+
+    def _disk_path(self, version, key):
+        return super()._disk_path(version, key)[:-len('.html')] + '.json'
+
+    def method_key(self, method, args, kwargs):
+        return self.key(method.__self__, method.__name__, args, kwargs)
+
+    def payload(self, method, *args, **kwargs):
+        """JSON de la lista de figuras que devuelve un método de un handler"""
+        version = self._version()
+        key = self.method_key(method, args, kwargs)
+
+        payload = self.get(version, key)
+        if payload is None:
+            result = method(*args, **kwargs)
+            figures = result if isinstance(result, (list, tuple)) else [result]
+            payload = '[' + ','.join(pio.to_json(fig, validate=False, engine='auto') for fig in figures) + ']'
+            self.put(version, key, payload)
+        return payload
+
+
+def graphs(store, method, *args, **kwargs):
+    """Componentes con las figuras de `method`, a través de `store` si se pasa.
+
+    Con un FigureStore se devuelve el JSON guardado en un dcc.Store y el
+    callback de cliente RENDER_GRAPHS (registrado en app.py) crea los dcc.Graph
+    en el contenedor con el mismo índice.
+    """
+    if store is None:
+        result = method(*args, **kwargs)
+        figures = result if isinstance(result, (list, tuple)) else [result]
+        return [dcc.Graph(figure=fig) for fig in figures]
+
+    index = store.method_key(method, args, kwargs)
+    return [
+        dcc.Store(id={'type': PAYLOAD_TYPE, 'index': index}, data=store.payload(method, *args, **kwargs)),
+        html.Div(id={'type': GRAPHS_TYPE, 'index': index})
+    ]
@@ -1,52 +1,82 @@
-from shapely.geometry import Polygon, MultiPolygon
 import plotly.express as px
 import plotly.graph_objects as go
 import numpy as np
-from dash import html, dcc
-from geopy.distance import geodesic
+from dash import html
 import folium
-from folium.plugins import HeatMap
+from .aggregate_cube import aggregate_cube
+from .density import DensityEngine
+from .distances import poi_distances
+from .figure_store import graphs
 from .general_use import add_tourist_spots
+from .geometry import boundary_trace, geometry_version, level_for_zoom, neighbourhood_topology, simplified
+from .listings_index import ListingsIndex, viewport_map
+from .quantile_sketch import box_traces
+from .scatter_render import scatter
+
+# Zoom equivalente de los gráficos de Plotly de todo Madrid (~800 px de ancho),
+# usado para simplificar los contornos de los barrios
+BOUNDARY_ZOOM = 11
 
 class GeneralVisualization:
-    def __init__(self, listings, gdf):
+    # Columnas de listings que usa esta visualización
+    COLUMNS = [
+        'name', 'neighbourhood', 'neighbourhood_group', 'latitude', 'longitude',
+        'room_type', 'price', 'm2', 'review_scores_rating'
+    ]
+
+    def __init__(self, listings, gdf, layers=None, listings_index=None, density=None, cube=None, figure_store=None, gdf_version=None, scatter_mode='auto'):
         self.listings = listings
         self.gdf = gdf
-
-    def get_all_graphs(self):
-        fig1 = self.get_alojamientos_por_distrito()
-        fig2 = self.get_tipo_de_habitacion_por_distrito()
-        fig3 = self.get_precio_promedio_por_distrito()
-        fig4 = self.get_violins_plot()
-        fig5 = self.get_dist_precio_por_hab()
-        fig6 = self.get_rel_precio_tam()
-        fig7 = self.get_rel_cal_precio()
-
-        fig_8_1, fig_8_2, fig_8_3 = self.get_rel_precio_dist()
-
-        fig_9 = self.get_corr_matrix()
-
-        return html.Div([
-            dcc.Graph(figure=fig1),
-            dcc.Graph(figure=fig2),
-            dcc.Graph(figure=fig3),
-            dcc.Graph(figure=fig4),
-            dcc.Graph(figure=fig5),
-            dcc.Graph(figure=fig6),
-            dcc.Graph(figure=fig7),
-            dcc.Graph(figure=fig_8_1),
-            dcc.Graph(figure=fig_8_2),
-            dcc.Graph(figure=fig_8_3),
-            dcc.Graph(figure=fig_9)
-        ])
-
+        # LayerRegistry opcional con las capas estáticas compartidas
+        self.layers = layers
+        # Índice espacial de los alojamientos (se crea al usarlo si no se pasa)
+        self.listings_index = listings_index
+        # Densidad rasterizada de los mapas de calor (se crea al usarla si no se pasa)
+        self.density = density
+        # Cubo de agregados con los resúmenes de cuantiles (se crea al usarlo si no se pasa)
+        self.cube = cube
+        # FigureStore opcional con las figuras ya serializadas
+        self.figure_store = figure_store
+        # Versión de la geometría de gdf para las cachés de geometry (se calcula al usarla si no se pasa)
+        self.gdf_version = gdf_version
+        # Modo de los gráficos de dispersión: 'auto', 'full', 'sample' o 'hexbin'
+        self.scatter_mode = scatter_mode
+
+    def get_all_graphs(self, progress=None):
+        """Todos los gráficos (del FigureStore si hay uno); `progress(hechos, total)` se llama tras cada paso"""
+        return html.Div(graphs(self.figure_store, self.get_figures, progress=progress))
+
+    def get_figures(self, progress=None):
+        """Figuras de todos los gráficos, en orden"""
+        steps = [
+            self.get_alojamientos_por_distrito,
+            self.get_tipo_de_habitacion_por_distrito,
+            self.get_precio_promedio_por_distrito,
+            self.get_violins_plot,
+            self.get_dist_precio_por_hab,
+            self.get_rel_precio_tam,
+            self.get_rel_cal_precio,
+            self.get_rel_precio_dist,
+            self.get_corr_matrix
+        ]
+
+        figures = []
+        for i, step in enumerate(steps):
+            result = step()
+            figures.extend(result if isinstance(result, tuple) else [result])
+            if progress is not None:
+                progress(i + 1, len(steps))
+
+        return figures
 
     def get_alojamientos_por_distrito(self):
-        fig = px.scatter(
+        fig = scatter(
             self.listings,
             x='longitude',
             y='latitude',
             color='neighbourhood_group',
+            mode=self.scatter_mode,
+            marker=dict(size=8, opacity=0.7),
             hover_data=['name', 'price', 'room_type', 'neighbourhood'],
             labels={
                 'neighbourhood_group': 'Distrito',
@@ -58,35 +88,8 @@ class GeneralVisualization:
             title='Distribución de Alojamientos por Distrito'
         )
 
-        for _, row in self.gdf.iterrows():
-            geometry = row['geometry']
-            if isinstance(geometry, MultiPolygon):
-                for polygon in geometry.geoms:
-                    lon, lat = polygon.exterior.xy
-                    fig.add_trace(
-                        go.Scatter(
-                            x=list(lon),
-                            y=list(lat),
-                            mode='lines',
-                            line=dict(width=1, color='black'),
-                            name=row['neighbourhood_group'],
-                            hoverinfo='none'
-                        )
-                    )
-            elif isinstance(geometry, Polygon):
-                lon, lat = geometry.exterior.xy
-                fig.add_trace(
-                    go.Scatter(
-                        x=list(lon),
-                        y=list(lat),
-                        mode='lines',
-                        line=dict(width=1, color='black'),
-                        name=row['neighbourhood_group'],
-                        hoverinfo='none'
-                    )
-                )
-
-        fig.update_traces(marker=dict(size=8, opacity=0.7), selector=dict(mode='markers'))
+        fig.add_trace(boundary_trace(self.gdf, zoom=BOUNDARY_ZOOM, version=self.get_gdf_version()))
+
         fig.update_layout(
             legend_title_text='Distrito',
             xaxis=dict(title='Longitud'),
@@ -98,11 +101,13 @@ class GeneralVisualization:
         return fig
     
     def get_tipo_de_habitacion_por_distrito(self):
-        fig = px.scatter(
+        fig = scatter(
             self.listings,
             x='longitude',
             y='latitude',
             color='room_type',
+            mode=self.scatter_mode,
+            marker=dict(size=8, opacity=0.5),
             hover_data=['name', 'price', 'room_type'],
             labels={
                 'room_type': 'Tipo de Habitación',
@@ -112,30 +117,7 @@ class GeneralVisualization:
             title='Tipos de habitación por Distrito'
         )
 
-        fig.update_traces(marker=dict(size=8, opacity=0.5), selector=dict(mode='markers'))
-
-        for _, row in self.gdf.iterrows():
-            geometry = row['geometry']
-            name = row['neighbourhood_group'] if 'neighbourhood_group' in row else "Desconocido"
-            
-            if isinstance(geometry, MultiPolygon):
-                polygons = geometry.geoms
-            else:
-                polygons = [geometry]
-            
-            for polygon in polygons:
-                x, y = polygon.exterior.xy
-
-                fig.add_trace(
-                    go.Scatter(
-                        x=list(x),
-                        y=list(y), 
-                        mode='lines',
-                        line=dict(color='rgba(0, 0, 255, 0.3)', width=1),
-                        name=name,
-                        hoverinfo='none'
-                    )
-                )
+        fig.add_trace(boundary_trace(self.gdf, zoom=BOUNDARY_ZOOM, version=self.get_gdf_version(), line=dict(color='rgba(0, 0, 255, 0.3)', width=1)))
 
         fig.update_layout(
             legend_title_text='Tipo de Habitación',
@@ -149,7 +131,7 @@ class GeneralVisualization:
         return fig
 
     def get_precio_promedio_por_distrito(self):
-        average = self.listings.groupby(['room_type','neighbourhood_group'])['price'].mean().reset_index()
+        average = self.listings.groupby(['room_type','neighbourhood_group'], observed=True)['price'].mean().reset_index()
         fig = px.bar(
             average,
             x='neighbourhood_group',
@@ -195,35 +177,27 @@ class GeneralVisualization:
     def get_violins_plot(self):
         self.listings['log_price'] = np.log1p(self.listings['price'])
 
-        fig = px.box(self.listings, 
-                    x='neighbourhood_group', 
-                    y='log_price',
-                    color='room_type',
-                    title='Precios por tipo de habitación por distrito (escala logarítmica)', 
-                    points='all',
-                    width=1200,
-                    custom_data=['price', 'room_type'],
-                    labels={'neighbourhood_group': 'Distrito', 'log_price': 'Log(Precio)', 'room_type': 'Tipo de Habitación'}
-                )
+        # Cajas precalculadas con los resúmenes de cuantiles del cubo: se envían
+        # cinco números por distrito y tipo en lugar de todos los alojamientos
+        sketches = {}
+        for (distrito, room_type), sketch in self.get_cube().sketches(['neighbourhood_group', 'room_type']).items():
+            sketches.setdefault(room_type, {})[distrito] = sketch
 
-        fig.update_traces(
-            hovertemplate="<br>".join([
-                "Distrito: %{x}",
-                "Tipo de habitación: %{customdata[1]}",
-                "Log(Precio): %{y:.2f}",
-                "Precio Original: %{customdata[0]:,.2f}",
-            ])
-        )
+        fig = go.Figure(box_traces(sketches, transform=np.log1p, colors=px.colors.qualitative.Plotly))
 
         fig.update_layout(
+            title='Precios por tipo de habitación por distrito (escala logarítmica)',
+            width=1200,
+            boxmode='group',
             legend_title_text='Tipo de Habitación',
-            xaxis=dict(title='Distrito'),
+            xaxis=dict(title='Distrito', categoryorder='category ascending'),
+            yaxis=dict(title='Log(Precio)'),
         )
         
         return fig
     
     def get_precio_promedio_por_distrito(self):
-        average = self.listings.groupby(['neighbourhood_group'])['price'].mean().reset_index()
+        average = self.listings.groupby(['neighbourhood_group'], observed=True)['price'].mean().reset_index()
 
         fig = px.bar(
             average,
@@ -264,24 +238,26 @@ class GeneralVisualization:
         return fig
     
     def get_rel_precio_tam(self):
-        fig = px.scatter(
+        fig = scatter(
             self.listings, 
             x='m2', 
             y='log_price', 
             color='room_type',
+            mode=self.scatter_mode,
             hover_data=['name', 'neighbourhood_group', 'neighbourhood'],
             labels={'m2': 'Tamaño (m²)', 'log_price': 'Log(Precio)', 'room_type': 'Tipo de Habitación', 'neighbourhood_group': 'Distrito', 'neighbourhood': 'Barrio'},
             title='Relación entre Precio y Tamaño de los Alojamientos',
             custom_data=['price']  
         )
 
-        fig.update_traces(
-            hovertemplate="<br>".join([
-                "Tamaño (m²): %{x:.2f}", 
-                "Log(Precio): %{y:.2f}€",
-                "Precio Original: %{customdata[0]:,.2f}€",
-            ])
-        )
+        if self.scatter_mode != 'hexbin':
+            fig.update_traces(
+                hovertemplate="<br>".join([
+                    "Tamaño (m²): %{x:.2f}", 
+                    "Log(Precio): %{y:.2f}€",
+                    "Precio Original: %{customdata[0]:,.2f}€",
+                ])
+            )
 
         fig.update_layout(
             legend_title_text='Tipo de Habitación',
@@ -293,11 +269,12 @@ class GeneralVisualization:
         return fig
     
     def get_rel_cal_precio(self):
-        fig = px.scatter(
+        fig = scatter(
             self.listings, 
             x='review_scores_rating', 
             y='log_price', 
             color='room_type',
+            mode=self.scatter_mode,
             labels={'review_scores_rating': 'Calificación', 'price': 'Precio (€)', 'room_type': 'Tipo de Habitación', 'log_price': 'Log(Precio)'},
             title='Relación entre Calificación y Precio'
         )
@@ -305,37 +282,37 @@ class GeneralVisualization:
         return fig
     
     def get_rel_precio_dist(self):
-        puerta_del_sol = (40.416775, -3.703790)
-        retiro = (40.415260, -3.684416)
-        gran_via = (40.420347, -3.705774)
+        # Distancias a todos los puntos turísticos, calculadas una vez por versión de los datos;
+        # se añaden a una copia local porque listings se comparte entre peticiones
+        distances = poi_distances(self.listings)
+        df = self.listings.assign(**distances.frame(), **distances.nearest())
 
-        self.listings['distance_to_sol'] = self.listings.apply(lambda row: geodesic(puerta_del_sol, (row['latitude'], row['longitude'])).km, axis=1)
-        self.listings['distance_to_retiro'] = self.listings.apply(lambda row: geodesic(retiro, (row['latitude'], row['longitude'])).km, axis=1)
-        self.listings['distance_to_gran_via'] = self.listings.apply(lambda row: geodesic(gran_via, (row['latitude'], row['longitude'])).km, axis=1)
-
-        fig_1 = px.scatter(
-            self.listings, 
+        fig_1 = scatter(
+            df, 
             x='distance_to_sol', 
             y='price', 
             color='room_type', 
+            mode=self.scatter_mode,
             title='Relación entre Precio y Distancia a la Puerta del Sol',
             labels={'distance_to_sol': 'Distancia a Puerta del Sol (km)', 'price': 'Precio (€)', 'room_type': 'Tipo de Habitación'}
         )
 
-        fig_2 = px.scatter(
-            self.listings, 
+        fig_2 = scatter(
+            df, 
             x='distance_to_retiro', 
             y='price', 
             color='room_type', 
+            mode=self.scatter_mode,
             title='Relación entre Precio y Distancia al Parque del Retiro',
             labels={'distance_to_retiro': 'Distancia al Parque del Retiro (km)', 'price': 'Precio (€)', 'room_type': 'Tipo de Habitación'}
         )
 
-        fig_3 = px.scatter(
-            self.listings, 
+        fig_3 = scatter(
+            df, 
             x='distance_to_gran_via', 
             y='price', 
             color='room_type', 
+            mode=self.scatter_mode,
             title='Relación entre Precio y Distancia a Gran Vía',
             labels={'distance_to_gran_via': 'Distancia a Gran Vía (km)', 'price': 'Precio (€)', 'room_type': 'Tipo de Habitación'}
         )
@@ -343,7 +320,11 @@ class GeneralVisualization:
         return fig_1, fig_2, fig_3
 
     def get_corr_matrix(self):
-        corr = self.listings[['price', 'm2', 'log_price', 'review_scores_rating', 'distance_to_sol', 'distance_to_retiro', 'distance_to_gran_via']].corr()
+        distances = poi_distances(self.listings).frame()
+        df = self.listings[['price', 'm2', 'log_price', 'review_scores_rating']].join(
+            distances[['distance_to_sol', 'distance_to_retiro', 'distance_to_gran_via']]
+        )
+        corr = df.corr()
 
         fig = go.Figure(data=go.Heatmap(
             z=corr.values,
@@ -365,53 +346,84 @@ class GeneralVisualization:
         return fig
     
     def get_madrid_cloropleth(self):
-        avg_price_by_district = self.listings.groupby('neighbourhood_group')['price'].mean().reset_index()
-        avg_price_by_district.rename(columns={'price': 'avg_price'}, inplace=True)
+        avg_price_by_district = self.listings.groupby('neighbourhood_group', observed=True)['price'].mean()
 
-        gdf_with_prices = self.gdf.merge(avg_price_by_district, left_on='neighbourhood_group', right_on='neighbourhood_group')
+        # Cada barrio toma el precio promedio de su distrito
+        district_prices = self.gdf[['neighbourhood_group']].copy()
+        district_prices['avg_price'] = district_prices['neighbourhood_group'].map(avg_price_by_district)
+        district_prices = district_prices.dropna(subset=['avg_price'])
 
         m = folium.Map(location=[40.416775, -3.703790], zoom_start=12, tiles="CartoDB positron")
 
-        folium.Choropleth(
-            geo_data=gdf_with_prices,
-            data=gdf_with_prices,
+        # Barrios como TopoJSON cuantizado y simplificado para el zoom del mapa
+        topology = neighbourhood_topology(self.gdf, self.get_gdf_version())
+        choropleth = folium.Choropleth(
+            geo_data=topology.topojson(level_for_zoom(12), district_prices),
+            topojson='objects.barrios',
+            data=district_prices,
             columns=['neighbourhood_group', 'avg_price'],
             key_on='feature.properties.neighbourhood_group',
             fill_color='YlGnBu',
             fill_opacity=0.7,
-            line_opacity=0.2,
+            line_color='blue',
+            line_weight=0.5,
             legend_name='Precio promedio (€)'
         ).add_to(m)
 
-        folium.GeoJson(
-            gdf_with_prices,
-            style_function=lambda x: {'fillColor': 'transparent', 'color': 'blue', 'weight': 0.5},
-            tooltip=folium.GeoJsonTooltip(
-                fields=['neighbourhood_group', 'avg_price'],
-                aliases=['Distrito:', 'Precio promedio (€):'],
-                localize=True
-            )
-        ).add_to(m)
+        folium.GeoJsonTooltip(
+            fields=['neighbourhood_group', 'avg_price'],
+            aliases=['Distrito:', 'Precio promedio (€):'],
+            localize=True
+        ).add_to(choropleth.geojson)
+
+        add_tourist_spots(m, self.layers)
 
-        add_tourist_spots(m)
+        folium.LayerControl().add_to(m)
 
         return m
 
-    def get_madrid_heatmap(self):
-        heat_data = self.listings[['latitude', 'longitude', 'price']].dropna()
+    def get_density(self):
+        if self.density is None:
+            self.density = DensityEngine(self.listings)
+        return self.density
+
+    def get_gdf_version(self):
+        if self.gdf_version is None:
+            self.gdf_version = geometry_version(self.gdf)
+        return self.gdf_version
+
+    def get_cube(self):
+        if self.cube is None:
+            self.cube = aggregate_cube(self.listings)
+        return self.cube
+
+    def get_listings_index(self):
+        if self.listings_index is None:
+            self.listings_index = ListingsIndex(self.listings)
+        return self.listings_index
+
+    def get_madrid_listings_map(self, url='/api/listings'):
+        """Mapa de Madrid que pide a la API solo los alojamientos visibles"""
+        m = viewport_map(self.get_listings_index(), url)
+        add_tourist_spots(m, self.layers)
+        folium.LayerControl().add_to(m)
+        return m
 
+    def get_madrid_heatmap(self, tiles=False):
         m = folium.Map(location=[40.416775, -3.703790], zoom_start=12, tiles="CartoDB positron")
 
-        HeatMap(
-            data=heat_data[['latitude', 'longitude', 'price']].values,
-            radius=10,
-            blur=15,
-            max_zoom=1,
-            min_opacity=0.5
-        ).add_to(m)
-
-        avg_price_by_neighbourhood = self.listings.groupby('neighbourhood')['price'].mean().reset_index()
-        gdf_filtered = self.gdf.merge(avg_price_by_neighbourhood, on='neighbourhood')
+        # Densidad calculada en el servidor: una imagen o teselas servidas por
+        # register_density_tiles, en lugar de enviar todos los puntos
+        density = self.get_density()
+        if tiles:
+            density.tile_layer('price', name='Mapa de calor').add_to(m)
+        else:
+            overlay = density.overlay('price', name='Mapa de calor')
+            if overlay is not None:
+                overlay.add_to(m)
+
+        avg_price_by_neighbourhood = self.listings.groupby('neighbourhood', observed=True)['price'].mean().reset_index()
+        gdf_filtered = simplified(self.gdf, zoom=12, version=self.get_gdf_version()).merge(avg_price_by_neighbourhood, on='neighbourhood')
         gdf_filtered['price'] = gdf_filtered['price'].round(2)
 
         folium.GeoJson(
@@ -0,0 +1,381 @@
+import hashlib
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import plotly.graph_objects as go
+from shapely.geometry import Polygon, MultiPolygon
+
+# Número de posiciones de la rejilla de cuantización en cada eje
+QUANTIZATION = 100_000
+
+# Tolerancia de simplificación (grados) de cada nivel; el nivel 0 no simplifica
+TOLERANCES = [0.0, 0.0001, 0.0005, 0.002]
+
+# Decimales de las coordenadas de los GeoDataFrame simplificados (~0,1 m)
+COORDINATE_DECIMALS = 6
+
+# Topologías ya calculadas por versión de la geometría (se guardan solo las últimas)
+_TOPOLOGIES = {}
+_MAX_VERSIONS = 4
+
+
+def level_for_zoom(zoom, tolerances=TOLERANCES):
+    """Nivel más simplificado cuya tolerancia no supera un píxel a ese zoom"""
+    pixel = 360 / (256 * 2 ** zoom)
+    level = 0
+    for i, tolerance in enumerate(tolerances):
+        if tolerance <= pixel:
+            level = i
+    return level
+
+
+def geometry_version(gdf):
+    """Versión de un GeoDataFrame a partir de sus atributos y su geometría"""
+    digest = hashlib.sha1()
+    digest.update(pd.util.hash_pandas_object(gdf.drop(columns=gdf.geometry.name), index=True).to_numpy().tobytes())
+    for wkb in gdf.geometry.to_wkb():
+        digest.update(wkb or b'')
+    return digest.hexdigest()
+
+
+def _polygons(geometry):
+    if isinstance(geometry, Polygon):
+        return [geometry]
+    if isinstance(geometry, MultiPolygon):
+        return list(geometry.geoms)
+    return []
+
+
+def _douglas_peucker(points, tolerance):
+    """Índices que conserva Douglas-Peucker en una polilínea abierta"""
+    n = len(points)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+
+        segment = points[end] - points[start]
+        relative = points[start + 1:end] - points[start]
+        length = np.hypot(*segment)
+        if length == 0:
+            distances = np.hypot(relative[:, 0], relative[:, 1])
+        else:
+            distances = np.abs(segment[0] * relative[:, 1] - segment[1] * relative[:, 0]) / length
+
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            index = start + 1 + farthest
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+
+    return np.flatnonzero(keep)
+
+
+class NeighbourhoodTopology:
+    """Topología de arcos compartidos de los polígonos de barrios.
+
+    Las coordenadas se cuantizan a una rejilla y cada frontera entre dos barrios
+    se guarda una sola vez como arco. Cada nivel simplifica los arcos con
+    Douglas-Peucker sin mover sus extremos, por lo que dos barrios vecinos usan
+    exactamente la misma frontera simplificada y no aparecen huecos entre ellos.
+    Los niveles se pueden obtener como GeoDataFrame o como TopoJSON cuantizado.
+    """
+
+    def __init__(self, gdf, quantization=QUANTIZATION, tolerances=TOLERANCES):
+        if gdf.crs is not None and gdf.crs.to_epsg() != 4326:
+            gdf = gdf.to_crs(epsg=4326)
+
+        self.gdf = gdf
+        self.tolerances = list(tolerances)
+
+        minx, miny, maxx, maxy = gdf.total_bounds
+        self.translate = np.array([minx, miny])
+        self.scale = np.array([
+            (maxx - minx) / (quantization - 1) or 1.0,
+            (maxy - miny) / (quantization - 1) or 1.0
+        ])
+
+        self.arcs = []
+        self.geometries = []
+        self._build()
+
+        self._levels = {}
+        self._frames = {}
+        self._boundaries = {}
+
+    def _quantized_rings(self):
+        """Anillos de cada fila, cuantizados y sin el punto de cierre"""
+        rows = []
+        for geometry in self.gdf.geometry:
+            polygons = []
+            for polygon in _polygons(geometry):
+                rings = []
+                for ring in [polygon.exterior, *polygon.interiors]:
+                    coords = np.asarray(ring.coords)[:, :2]
+                    quantized = np.rint((coords - self.translate) / self.scale).astype(np.int64)
+                    # Quitar puntos repetidos consecutivos que deja la cuantización
+                    changed = np.any(np.diff(quantized, axis=0) != 0, axis=1)
+                    quantized = quantized[np.concatenate([[True], changed])]
+                    points = [tuple(point) for point in quantized.tolist()]
+                    if len(points) > 1 and points[0] == points[-1]:
+                        points = points[:-1]
+                    if len(set(points)) >= 3:
+                        rings.append(points)
+                if rings:
+                    polygons.append(rings)
+            rows.append(polygons)
+        return rows
+
+    @staticmethod
+    def _junctions(rows):
+        """Puntos donde se unen o separan las fronteras de distintos anillos"""
+        neighbours = {}
+        junctions = set()
+        for polygons in rows:
+            for rings in polygons:
+                for points in rings:
+                    seen = set()
+                    n = len(points)
+                    for i, point in enumerate(points):
+                        pair = frozenset((points[i - 1], points[(i + 1) % n]))
+                        if point in seen:
+                            junctions.add(point)
+                        seen.add(point)
+
+                        previous = neighbours.setdefault(point, pair)
+                        if previous != pair:
+                            junctions.add(point)
+        return junctions
+
+    def _arc_reference(self, points, index):
+        """Índice del arco (~i si se recorre al revés), añadiéndolo si es nuevo"""
+        key = tuple(points)
+        if key in index:
+            return index[key]
+        reversed_key = key[::-1]
+        if reversed_key in index:
+            return ~index[reversed_key]
+
+        self.arcs.append(np.array(points, dtype=np.int64))
+        index[key] = len(self.arcs) - 1
+        return index[key]
+
+    def _ring_arcs(self, points, junctions, index):
+        cuts = [i for i, point in enumerate(points) if point in junctions]
+
+        if not cuts:
+            # Anillo sin uniones (por ejemplo una isla): un único arco cerrado
+            # que empieza en su punto mínimo para que sus copias coincidan
+            start = points.index(min(points))
+            rotated = points[start:] + points[:start]
+            return [self._arc_reference(rotated + rotated[:1], index)]
+
+        rotated = points[cuts[0]:] + points[:cuts[0]]
+        offsets = [cut - cuts[0] for cut in cuts] + [len(points)]
+        closed = rotated + rotated[:1]
+        return [
+            self._arc_reference(closed[start:end + 1], index)
+            for start, end in zip(offsets[:-1], offsets[1:])
+        ]
+
+    def _build(self):
+        rows = self._quantized_rings()
+        junctions = self._junctions(rows)
+        index = {}
+        self.geometries = [
+            [[self._ring_arcs(points, junctions, index) for points in rings] for rings in polygons]
+            for polygons in rows
+        ]
+
+    def _simplify_arc(self, arc, tolerance):
+        points = arc * self.scale
+        if np.array_equal(arc[0], arc[-1]) and len(arc) > 3:
+            # Arco cerrado: se divide en el punto más lejano al inicio
+            split = int(np.argmax(np.hypot(*(points - points[0]).T)))
+            first = _douglas_peucker(points[:split + 1], tolerance)
+            second = _douglas_peucker(points[split:], tolerance) + split
+            keep = np.concatenate([first, second[1:]])
+        else:
+            keep = _douglas_peucker(points, tolerance)
+        return arc[keep]
+
+    def level_arcs(self, level):
+        """Arcos cuantizados de un nivel de simplificación"""
+        if level in self._levels:
+            return self._levels[level]
+
+        if level == 0 or self.tolerances[level] == 0:
+            self._levels[level] = self.arcs
+            return self.arcs
+
+        finer = self.level_arcs(level - 1)
+        arcs = [self._simplify_arc(arc, self.tolerances[level]) for arc in self.arcs]
+
+        # Un anillo necesita al menos tres vértices distintos; si la
+        # simplificación lo deja sin ellos, sus arcos se quedan en el nivel anterior
+        for polygons in self.geometries:
+            for rings in polygons:
+                for ring in rings:
+                    if sum(len(arcs[ref if ref >= 0 else ~ref]) - 1 for ref in ring) < 3:
+                        for ref in ring:
+                            arc_index = ref if ref >= 0 else ~ref
+                            arcs[arc_index] = finer[arc_index]
+
+        self._levels[level] = arcs
+        return arcs
+
+    @staticmethod
+    def _ring_points(ring, arcs):
+        points = []
+        for ref in ring:
+            arc = arcs[ref] if ref >= 0 else arcs[~ref][::-1]
+            points.append(arc if not points else arc[1:])
+        return np.concatenate(points)
+
+    def geodataframe(self, level=0):
+        """GeoDataFrame con los mismos atributos y la geometría del nivel indicado"""
+        if level in self._frames:
+            return self._frames[level]
+
+        arcs = [
+            np.round(self.translate + arc * self.scale, COORDINATE_DECIMALS)
+            for arc in self.level_arcs(level)
+        ]
+
+        geometries = []
+        for polygons in self.geometries:
+            shapes = []
+            for rings in polygons:
+                exterior, *interiors = [self._ring_points(ring, arcs) for ring in rings]
+                shapes.append(Polygon(exterior, interiors))
+            if not shapes:
+                geometries.append(None)
+            elif len(shapes) == 1:
+                geometries.append(shapes[0])
+            else:
+                geometries.append(MultiPolygon(shapes))
+
+        frame = self.gdf.copy()
+        frame[self.gdf.geometry.name] = gpd.GeoSeries(geometries, index=self.gdf.index, crs=self.gdf.crs)
+        self._frames[level] = frame
+        return frame
+
+    def districts(self, level=0, by='neighbourhood_group'):
+        """Polígonos de los distritos uniendo los barrios del nivel indicado"""
+        key = ('districts', by, level)
+        if key not in self._frames:
+            self._frames[key] = self.geodataframe(level)[[by, self.gdf.geometry.name]].dissolve(by=by).reset_index()
+        return self._frames[key]
+
+    def boundaries(self, level=0):
+        """Coordenadas (x, y) de los contornos exteriores separadas por None.
+
+        Cada frontera compartida entre dos barrios aparece una sola vez, así
+        que todos los contornos se pueden dibujar con una única traza.
+        """
+        if level in self._boundaries:
+            return self._boundaries[level]
+
+        exterior = {}
+        for polygons in self.geometries:
+            for rings in polygons:
+                for ref in rings[0]:
+                    exterior.setdefault(ref if ref >= 0 else ~ref, None)
+
+        arcs = self.level_arcs(level)
+        x, y = [], []
+        for arc_index in exterior:
+            coords = np.round(self.translate + arcs[arc_index] * self.scale, COORDINATE_DECIMALS)
+            x += coords[:, 0].tolist() + [None]
+            y += coords[:, 1].tolist() + [None]
+
+        self._boundaries[level] = (x, y)
+        return self._boundaries[level]
+
+    def topojson(self, level=0, properties=None, object_name='barrios'):
+        """TopoJSON cuantizado del nivel indicado.
+
+        `properties` es un DataFrame con el mismo índice que el GeoDataFrame de
+        origen (puede contener solo algunas filas); por defecto se usan todas
+        las columnas que no son geometría.
+        """
+        if properties is None:
+            properties = self.gdf.drop(columns=self.gdf.geometry.name)
+
+        positions = self.gdf.index.get_indexer(properties.index)
+        records = properties.astype(object).where(properties.notna(), None).to_dict('records')
+
+        geometries = []
+        used = {}
+        for position, record in zip(positions, records):
+            polygons = self.geometries[position]
+            if not polygons:
+                continue
+            for rings in polygons:
+                for ring in rings:
+                    for ref in ring:
+                        used.setdefault(ref if ref >= 0 else ~ref, len(used))
+
+            # Se renumeran los arcos para incluir solo los que se usan
+            def renumber(ref):
+                return used[ref] if ref >= 0 else ~used[~ref]
+
+            arcs = [[[renumber(ref) for ref in ring] for ring in rings] for rings in polygons]
+            if len(arcs) == 1:
+                geometries.append({'type': 'Polygon', 'arcs': arcs[0], 'properties': record})
+            else:
+                geometries.append({'type': 'MultiPolygon', 'arcs': arcs, 'properties': record})
+
+        level_arcs = self.level_arcs(level)
+        encoded = [None] * len(used)
+        for arc_index, new_index in used.items():
+            arc = level_arcs[arc_index]
+            # Codificación delta: primer punto absoluto y después diferencias
+            encoded[new_index] = np.concatenate([arc[:1], np.diff(arc, axis=0)]).tolist()
+
+        return {
+            'type': 'Topology',
+            'transform': {'scale': self.scale.tolist(), 'translate': self.translate.tolist()},
+            'objects': {object_name: {'type': 'GeometryCollection', 'geometries': geometries}},
+            'arcs': encoded
+        }
+
+
+def neighbourhood_topology(gdf, version=None):
+    """Topología de un GeoDataFrame, memoizada por versión de la geometría"""
+    if version is None:
+        version = geometry_version(gdf)
+
+    if version not in _TOPOLOGIES:
+        if len(_TOPOLOGIES) >= _MAX_VERSIONS:
+            del _TOPOLOGIES[next(iter(_TOPOLOGIES))]
+        _TOPOLOGIES[version] = NeighbourhoodTopology(gdf)
+    return _TOPOLOGIES[version]
+
+
+def simplified(gdf, zoom, version=None):
+    """GeoDataFrame con la geometría simplificada adecuada para un zoom"""
+    return neighbourhood_topology(gdf, version).geodataframe(level_for_zoom(zoom))
+
+
+def boundary_trace(gdf, zoom=None, version=None, name='Barrios', line=None):
+    """Traza de Plotly con los contornos de todos los barrios.
+
+    Las coordenadas se calculan una vez por versión de la geometría y nivel
+    de simplificación (sin simplificar si no se indica zoom).
+    """
+    topology = neighbourhood_topology(gdf, version)
+    x, y = topology.boundaries(0 if zoom is None else level_for_zoom(zoom))
+    return go.Scatter(
+        x=x,
+        y=y,
+        mode='lines',
+        line=line or dict(width=1, color='black'),
+        name=name,
+        hoverinfo='none'
+    )
@@ -0,0 +1,194 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import pyarrow.feather as feather
+
+# Tipos explícitos de las columnas que usamos de cada fichero GTFS. El resto
+# de columnas no se leen.
+GTFS_DTYPES = {
+    'stops': {
+        'stop_id': 'string',
+        'stop_code': 'string',
+        'stop_name': 'string',
+        'stop_desc': 'string',
+        'stop_lat': 'float32',
+        'stop_lon': 'float32',
+        'zone_id': 'string',
+        'location_type': 'float32',
+        'parent_station': 'string',
+    },
+    'routes': {
+        'route_id': 'string',
+        'agency_id': 'string',
+        'route_short_name': 'string',
+        'route_long_name': 'string',
+        'route_type': 'float32',
+        'route_color': 'string',
+        'route_text_color': 'string',
+    },
+    'trips': {
+        'route_id': 'string',
+        'service_id': 'string',
+        'trip_id': 'string',
+        'trip_headsign': 'string',
+        'direction_id': 'float32',
+        'shape_id': 'string',
+    },
+    'stop_times': {
+        'trip_id': 'string',
+        'arrival_time': 'string',
+        'departure_time': 'string',
+        'stop_id': 'string',
+        'stop_sequence': 'int32',
+    },
+}
+
+# Identificadores que se guardan como categorías una vez unidas todas las carpetas
+CATEGORY_COLUMNS = {
+    'stops': ['stop_id', 'zone_id', 'parent_station'],
+    'routes': ['route_id', 'agency_id'],
+    'trips': ['route_id', 'service_id', 'trip_id', 'shape_id'],
+    'stop_times': ['trip_id', 'stop_id'],
+}
+
+# Horas GTFS que se convierten a segundos desde el inicio del día de servicio
+TIME_COLUMNS = ['arrival_time', 'departure_time']
+
+
+def gtfs_time_to_seconds(times):
+    """Convertir horas 'HH:MM:SS' (pueden pasar de 24h) a segundos, -1 si faltan"""
+    seconds = pd.to_timedelta(times, errors='coerce').dt.total_seconds()
+    return seconds.fillna(-1).astype('int32')
+
+
+def format_gtfs_time(seconds):
+    """Formatear segundos desde el inicio del día de servicio como 'HH:MM:SS'"""
+    if seconds < 0:
+        return 'N/A'
+    return f'{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}'
+
+
+def read_gtfs_table(table, path):
+    """Leer un fichero GTFS con los tipos explícitos de su tabla"""
+    dtypes = GTFS_DTYPES[table]
+    return pd.read_csv(path, usecols=lambda col: col in dtypes, dtype=dtypes)
+
+
+class GTFSFeed:
+    """Carga de un feed GTFS repartido en subcarpetas.
+
+    Las carpetas se leen en paralelo con tipos explícitos y cada tabla se une
+    una sola vez. El resultado se guarda como feed compilado (Arrow IPC sin
+    comprimir) que en los siguientes arranques se lee con memory-mapping,
+    mientras los ficheros de origen no cambien.
+    """
+
+    TABLES = list(GTFS_DTYPES)
+
+    def __init__(self, base_path, compiled_path=None, workers=None):
+        self.base_path = base_path
+        self.compiled_path = compiled_path or os.path.join(base_path, '_compiled')
+        self.workers = workers
+
+    def _subdirs(self):
+        compiled = os.path.abspath(self.compiled_path)
+        return sorted(
+            os.path.join(self.base_path, d) for d in os.listdir(self.base_path)
+            if os.path.isdir(os.path.join(self.base_path, d))
+            and os.path.abspath(os.path.join(self.base_path, d)) != compiled
+        )
+
+    def _sources(self):
+        """Ficheros de origen de cada tabla"""
+        sources = {table: [] for table in self.TABLES}
+        for subdir in self._subdirs():
+            for table in self.TABLES:
+                path = os.path.join(subdir, f'{table}.txt')
+                if os.path.exists(path):
+                    sources[table].append(path)
+        return sources
+
+    @staticmethod
+    def _fingerprint(sources):
+        """Ruta, fecha de modificación y tamaño de cada fichero de origen"""
+        fingerprint = {}
+        for table, paths in sources.items():
+            fingerprint[table] = []
+            for path in paths:
+                stat = os.stat(path)
+                fingerprint[table].append([path, stat.st_mtime_ns, stat.st_size])
+        return fingerprint
+
+    def _read_sources(self, sources):
+        """Leer todos los ficheros en paralelo y unir cada tabla de una vez"""
+        jobs = [(table, path) for table, paths in sources.items() for path in paths]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            frames = list(executor.map(lambda job: read_gtfs_table(*job), jobs))
+
+        by_table = {table: [] for table in self.TABLES}
+        for (table, _), frame in zip(jobs, frames):
+            by_table[table].append(frame)
+
+        data = {}
+        for table, table_frames in by_table.items():
+            if table_frames:
+                df = pd.concat(table_frames, ignore_index=True)
+            else:
+                df = pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in GTFS_DTYPES[table].items()})
+            data[table] = self._compact(table, df)
+        return data
+
+    @staticmethod
+    def _compact(table, df):
+        """Pasar a tipos compactos y eliminar duplicados"""
+        for col in TIME_COLUMNS:
+            if col in df.columns:
+                df[col] = gtfs_time_to_seconds(df[col])
+
+        if table == 'stop_times':
+            # Un viaje no repite número de parada: basta con comparar la clave
+            df = df.drop_duplicates(subset=['trip_id', 'stop_sequence'])
+        else:
+            df = df.drop_duplicates()
+
+        for col in CATEGORY_COLUMNS[table]:
+            if col in df.columns:
+                df[col] = df[col].astype('category')
+        return df.reset_index(drop=True)
+
+    def _manifest_path(self):
+        return os.path.join(self.compiled_path, 'manifest.json')
+
+    def _is_compiled(self, fingerprint):
+        if not os.path.exists(self._manifest_path()):
+            return False
+        with open(self._manifest_path()) as f:
+            return json.load(f) == fingerprint
+
+    def compile(self, data, fingerprint):
+        """Guardar el feed compilado"""
+        os.makedirs(self.compiled_path, exist_ok=True)
+        for table, df in data.items():
+            feather.write_feather(df, os.path.join(self.compiled_path, f'{table}.arrow'), compression='uncompressed')
+        with open(self._manifest_path(), 'w') as f:
+            json.dump(fingerprint, f)
+
+    def load_compiled(self):
+        """Leer el feed compilado con memory-mapping"""
+        return {
+            table: feather.read_table(os.path.join(self.compiled_path, f'{table}.arrow'), memory_map=True).to_pandas()
+            for table in self.TABLES
+        }
+
+    def load(self):
+        """Cargar el feed, desde el compilado si está al día"""
+        sources = self._sources()
+        fingerprint = self._fingerprint(sources)
+
+        if self._is_compiled(fingerprint):
+            return self.load_compiled()
+
+        data = self._read_sources(sources)
+        self.compile(data, fingerprint)
+        return data
@@ -0,0 +1,80 @@
+import hashlib
+import json
+import os
+import threading
+import folium
+
+class LayerRegistry:
+    """Registro de capas estáticas compartidas entre mapas.
+
+    Cada capa se serializa una sola vez como GeoJSON en
+    `<assets>/layers/<clave>.<hash>.geojson` y los mapas la cargan por URL en
+    lugar de llevarla incrustada en su HTML, de modo que el navegador la guarda
+    en caché entre mapas y pestañas. El hash del contenido forma parte del
+    nombre del fichero: si los datos cambian, cambia la URL. Las versiones
+    anteriores no se borran al publicar, porque el HTML de los mapas guardado en
+    MapCache puede seguir enlazándolas; `clear` las borra todas.
+    """
+
+    def __init__(self, assets_path, url_prefix='/assets'):
+        self.assets_path = assets_path
+        self.url_prefix = url_prefix.rstrip('/')
+        self.layers_path = os.path.join(assets_path, 'layers')
+        os.makedirs(self.layers_path, exist_ok=True)
+
+        # clave -> (datos de origen, ruta, url, GeoJSON ya leído) de la última publicación
+        self.published = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _serialize(data):
+        """Texto GeoJSON de un GeoDataFrame o de un diccionario"""
+        if hasattr(data, 'to_crs'):
+            return data.to_crs(epsg=4326).to_json(drop_id=False)
+        return json.dumps(data, separators=(',', ':'), ensure_ascii=False)
+
+    def publish(self, key, data):
+        """Guardar la capa si no existe ya y devolver (ruta, url).
+
+        Mientras se pase el mismo objeto de datos no se vuelve a serializar.
+        """
+        return self._publish(key, data)[1:3]
+
+    def _publish(self, key, data):
+        with self.lock:
+            previous = self.published.get(key)
+            if previous is not None and previous[0] is data:
+                return previous
+
+            text = self._serialize(data)
+            digest = hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+            filename = f'{key}.{digest}.geojson'
+            path = os.path.join(self.layers_path, filename)
+
+            if not os.path.exists(path):
+                tmp_path = f'{path}.{os.getpid()}.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(text)
+                os.replace(tmp_path, path)
+
+            url = f'{self.url_prefix}/layers/{filename}'
+            self.published[key] = (data, path, url, json.loads(text))
+            return self.published[key]
+
+    def geojson(self, key, data, **kwargs):
+        """Capa `folium.GeoJson` que el navegador descarga de la URL de la capa"""
+        _, _, url, geojson = self._publish(key, data)
+        # folium recibe el diccionario ya leído (no vuelve a abrir el fichero)
+        # pero la capa sigue enlazando la URL en lugar de incrustar los datos
+        layer = folium.GeoJson(geojson, **kwargs)
+        layer.embed = False
+        layer.embed_link = url
+        return layer
+
+    def clear(self):
+        """Borrar todas las capas publicadas (por ejemplo junto con MapCache.clear)"""
+        with self.lock:
+            self.published.clear()
+            for filename in os.listdir(self.layers_path):
+                if filename.endswith('.geojson'):
+                    os.remove(os.path.join(self.layers_path, filename))
@@ -0,0 +1,55 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+def order_nearest_neighbour(coordinates):
+    """Ordenar puntos uniendo cada uno con el más cercano aún no visitado.
+
+    Usa un KD-tree construido una sola vez: en cada paso se piden los k vecinos
+    más cercanos y se duplica k solo si todos ellos ya están visitados.
+    """
+    if len(coordinates) <= 2:
+        return list(coordinates)
+
+    points = np.asarray(coordinates, dtype='float64')
+    n = len(points)
+    tree = cKDTree(points)
+
+    visited = np.zeros(n, dtype=bool)
+    visited[0] = True
+    order = [0]
+    current = 0
+
+    for _ in range(n - 1):
+        k = 8
+        while True:
+            k = min(k, n)
+            _, neighbours = tree.query(points[current], k=k)
+            candidates = neighbours[~visited[neighbours]]
+            if len(candidates) or k == n:
+                break
+            k *= 2
+
+        current = candidates[0]
+        visited[current] = True
+        order.append(current)
+
+    return [coordinates[i] for i in order]
+
+
+def longest_trip_stops(trip_lines, stop_times):
+    """Paradas, en orden, del viaje más largo de cada línea, en una sola pasada.
+
+    `trip_lines` es una Serie trip_id -> línea y `stop_times` la tabla del feed
+    (con los ids como texto). Devuelve {línea: [stop_id, ...]}; las líneas sin
+    viajes no aparecen.
+    """
+    times = stop_times[stop_times['trip_id'].isin(trip_lines.index)]
+    if times.empty:
+        return {}
+
+    sizes = times.groupby('trip_id', observed=True).size()
+    longest = sizes.groupby(trip_lines.reindex(sizes.index).to_numpy()).idxmax()
+
+    chosen = times[times['trip_id'].isin(longest.to_numpy())].sort_values(['trip_id', 'stop_sequence'])
+    stops_by_trip = chosen.groupby('trip_id', observed=True)['stop_id'].agg(list)
+    return {line: stops_by_trip[trip] for line, trip in longest.items()}
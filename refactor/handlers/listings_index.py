@@ -0,0 +1,294 @@
+import json
+import numpy as np
+import pandas as pd
+import folium
+from branca.element import MacroElement
+from flask import request, Response
+from jinja2 import Template
+from .color_scale import ColorScale
+
+# Tamaño (grados) de las celdas de la rejilla del índice
+CELL_SIZE = 0.005
+
+# A partir de este zoom se devuelven siempre puntos; por debajo, celdas agregadas
+# salvo que en la vista haya pocos alojamientos
+POINTS_ZOOM = 15
+MAX_POINTS = 5000
+
+# Tamaño en píxeles de las celdas agregadas
+AGGREGATE_PIXELS = 24
+
+
+def parse_bbox(text):
+    """'oeste,sur,este,norte' -> (min_lon, min_lat, max_lon, max_lat)"""
+    values = [float(value) for value in text.split(',')]
+    if len(values) != 4:
+        raise ValueError('bbox debe tener cuatro valores: oeste,sur,este,norte')
+    min_lon, min_lat, max_lon, max_lat = values
+    return min(min_lon, max_lon), min(min_lat, max_lat), max(min_lon, max_lon), max(min_lat, max_lat)
+
+
+class ListingsIndex:
+    """Índice espacial en rejilla de los alojamientos.
+
+    Las posiciones se ordenan por celda una sola vez; una consulta por
+    rectángulo solo recorre las celdas que lo cubren. Según el zoom devuelve
+    los puntos visibles o agregados por celdas de tamaño fijo en pantalla.
+    """
+
+    def __init__(self, listings, cell_size=CELL_SIZE):
+        valid = listings['latitude'].notna() & listings['longitude'].notna()
+        self.positions = np.flatnonzero(valid.to_numpy())
+
+        self.lat = listings['latitude'].to_numpy(dtype='float64')[self.positions]
+        self.lon = listings['longitude'].to_numpy(dtype='float64')[self.positions]
+        self.price = listings['price'].to_numpy(dtype='float64')[self.positions]
+        self.district = listings['neighbourhood_group'].astype(str).to_numpy()[self.positions]
+
+        self.cell_size = cell_size
+        self.origin = (self.lon.min(initial=0), self.lat.min(initial=0))
+        self.columns_count = int((self.lon.max(initial=0) - self.origin[0]) // cell_size) + 1
+        self.rows_count = int((self.lat.max(initial=0) - self.origin[1]) // cell_size) + 1
+
+        cells = self._cell(self.lon, self.lat)
+        self.order = np.argsort(cells, kind='stable')
+        self.sorted_cells = cells[self.order]
+
+        # Rango de precios (p5-p95) para los colores del cliente
+        prices = self.price[~np.isnan(self.price)]
+        self.price_range = tuple(np.percentile(prices, [5, 95]).tolist()) if len(prices) else (0.0, 1.0)
+
+    def _cell_xy(self, lon, lat):
+        x = np.clip(((lon - self.origin[0]) // self.cell_size).astype(int), 0, self.columns_count - 1)
+        y = np.clip(((lat - self.origin[1]) // self.cell_size).astype(int), 0, self.rows_count - 1)
+        return x, y
+
+    def _cell(self, lon, lat):
+        x, y = self._cell_xy(lon, lat)
+        return y * self.columns_count + x
+
+    def _candidates(self, bbox):
+        """Índices internos de las celdas que cubren el rectángulo"""
+        min_lon, min_lat, max_lon, max_lat = bbox
+        (x0, x1), (y0, y1) = self._cell_xy(np.array([min_lon, max_lon]), np.array([min_lat, max_lat]))
+
+        # En cada fila de la rejilla las celdas x0..x1 son contiguas en el orden
+        row_starts = np.arange(y0, y1 + 1) * self.columns_count
+        starts = np.searchsorted(self.sorted_cells, row_starts + x0, side='left')
+        ends = np.searchsorted(self.sorted_cells, row_starts + x1, side='right')
+        if not len(starts):
+            return np.empty(0, dtype=int)
+        return np.concatenate([self.order[start:end] for start, end in zip(starts, ends)])
+
+    def _select(self, bbox, district=None):
+        candidates = self._candidates(bbox)
+        min_lon, min_lat, max_lon, max_lat = bbox
+        inside = (
+            (self.lon[candidates] >= min_lon) & (self.lon[candidates] <= max_lon)
+            & (self.lat[candidates] >= min_lat) & (self.lat[candidates] <= max_lat)
+        )
+        if district is not None:
+            inside &= self.district[candidates] == district
+        return np.sort(candidates[inside])
+
+    def rows(self, bbox, district=None):
+        """Posiciones (en el DataFrame original) de los alojamientos del rectángulo"""
+        return self.positions[self._select(bbox, district)]
+
+    def bounds(self, district=None):
+        """Rectángulo que contiene los alojamientos (de un distrito)"""
+        mask = slice(None) if district is None else self.district == district
+        lon, lat = self.lon[mask], self.lat[mask]
+        if not len(lon):
+            return None
+        return lon.min(), lat.min(), lon.max(), lat.max()
+
+    def query(self, bbox, zoom, district=None):
+        """Alojamientos visibles: puntos o celdas agregadas según el zoom.
+
+        Devuelve un diccionario con `mode` ('points' o 'cells') y arrays:
+        lon, lat y price para los puntos; lon, lat (centro de masas), count y
+        mean_price para las celdas.
+        """
+        selected = self._select(bbox, district)
+
+        if zoom >= POINTS_ZOOM or len(selected) <= MAX_POINTS:
+            return {
+                'mode': 'points',
+                'rows': self.positions[selected],
+                'lon': self.lon[selected],
+                'lat': self.lat[selected],
+                'price': self.price[selected],
+            }
+
+        cell = AGGREGATE_PIXELS * 360 / (256 * 2 ** zoom)
+        lon, lat, price = self.lon[selected], self.lat[selected], self.price[selected]
+        x = ((lon - bbox[0]) // cell).astype(np.int64)
+        y = ((lat - bbox[1]) // cell).astype(np.int64)
+        _, groups = np.unique(y * (int((bbox[2] - bbox[0]) // cell) + 1) + x, return_inverse=True)
+
+        count = np.bincount(groups)
+        priced = ~np.isnan(price)
+        price_count = np.bincount(groups, weights=priced)
+        price_sum = np.bincount(groups, weights=np.where(priced, price, 0))
+
+        return {
+            'mode': 'cells',
+            'lon': np.bincount(groups, weights=lon) / count,
+            'lat': np.bincount(groups, weights=lat) / count,
+            'count': count,
+            'mean_price': np.divide(price_sum, price_count, out=np.full(len(count), np.nan), where=price_count > 0),
+        }
+
+    @staticmethod
+    def encode(result, fmt='geojson'):
+        """Cuerpo y tipo de contenido de la respuesta.
+
+        'binary' son float32 little-endian consecutivos: (lon, lat, precio) por
+        punto o (lon, lat, número, precio medio) por celda.
+        """
+        if result['mode'] == 'points':
+            fields = ['lon', 'lat', 'price']
+        else:
+            fields = ['lon', 'lat', 'count', 'mean_price']
+
+        if fmt == 'binary':
+            values = np.column_stack([result[field] for field in fields]).astype('<f4')
+            return values.tobytes(), 'application/octet-stream'
+
+        properties = fields[2:]
+        columns = [np.round(result[field], 6).tolist() for field in fields[:2]]
+        columns += [[None if np.isnan(value) else value for value in np.asarray(result[field], dtype=float).tolist()] for field in properties]
+
+        features = [
+            {
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [row[0], row[1]]},
+                'properties': dict(zip(properties, row[2:]))
+            }
+            for row in zip(*columns)
+        ]
+        body = json.dumps({'type': 'FeatureCollection', 'mode': result['mode'], 'features': features}, separators=(',', ':'))
+        return body.encode('utf-8'), 'application/geo+json'
+
+
+def register_listings_api(server, index, route='/api/listings'):
+    """Registrar en el servidor Flask de Dash la consulta por rectángulo.
+
+    `index` es un ListingsIndex o una función que lo devuelve (para usar
+    siempre el de la versión actual de los datos). Parámetros de la consulta:
+    bbox=oeste,sur,este,norte, zoom, format=geojson|binary y district opcional.
+    """
+    get_index = index if callable(index) else (lambda: index)
+
+    @server.route(route)
+    def listings_viewport():
+        try:
+            bbox = parse_bbox(request.args['bbox'])
+            zoom = int(float(request.args.get('zoom', POINTS_ZOOM)))
+        except (KeyError, ValueError) as error:
+            return Response(str(error), status=400)
+
+        result = get_index().query(bbox, zoom, request.args.get('district'))
+        body, content_type = ListingsIndex.encode(result, request.args.get('format', 'geojson'))
+
+        response = Response(body, content_type=content_type)
+        response.headers['X-Listings-Mode'] = result['mode']
+        return response
+
+    return listings_viewport
+
+
+class ViewportListings(MacroElement):
+    """Capa de Leaflet que pide al servidor solo los alojamientos visibles.
+
+    Cada vez que se mueve el mapa consulta la API de `register_listings_api` en
+    formato binario y dibuja los puntos (o las celdas agregadas) en canvas.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var map = {{ this._parent.get_name() }};
+            var layer = L.layerGroup().addTo(map);
+            var renderer = L.canvas({padding: 0.2});
+            var palette = {{ this.palette|tojson }};
+            var priceRange = {{ this.price_range|tojson }};
+            var controller = null;
+
+            function color(price) {
+                if (isNaN(price)) { return '#808080'; }
+                var t = (price - priceRange[0]) / (priceRange[1] - priceRange[0] || 1);
+                var i = Math.min(palette.length - 1, Math.max(0, Math.floor(t * palette.length)));
+                return palette[i];
+            }
+
+            function draw(mode, values) {
+                layer.clearLayers();
+                var stride = mode === 'points' ? 3 : 4;
+                for (var i = 0; i < values.length; i += stride) {
+                    var latlng = [values[i + 1], values[i]];
+                    if (mode === 'points') {
+                        L.circleMarker(latlng, {renderer: renderer, radius: 3, weight: 0, fillOpacity: 0.8, fillColor: color(values[i + 2])})
+                            .bindTooltip(values[i + 2].toFixed(0) + ' €')
+                            .addTo(layer);
+                    } else {
+                        L.circleMarker(latlng, {renderer: renderer, radius: 4 + Math.sqrt(values[i + 2]), weight: 1, color: '#333', fillOpacity: 0.6, fillColor: color(values[i + 3])})
+                            .bindTooltip(values[i + 2] + ' alojamientos<br>' + values[i + 3].toFixed(0) + ' € de media')
+                            .addTo(layer);
+                    }
+                }
+            }
+
+            function load() {
+                var b = map.getBounds();
+                var url = {{ this.url|tojson }} + '?format=binary&zoom=' + map.getZoom()
+                    + '&bbox=' + [b.getWest(), b.getSouth(), b.getEast(), b.getNorth()].join(',')
+                    {%- if this.district %} + '&district=' + encodeURIComponent({{ this.district|tojson }}){% endif %};
+
+                if (controller) { controller.abort(); }
+                controller = new AbortController();
+                fetch(url, {signal: controller.signal})
+                    .then(function(response) {
+                        var mode = response.headers.get('X-Listings-Mode');
+                        return response.arrayBuffer().then(function(buffer) { draw(mode, new Float32Array(buffer)); });
+                    })
+                    .catch(function() {});
+            }
+
+            map.on('moveend', load);
+            load();
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, url='/api/listings', price_range=(0, 300), district=None, colors=('green', 'yellow', 'red')):
+        super().__init__()
+        self._name = 'ViewportListings'
+        self.url = url
+        self.price_range = list(price_range)
+        self.district = district
+        self.palette = ColorScale(colors, size=32).table.tolist()
+
+
+def viewport_map(index, url='/api/listings', district=None, zoom_start=12):
+    """Mapa folium que carga los alojamientos visibles desde la API"""
+    bounds = index.bounds(district)
+    center = [40.416775, -3.703790] if bounds is None else [(bounds[1] + bounds[3]) / 2, (bounds[0] + bounds[2]) / 2]
+
+    m = folium.Map(location=center, zoom_start=zoom_start, tiles="CartoDB positron")
+    ViewportListings(url, index.price_range, district).add_to(m)
+    return m
+
+
+def viewport_frame(index, listings, bbox, zoom, district=None):
+    """DataFrame de lo visible para figuras de plotly: filas de listings o celdas agregadas"""
+    result = index.query(bbox, zoom, district)
+    if result['mode'] == 'points':
+        return 'points', listings.iloc[result['rows']]
+    return 'cells', pd.DataFrame({
+        'latitude': result['lat'],
+        'longitude': result['lon'],
+        'count': result['count'],
+        'price': result['mean_price'],
+    })
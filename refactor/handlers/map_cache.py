@@ -0,0 +1,148 @@
+import hashlib
+import os
+import shutil
+import threading
+from collections import OrderedDict
+import folium
+
+class MapCache:
+    """Caché en dos niveles del HTML de los mapas folium de los handlers.
+
+    La clave es (handler, método, argumentos, versión de los datos). El primer
+    nivel es un LRU en memoria limitado en bytes y el segundo guarda el HTML en
+    disco, de modo que sobrevive a los reinicios. `version` puede ser un texto o
+    una función (por ejemplo `lambda: store.version('listings', 'neighbourhoods')`);
+    cuando cambia, las entradas de la versión anterior se descartan.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=256 * 1024 ** 2, version=''):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.version = version
+
+        self.entries = OrderedDict()
+        self.size = 0
+        self.current_version = None
+        self.lock = threading.Lock()
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def _digest(text):
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def _version(self):
+        """Versión actual de los datos; al cambiar se purgan las entradas antiguas"""
+        version = self._digest(str(self.version() if callable(self.version) else self.version))
+        with self.lock:
+            if version != self.current_version:
+                self.current_version = version
+                self.entries.clear()
+                self.size = 0
+                self._purge_disk(version)
+        return version
+
+    def _purge_disk(self, version):
+        """Borrar del disco los directorios de versiones anteriores"""
+        if not self.cache_dir:
+            return
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name != version and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+
+    def key(self, handler, method, args, kwargs):
+        """Clave de una llamada: clase (o nombre) del handler, método y argumentos"""
+        owner = handler if isinstance(handler, str) else type(handler).__qualname__
+        raw = repr((owner, method, tuple(args), sorted(kwargs.items())))
+        return self._digest(raw)
+
+    def _disk_path(self, version, key):
+        return os.path.join(self.cache_dir, version, f'{key}.html')
+
+    def get(self, version, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key][0]
+
+        if not self.cache_dir or not os.path.exists(self._disk_path(version, key)):
+            return None
+
+        with open(self._disk_path(version, key), encoding='utf-8') as f:
+            html = f.read()
+        self._remember(key, html)
+        return html
+
+    def put(self, version, key, html):
+        self._remember(key, html)
+
+        if self.cache_dir:
+            path = self._disk_path(version, key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Escritura atómica: otro proceso nunca lee un fichero a medias
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(html)
+            os.replace(tmp_path, path)
+
+    def _remember(self, key, html):
+        """Guardar en memoria expulsando las entradas menos usadas si no cabe.
+
+        Cada entrada guarda su tamaño en bytes (UTF-8), no en caracteres.
+        """
+        size = len(html.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = (html, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= evicted
+
+    def html(self, method, *args, **kwargs):
+        """HTML (para `srcDoc`) del mapa que devuelve un método de un handler.
+
+        Si el método no devuelve un mapa folium (por ejemplo un aviso de que no
+        hay datos) el resultado se devuelve tal cual y no se guarda.
+        """
+        key = self.key(method.__self__, method.__name__, args, kwargs)
+        return self._cached(key, lambda: method(*args, **kwargs))
+
+    def handler_html(self, name, get_handler, method, *args, **kwargs):
+        """Como `html`, con la clave por nombre del handler.
+
+        `get_handler()` solo se llama si el mapa no está en caché, así que un
+        acierto no construye el handler (útil con los que cargan feeds GTFS).
+        """
+        key = self.key(name, method, args, kwargs)
+        return self._cached(key, lambda: getattr(get_handler(), method)(*args, **kwargs))
+
+    def _cached(self, key, build):
+        version = self._version()
+        html = self.get(version, key)
+        if html is not None:
+            return html
+
+        result = build()
+        if not isinstance(result, folium.Map):
+            return result
+
+        html = result._repr_html_()
+        self.put(version, key, html)
+        return html
+
+    def clear(self):
+        """Vaciar los dos niveles"""
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            self.current_version = None
+        if self.cache_dir:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+            os.makedirs(self.cache_dir, exist_ok=True)
@@ -0,0 +1,145 @@
+import folium
+import pandas as pd
+from folium.utilities import JsCode
+from .color_scale import scale_range
+
+# Radio de las estaciones según su tráfico dentro de la línea
+MIN_RADIUS = 5
+MAX_RADIUS = 30
+
+# Cada estación toma su radio, popup y tooltip de las propiedades del GeoJSON
+ESTACION_DESDE_PROPIEDADES = JsCode("""
+function(feature, layer) {
+    layer.setRadius(feature.properties.radius);
+    layer.bindPopup(feature.properties.popup);
+    layer.bindTooltip(feature.properties.tooltip, {sticky: true});
+}
+""")
+
+# Capas ya calculadas por versión de los datos (se guardan solo las últimas)
+_LAYERS = {}
+_MAX_VERSIONS = 4
+
+
+def ordenar_lineas(linea):
+    """Orden numérico de las líneas ('Linea 2' antes que 'Linea 10')"""
+    return int(linea.replace('Linea ', ''))
+
+
+def data_version(metro_data):
+    """Versión de los datos del metro a partir de su contenido"""
+    return int(pd.util.hash_pandas_object(metro_data, index=False).sum())
+
+
+def _station_features(df_linea):
+    """FeatureCollection con las estaciones de una línea y sus radios"""
+    radii = scale_range(df_linea['Traffic'], MIN_RADIUS, MAX_RADIUS)
+    traffic = df_linea['Traffic'].map('{:,}'.format)
+    station = df_linea['Station'].astype(str)
+
+    popups = 'Estación: ' + station + '<br>Línea: ' + df_linea['Line'].astype(str) + '<br>Tráfico: ' + traffic + ' pasajeros'
+    tooltips = station + ': ' + traffic + ' pasajeros'
+
+    return {
+        'type': 'FeatureCollection',
+        'features': [
+            {
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+                'properties': {'radius': radius, 'popup': popup, 'tooltip': tooltip}
+            }
+            for lon, lat, radius, popup, tooltip in zip(
+                df_linea['Longitude'].astype(float).tolist(), df_linea['Latitude'].astype(float).tolist(),
+                radii.tolist(), popups.tolist(), tooltips.tolist()
+            )
+        ]
+    }
+
+
+def _route_feature(coordinates):
+    """Recorrido de una línea como GeoJSON (coordenadas en orden lon, lat)"""
+    return {
+        'type': 'FeatureCollection',
+        'features': [{
+            'type': 'Feature',
+            'id': 0,
+            'geometry': {'type': 'LineString', 'coordinates': [[lon, lat] for lat, lon in coordinates]},
+            'properties': {}
+        }]
+    }
+
+
+def _build_layers(metro_data, sort_key):
+    ordered = metro_data.sort_values('Order of Points', kind='stable')
+    groups = dict(tuple(ordered.groupby('Line', observed=True, sort=False)))
+
+    layers = []
+    for linea in sorted(groups, key=sort_key):
+        df_linea = groups[linea]
+        coordinates = df_linea[['Latitude', 'Longitude']].astype(float).values.tolist()
+        layers.append((linea, coordinates, _route_feature(coordinates), _station_features(df_linea)))
+    return layers
+
+
+def line_layers(metro_data, sort_key=ordenar_lineas, version=None):
+    """Datos de las capas de cada línea: (línea, coordenadas, recorrido, estaciones).
+
+    Se agrupa por línea una sola vez y el resultado se memoiza por versión de
+    los datos, que por defecto se calcula a partir del contenido.
+    """
+    if version is None:
+        version = data_version(metro_data)
+
+    key = (version, sort_key)
+    if key not in _LAYERS:
+        if len(_LAYERS) >= _MAX_VERSIONS:
+            del _LAYERS[next(iter(_LAYERS))]
+        _LAYERS[key] = _build_layers(metro_data, sort_key)
+    return _LAYERS[key]
+
+
+def add_line_layers(m, metro_data, colors, sort_key=ordenar_lineas, version=None, layers=None):
+    """Añadir al mapa un grupo por línea con su recorrido y sus estaciones.
+
+    Con un LayerRegistry el recorrido y las estaciones de cada línea se cargan
+    por URL como capas compartidas en lugar de incrustarse en el mapa.
+    """
+    for linea, coordinates, route, stations in line_layers(metro_data, sort_key, version):
+        color = colors[linea]
+        line_group = folium.FeatureGroup(name=f'{linea}')
+        layer_name = 'metro_' + str(linea).lower().replace(' ', '_')
+
+        if len(coordinates) > 1 and layers is not None:
+            layers.geojson(
+                f'{layer_name}_recorrido',
+                route,
+                style_function=lambda feature, color=color: {'color': color, 'weight': 3, 'opacity': 0.8},
+                control=False
+            ).add_to(line_group)
+        elif len(coordinates) > 1:
+            folium.PolyLine(
+                locations=coordinates,
+                color=color,
+                weight=3,
+                opacity=0.8
+            ).add_to(line_group)
+
+        options = dict(
+            marker=folium.CircleMarker(
+                radius=MIN_RADIUS,
+                color=color,
+                fill=True,
+                fill_color=color,
+                fill_opacity=0.2,
+                weight=3
+            ),
+            on_each_feature=ESTACION_DESDE_PROPIEDADES,
+            control=False
+        )
+
+        if layers is not None:
+            layers.geojson(layer_name, stations, **options).add_to(line_group)
+        else:
+            folium.GeoJson(stations, **options).add_to(line_group)
+
+        line_group.add_to(m)
@@ -1,14 +1,21 @@
 import folium
 from dash import html
 import pandas as pd
+from .metro_layers import add_line_layers, ordenar_lineas
 
 class MetroMap:
-    def __init__(self, base_path):
+    def __init__(self, base_path, layers=None):
         self.base_path = base_path
+        # LayerRegistry opcional con las capas estáticas compartidas
+        self.layers = layers
         self.df = self._load_data()
         self.colors = self._setup_colors()
 
     def _load_data(self):
+        # El almacén limpio ya guarda las coordenadas y el tráfico como números
+        if self.base_path.endswith('.parquet'):
+            return pd.read_parquet(self.base_path)
+
         # Cargar datos del metro
         df = pd.read_csv(self.base_path)  # Ajusta la ruta según tu estructura
 
@@ -20,7 +27,7 @@ class MetroMap:
     
     # Función auxiliar para ordenar las líneas correctamente
     def ordenar_lineas(self, linea):
-        return int(linea.replace('Linea ', ''))
+        return ordenar_lineas(linea)
     
     def _setup_colors(self):
         # Definir colores para las líneas
@@ -46,50 +53,8 @@ class MetroMap:
             zoom_start=12
         )
 
-        # Creamos las capas para cada línea
-        for linea in sorted(self.df['Line'].unique(), key=self.ordenar_lineas):  # Ordenamos usando la función auxiliar
-            
-            # Creamos un grupo para esta línea
-            line_group = folium.FeatureGroup(name=f'{linea}')
-            
-            # Filtramos y ordenamos las estaciones de esta línea
-            df_linea = self.df[self.df['Line'] == linea].sort_values('Order of Points')
-            
-            # Primero dibujamos las conexiones entre estaciones
-            coordinates = df_linea[['Latitude', 'Longitude']].values.tolist()
-            if len(coordinates) > 1:
-                folium.PolyLine(
-                    locations=coordinates,
-                    color=self.colors[linea],
-                    weight=3,
-                    opacity=0.8
-                ).add_to(line_group)
-            
-            # Calculamos el rango de tráfico para esta línea
-            min_traffic = df_linea['Traffic'].min()
-            max_traffic = df_linea['Traffic'].max()
-            min_radius = 5
-            max_radius = 30
-            
-            # Luego añadimos las estaciones
-            for _, row in df_linea.iterrows():
-                # Calculamos el radio proporcional al tráfico
-                radius = min_radius + (row['Traffic'] - min_traffic) * (max_radius - min_radius) / (max_traffic - min_traffic)
-                
-                # Añadimos el marcador de la estación
-                folium.CircleMarker(
-                    location=[row['Latitude'], row['Longitude']],
-                    radius=radius,
-                    popup=f"Estación: {row['Station']}<br>Línea: {row['Line']}<br>Tráfico: {row['Traffic']:,} pasajeros",
-                    color=self.colors[linea],
-                    fill=True,
-                    fill_color=self.colors[linea],
-                    fill_opacity=0.2,
-                    weight=3,
-                    tooltip=f"{row['Station']}: {row['Traffic']:,} pasajeros"
-                ).add_to(line_group)
-            
-            line_group.add_to(mapa_metro)
+        # Creamos las capas para cada línea: recorrido y estaciones con radio según el tráfico
+        add_line_layers(mapa_metro, self.df, self.colors, layers=self.layers)
 
         # Añadimos el control de capas
         folium.LayerControl(collapsed=False).add_to(mapa_metro)
@@ -1,8 +1,7 @@
 import folium
 from .general_use import add_tourist_spots
-
-def ordenar_lineas(linea):
-    return int(linea.replace('Linea ', ''))
+from .metro_layers import add_line_layers
+from .geometry import geometry_version, simplified
 
 colores_linea = {
     'Linea 1': '#2B7CE9',    # Azul claro
@@ -20,14 +19,25 @@ colores_linea = {
 }
 
 class MetroVisualization:
-    def __init__(self, listings, metro_data, gdf):
+    # Columnas de listings que usa esta visualización
+    COLUMNS = ['neighbourhood', 'price']
+
+    def __init__(self, listings, metro_data, gdf, layers=None, gdf_version=None):
         self.listings = listings
         self.metro_data = metro_data
         self.gdf = gdf
+        # LayerRegistry opcional con las capas estáticas compartidas
+        self.layers = layers
+        # Versión de la geometría de gdf para las cachés de geometry (se calcula al usarla si no se pasa)
+        self.gdf_version = gdf_version
+
+    def get_gdf_version(self):
+        if self.gdf_version is None:
+            self.gdf_version = geometry_version(self.gdf)
+        return self.gdf_version
 
     def add_borders(self, m):
-        folium.GeoJson(
-            self.gdf, 
+        options = dict(
             name="Distritos de Madrid",
             style_function=lambda feature: {
                     'fillOpacity': 0.2,
@@ -39,47 +49,41 @@ class MetroVisualization:
                 aliases=['Distrito:'],
                 localize=True
             )
-        ).add_to(m)
+        )
+
+        gdf = simplified(self.gdf, zoom=12, version=self.get_gdf_version())
+        if self.layers is not None:
+            self.layers.geojson('metro_distritos', gdf, **options).add_to(m)
+        else:
+            folium.GeoJson(gdf, **options).add_to(m)
 
     def add_cloropleth(self, m):
-        avg_price_per_neighbourhood = self.listings.groupby('neighbourhood')['price'].mean().reset_index()
-        avg_price_per_neighbourhood = avg_price_per_neighbourhood.merge(self.gdf, left_on='neighbourhood', right_on='neighbourhood')
+        avg_price_per_neighbourhood = self.listings.groupby('neighbourhood', observed=True)['price'].mean().reset_index()
 
-        folium.Choropleth(
-            geo_data=self.gdf,
+        # Barrios simplificados para el zoom del mapa con el precio formateado para el popup
+        gdf_with_prices = simplified(self.gdf, zoom=12, version=self.get_gdf_version()).merge(avg_price_per_neighbourhood, on='neighbourhood', how='left')
+        gdf_with_prices['price'] = gdf_with_prices['price'].map('{:.2f}'.format).where(gdf_with_prices['price'].notna(), 'Sin datos')
+
+        choropleth = folium.Choropleth(
+            geo_data=gdf_with_prices,
             name='choropleth',
             data=avg_price_per_neighbourhood,
             columns=['neighbourhood', 'price'],
             key_on='feature.properties.neighbourhood',
             fill_color='YlGnBu',
             fill_opacity=0.7,
-            line_opacity=0.2,
+            line_weight=0.5,
+            line_opacity=1,
             legend_name='Precio Promedio (€/noche)',
             highlight=True
         ).add_to(m)
 
-        gdf_with_prices = self.gdf.merge(avg_price_per_neighbourhood, on="neighbourhood")
-        gdf_with_prices["price"] = gdf_with_prices["price"].astype(str).str.replace(',', '.').astype(float)
-        gdf_with_prices["price"] = gdf_with_prices["price"].apply(lambda x: f"{x:.2f}")
-
-        gdf_with_prices = gdf_with_prices.rename(columns={'geometry_x': 'geometry'}).set_geometry('geometry')
-        if 'geometry_y' in gdf_with_prices.columns:
-            gdf_with_prices = gdf_with_prices.drop(columns=['geometry_y'])
-
-        folium.GeoJson(
-            data=gdf_with_prices,
-            style_function=lambda feature: {
-                'fillColor': 'transparent',
-                'color': 'black',
-                'weight': 0.5,
-                'fillOpacity': 0.0,
-            },
-            popup=folium.GeoJsonPopup(
-                fields=['neighbourhood', 'price'],
-                aliases=['Distrito:', 'Precio Promedio (€):'],
-                localize=True
-            )
-        ).add_to(m)
+        # El popup va sobre la propia capa del choropleth: la geometría se incluye una sola vez
+        folium.GeoJsonPopup(
+            fields=['neighbourhood', 'price'],
+            aliases=['Distrito:', 'Precio Promedio (€):'],
+            localize=True
+        ).add_to(choropleth.geojson)
 
     def get_metro_map(self, cloropleth=False):
         m = folium.Map(
@@ -100,43 +104,9 @@ class MetroVisualization:
 
         m.get_root().html.add_child(folium.Element(title_html))
 
-        for linea in sorted(self.metro_data['Line'].unique(), key=ordenar_lineas):  # Ordenamos usando la función auxiliar
-            line_group = folium.FeatureGroup(name=f'{linea}')
-            
-            self.metro_data_linea = self.metro_data[self.metro_data['Line'] == linea].sort_values('Order of Points')
-            
-            coordinates = self.metro_data_linea[['Latitude', 'Longitude']].values.tolist()
-            if len(coordinates) > 1:
-                folium.PolyLine(
-                    locations=coordinates,
-                    color=colores_linea[linea],
-                    weight=3,
-                    opacity=0.8
-                ).add_to(line_group)
-            
-            min_traffic = self.metro_data_linea['Traffic'].min()
-            max_traffic = self.metro_data_linea['Traffic'].max()
-            min_radius = 5
-            max_radius = 30
-            
-            for _, row in self.metro_data_linea.iterrows():
-                radius = min_radius + (row['Traffic'] - min_traffic) * (max_radius - min_radius) / (max_traffic - min_traffic)
-                
-                folium.CircleMarker(
-                    location=[row['Latitude'], row['Longitude']],
-                    radius=radius,
-                    popup=f"Estación: {row['Station']}<br>Línea: {row['Line']}<br>Tráfico: {row['Traffic']:,} pasajeros",
-                    color=colores_linea[linea],
-                    fill=True,
-                    fill_color=colores_linea[linea],
-                    fill_opacity=0.2,
-                    weight=3,
-                    tooltip=f"{row['Station']}: {row['Traffic']:,} pasajeros"
-                ).add_to(line_group)
-            
-            line_group.add_to(m)
+        add_line_layers(m, self.metro_data, colores_linea, layers=self.layers)
 
         folium.LayerControl(collapsed=False).add_to(m)
 
-        add_tourist_spots(m)
+        add_tourist_spots(m, self.layers)
         return m
\ No newline at end of file
@@ -0,0 +1,154 @@
+import numpy as np
+import plotly.graph_objects as go
+
+# Error relativo máximo de los cuantiles
+RELATIVE_ACCURACY = 0.01
+
+
+def gamma_for(accuracy):
+    """Razón entre los límites de dos cubos consecutivos"""
+    return (1 + accuracy) / (1 - accuracy)
+
+
+def bucket_index(values, gamma):
+    """Índice del cubo logarítmico de cada valor positivo"""
+    return np.ceil(np.log(values) / np.log(gamma)).astype(np.int64)
+
+
+class QuantileSketch:
+    """Resumen de cuantiles combinable con error relativo acotado.
+
+    Los valores positivos se cuentan en cubos logarítmicos de razón gamma
+    (como en DDSketch): cualquier cuantil se devuelve con un error relativo
+    menor que `accuracy` y dos resúmenes se combinan sumando sus contadores,
+    así que unir distritos o descargas no obliga a volver a leer los datos.
+    Los valores <= 0 se cuentan aparte y se tratan como 0. También se guardan
+    el mínimo y el máximo exactos.
+    """
+
+    def __init__(self, accuracy=RELATIVE_ACCURACY, counts=None, offset=0, zeros=0,
+                 minimum=np.inf, maximum=-np.inf):
+        self.accuracy = accuracy
+        self.gamma = gamma_for(accuracy)
+        self.counts = np.zeros(0, dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+        self.offset = int(offset)
+        self.zeros = int(zeros)
+        self.minimum = float(minimum)
+        self.maximum = float(maximum)
+
+    @classmethod
+    def from_values(cls, values, accuracy=RELATIVE_ACCURACY):
+        sketch = cls(accuracy)
+        sketch.add(values)
+        return sketch
+
+    @property
+    def count(self):
+        return int(self.counts.sum()) + self.zeros
+
+    def add(self, values):
+        """Añadir valores (se ignoran los NaN)"""
+        values = np.asarray(values, dtype='float64').ravel()
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return self
+
+        self.minimum = min(self.minimum, float(values.min()))
+        self.maximum = max(self.maximum, float(values.max()))
+        positive = values[values > 0]
+        self.zeros += len(values) - len(positive)
+        if len(positive):
+            index = bucket_index(positive, self.gamma)
+            self.merge(QuantileSketch(self.accuracy, np.bincount(index - index.min()), index.min()), inplace=True)
+        return self
+
+    def merge(self, other, inplace=False):
+        """Combinar con otro resumen de la misma precisión"""
+        if other.accuracy != self.accuracy:
+            raise ValueError('Solo se pueden combinar resúmenes con la misma precisión')
+
+        target = self if inplace else QuantileSketch(self.accuracy, self.counts.copy(), self.offset, self.zeros, self.minimum, self.maximum)
+        if len(other.counts):
+            if not len(target.counts):
+                target.counts, target.offset = other.counts.copy(), other.offset
+            else:
+                start = min(target.offset, other.offset)
+                end = max(target.offset + len(target.counts), other.offset + len(other.counts))
+                counts = np.zeros(end - start, dtype=np.int64)
+                counts[target.offset - start:target.offset - start + len(target.counts)] += target.counts
+                counts[other.offset - start:other.offset - start + len(other.counts)] += other.counts
+                target.counts, target.offset = counts, start
+
+        if other is not target:
+            target.zeros += other.zeros
+        target.minimum = min(target.minimum, other.minimum)
+        target.maximum = max(target.maximum, other.maximum)
+        return target
+
+    def __add__(self, other):
+        return self.merge(other)
+
+    def quantile(self, q):
+        """Cuantil(es) q en [0, 1]; NaN si el resumen está vacío"""
+        q = np.asarray(q, dtype='float64')
+        total = self.count
+        if total == 0:
+            return np.full(q.shape, np.nan)
+
+        rank = q * (total - 1)
+        cumulative = self.zeros + np.cumsum(self.counts)
+        bucket = np.searchsorted(cumulative, rank, side='right')
+        value = 2 * self.gamma ** (self.offset + np.minimum(bucket, len(self.counts) - 1)) / (self.gamma + 1)
+        value = np.where(rank < self.zeros, 0.0, value)
+        # El mínimo y el máximo son exactos
+        return np.clip(value, self.minimum, self.maximum)
+
+    def median(self):
+        return float(self.quantile(0.5))
+
+    def box(self, transform=None):
+        """Estadísticos de un diagrama de caja (cuartiles y bigotes de Tukey).
+
+        `transform` (por ejemplo np.log1p) se aplica a los cuantiles, lo que
+        equivale a calcularlos sobre los valores transformados al ser monótona.
+        """
+        values = self.quantile([0.25, 0.5, 0.75])
+        minimum, maximum = self.minimum, self.maximum
+        if transform is not None:
+            values = transform(values)
+            minimum, maximum = transform(minimum), transform(maximum)
+
+        q1, median, q3 = values
+        iqr = q3 - q1
+        return {
+            'q1': float(q1),
+            'median': float(median),
+            'q3': float(q3),
+            'lowerfence': float(max(minimum, q1 - 1.5 * iqr)),
+            'upperfence': float(min(maximum, q3 + 1.5 * iqr)),
+        }
+
+
+def box_traces(sketches, transform=None, colors=None):
+    """Trazas go.Box precalculadas a partir de resúmenes.
+
+    `sketches` es un diccionario {serie: {categoría: QuantileSketch}}; cada
+    serie es una traza (un color) y cada categoría una caja en el eje x. Solo
+    se envían cinco números por caja en lugar de todos los valores.
+    """
+    traces = []
+    for i, (name, by_category) in enumerate(sketches.items()):
+        categories = [category for category, sketch in by_category.items() if sketch.count]
+        stats = [by_category[category].box(transform) for category in categories]
+        traces.append(go.Box(
+            name=str(name),
+            x=categories,
+            q1=[s['q1'] for s in stats],
+            median=[s['median'] for s in stats],
+            q3=[s['q3'] for s in stats],
+            lowerfence=[s['lowerfence'] for s in stats],
+            upperfence=[s['upperfence'] for s in stats],
+            marker_color=None if colors is None else colors[i % len(colors)],
+            offsetgroup=str(name)
+        ))
+    return traces
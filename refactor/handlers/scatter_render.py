@@ -0,0 +1,156 @@
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+# A partir de este número de puntos las trazas se dibujan con WebGL
+WEBGL_THRESHOLD = 1000
+
+# Máximo de puntos del modo 'sample'
+MAX_POINTS = 15000
+
+# A partir de este número de puntos el modo 'auto' pasa a 'sample' (por
+# debajo WebGL dibuja todos los alojamientos sin problema)
+AUTO_MAX_POINTS = 200000
+
+# Hexágonos a lo ancho del gráfico en el modo 'hexbin'
+HEXBIN_GRIDSIZE = 60
+
+# Tamaño (px) de los hexágonos con más alojamientos
+HEXBIN_MAX_SIZE = 14
+
+MODES = ('auto', 'full', 'sample', 'hexbin')
+
+
+def outlier_mask(df, columns):
+    """Filas fuera de las vallas de Tukey (1,5 veces el rango intercuartílico) en alguna columna"""
+    mask = np.zeros(len(df), dtype=bool)
+    for column in columns:
+        values = df[column].to_numpy(dtype='float64')
+        q1, q3 = np.nanpercentile(values, [25, 75])
+        fence = 1.5 * (q3 - q1)
+        mask |= (values < q1 - fence) | (values > q3 + fence)
+    return mask
+
+
+def _extremeness(df, columns):
+    """Distancia de cada fila a la mediana, en rangos intercuartílicos"""
+    score = np.zeros(len(df))
+    for column in columns:
+        values = df[column].to_numpy(dtype='float64')
+        q1, median, q3 = np.nanpercentile(values, [25, 50, 75])
+        score = np.maximum(score, np.abs(values - median) / ((q3 - q1) or 1.0))
+    return score
+
+
+def stratified_sample(df, columns, max_points=MAX_POINTS, by=None, seed=0):
+    """Muestra de como mucho `max_points` filas que conserva los valores atípicos.
+
+    Los atípicos de `columns` se conservan todos (si no caben, los más
+    extremos, hasta la mitad del total). El resto se muestrea por igual en
+    cada grupo de `by`, de modo que cada categoría mantiene su proporción y
+    ninguna desaparece. Las filas conservan su orden original.
+    """
+    if len(df) <= max_points:
+        return df
+
+    outliers = np.flatnonzero(outlier_mask(df, columns))
+    if len(outliers) > max_points // 2:
+        score = _extremeness(df.iloc[outliers], columns)
+        outliers = outliers[np.argsort(-score, kind='stable')[:max_points // 2]]
+
+    rest = np.setdiff1d(np.arange(len(df)), outliers)
+    fraction = (max_points - len(outliers)) / len(rest)
+
+    rng = np.random.default_rng(seed)
+    keys = np.zeros(len(rest), dtype=int) if by is None else pd.factorize(df[by].to_numpy()[rest])[0]
+    chosen = []
+    for key in np.unique(keys):
+        members = rest[keys == key]
+        size = max(1, int(round(len(members) * fraction)))
+        chosen.append(rng.choice(members, size=min(size, len(members)), replace=False))
+
+    return df.iloc[np.sort(np.concatenate([outliers, *chosen]))]
+
+
+def hexbin(df, x, y, by=None, gridsize=HEXBIN_GRIDSIZE):
+    """Número de filas por hexágono (y por grupo de `by`), con el centro de cada hexágono"""
+    columns = [x, y] + ([by] if by else [])
+    data = df[columns].dropna(subset=[x, y])
+    xs = data[x].to_numpy(dtype='float64')
+    ys = data[y].to_numpy(dtype='float64')
+
+    # Coordenadas en unidades de hexágono (lado 1, vértice arriba)
+    x0, y0 = xs.min(), ys.min()
+    sx = (xs.max() - x0) / (gridsize * np.sqrt(3)) or 1.0
+    sy = (ys.max() - y0) / (gridsize * 1.5) or 1.0
+    u, v = (xs - x0) / sx, (ys - y0) / sy
+
+    # Coordenadas axiales y redondeo cúbico al hexágono más cercano
+    q = np.sqrt(3) / 3 * u - v / 3
+    r = 2 / 3 * v
+    cube = np.stack([q, r, -q - r])
+    rounded = np.rint(cube)
+    error = np.abs(rounded - cube)
+    largest = np.argmax(error, axis=0)
+    for axis, (a, b) in enumerate([(1, 2), (0, 2), (0, 1)]):
+        fix = largest == axis
+        rounded[axis, fix] = -rounded[a, fix] - rounded[b, fix]
+    q, r = rounded[0], rounded[1]
+
+    cells = pd.DataFrame({'q': q, 'r': r})
+    if by:
+        cells[by] = data[by].to_numpy()
+    keys = list(cells.columns)
+    counts = cells.groupby(keys, observed=True, sort=False).size().reset_index(name='count')
+
+    counts[x] = x0 + sx * np.sqrt(3) * (counts['q'] + counts['r'] / 2)
+    counts[y] = y0 + sy * 1.5 * counts['r']
+    return counts.drop(columns=['q', 'r'])
+
+
+def scatter(df, x, y, color=None, mode='auto', marker=None, max_points=MAX_POINTS,
+            webgl_threshold=WEBGL_THRESHOLD, auto_max_points=AUTO_MAX_POINTS, **kwargs):
+    """`px.scatter` con WebGL para muchos puntos y, si se pide, muestra o hexágonos.
+
+    - 'full': todos los puntos.
+    - 'sample': muestra estratificada por `color` que conserva los atípicos.
+    - 'hexbin': número de alojamientos por hexágono y categoría.
+    - 'auto': 'full' hasta `auto_max_points` puntos y 'sample' por encima.
+
+    Con más de `webgl_threshold` puntos se usa WebGL, que dibuja sin problema
+    todos los alojamientos de Madrid, así que 'auto' solo reduce los datos con
+    entradas mucho mayores. `marker` se aplica a las trazas de puntos (en 'hexbin' el
+    tamaño depende del número de alojamientos).
+    """
+    if mode not in MODES:
+        raise ValueError(f"Modo de dispersión desconocido: {mode}")
+
+    total = len(df)
+    if mode == 'auto':
+        mode = 'sample' if total > auto_max_points else 'full'
+
+    note = None
+    if mode == 'hexbin':
+        data = hexbin(df, x, y, color)
+        kwargs = {key: value for key, value in kwargs.items() if key in ('title', 'labels', 'category_orders')}
+        kwargs['labels'] = {'count': 'Alojamientos', **kwargs.get('labels', {})}
+        kwargs.update(size='count', size_max=HEXBIN_MAX_SIZE, hover_data={'count': True})
+        note = f'{total:,} alojamientos agregados en hexágonos'
+    elif mode == 'sample' and total > max_points:
+        data = stratified_sample(df, [x, y], max_points, by=color)
+        note = f'Muestra de {len(data):,} de {total:,} alojamientos (se conservan los valores atípicos)'
+    else:
+        data = df
+
+    render_mode = 'webgl' if len(data) > webgl_threshold else 'svg'
+    fig = px.scatter(data, x=x, y=y, color=color, render_mode=render_mode, **kwargs)
+
+    if mode == 'hexbin':
+        fig.update_traces(marker=dict(symbol='hexagon', opacity=(marker or {}).get('opacity', 0.8), line=dict(width=0)))
+    elif marker:
+        fig.update_traces(marker=marker)
+
+    if note:
+        title = fig.layout.title.text or ''
+        fig.update_layout(title_text=f'{title}<br><sup>{note}</sup>')
+    return fig
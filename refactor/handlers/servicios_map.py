@@ -1,8 +1,60 @@
 import folium
 from folium.plugins import MarkerCluster
+from folium.utilities import JsCode
+import numpy as np
 import pandas as pd
 import os
 
+# Popup de cada tipo de servicio: plantilla y columnas que la rellenan
+POPUPS = {
+    "Restaurantes": ("<b>{}</b><br>Cocina: {}<br>Horario: {}<br>Teléfono: {}", ['nombre', 'categorias', 'horario', 'telefono']),
+    "Parques": ("<b>{}</b><br>Equipamiento: {}<br>Horario: {}", ['nombre', 'equipamiento', 'horario']),
+    "Fuentes": ("<b>{}</b><br>Fuente potable disponible.", ['codigo']),
+    "Fuentes mascotas": ("<b>{}</b><br>Fuente para mascotas.", ['codigo']),
+    "Centros de Salud": ("<b>{}</b><br>Descripción: {}<br>Horario: {}<br>Teléfono: {}", ['nombre', 'descripcion', 'horario', 'telefono']),
+}
+
+# Cada punto abre el popup guardado en sus propiedades
+POPUP_DESDE_PROPIEDADES = JsCode("""
+function(feature, layer) {
+    layer.bindPopup(feature.properties.popup, {maxWidth: 300});
+}
+""")
+
+
+def textos_popup(data, tipo):
+    """Texto del popup de cada fila, construido columna a columna"""
+    if tipo not in POPUPS:
+        return np.full(len(data), "Información no disponible.", dtype=object)
+
+    plantilla, columnas = POPUPS[tipo]
+    partes = plantilla.split('{}')
+    texto = np.full(len(data), partes[0])
+    for columna, parte in zip(columnas, partes[1:]):
+        valores = np.asarray(data[columna], dtype=object).astype(str)
+        texto = np.char.add(np.char.add(texto, valores), parte)
+    return texto
+
+
+def puntos_geojson(data, tipo):
+    """FeatureCollection con un punto por fila y su popup como propiedad"""
+    lat = pd.to_numeric(data["latitud"], errors='coerce').to_numpy(dtype=float)
+    lon = pd.to_numeric(data["longitud"], errors='coerce').to_numpy(dtype=float)
+    validos = ~(np.isnan(lat) | np.isnan(lon))
+    popups = textos_popup(data, tipo)[validos]
+
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [x, y]},
+                "properties": {"popup": popup}
+            }
+            for x, y, popup in zip(lon[validos].tolist(), lat[validos].tolist(), popups.tolist())
+        ]
+    }
+
 class ServiciosMap:
     def __init__(self, base_path):
         self.base_path = base_path
@@ -57,13 +109,32 @@ class ServiciosMap:
             ).add_to(cluster)
 
 
-    def generar_mapa(self):
+    @staticmethod
+    def generar_capa_geojson(mapa, data, tipo, icono):
+        """Capa de un tipo de servicio como un único GeoJSON agrupado en el navegador"""
+        cluster = MarkerCluster(name=tipo).add_to(mapa)
+
+        folium.GeoJson(
+            puntos_geojson(data, tipo),
+            marker=folium.Marker(icon=folium.Icon(icon=icono, prefix="fa", color="blue")),
+            on_each_feature=POPUP_DESDE_PROPIEDADES,
+            control=False
+        ).add_to(cluster)
+
+    def generar_mapa(self, modo='geojson'):
+        """Mapa de servicios.
+
+        En modo 'geojson' cada tipo es un GeoJSON con todos sus puntos; el modo
+        'markers' crea un marcador de folium por fila, como antes.
+        """
         # Generamos el mapa de madrid
         mapa = folium.Map([40.428, -3.76], zoom_start=12)
 
+        generar_capa = self.generar_capa_geojson if modo == 'geojson' else self.generar_mapa_tipo
+
         # Iterar sobre los datasets y generar capas en el mapa
         for tipo, df in self.dataframes.items():
-            self.generar_mapa_tipo(mapa, df, tipo, self.iconos.get(tipo, "info-sign"))
+            generar_capa(mapa, df, tipo, self.iconos.get(tipo, "info-sign"))
 
         # Añadir control de capas para alternar entre ellas
         folium.LayerControl().add_to(mapa)
@@ -0,0 +1,173 @@
+import pandas as pd
+from .text_features import TextFeatureExtractor
+
+# Metadatos de la descarga que cambian en todas las filas cada mes y no
+# indican un cambio real del alojamiento
+VOLATILE_COLUMNS = ['scrape_id', 'last_scraped', 'calendar_last_scraped', 'source']
+
+# Columnas de las que dependen los agregados por distrito y barrio
+AGGREGATE_KEYS = ['neighbourhood_group', 'neighbourhood']
+AGGREGATE_COLUMNS = AGGREGATE_KEYS + ['price']
+
+
+def merge_snapshot(listings, details):
+    """Unir listings con las columnas exclusivas de listings_detailed"""
+    common_columns = set(listings.columns).intersection(details.columns)
+    unique_columns_details = [col for col in details.columns if col not in common_columns]
+
+    return pd.merge(
+        listings,
+        details[['id'] + unique_columns_details],
+        on='id',
+        how='inner'
+    )
+
+
+def row_hashes(merged):
+    """Hash de cada fila de la descarga, sin los metadatos volátiles"""
+    columns = sorted(col for col in merged.columns if col not in VOLATILE_COLUMNS and col != 'row_hash')
+    return pd.util.hash_pandas_object(merged[columns], index=False).to_numpy()
+
+
+def clean_listings(merged, store=None, prune=True):
+    """Limpieza de los alojamientos: precio, nombres de zona y características del texto"""
+    listings = merged.copy()
+
+    listings['price'] = listings['price'].replace(r'[\$,]', '', regex=True).astype(float)
+    listings['neighbourhood'] = listings['neighbourhood'].str.upper()
+    listings['neighbourhood_group'] = listings['neighbourhood_group'].str.upper()
+
+    features = TextFeatureExtractor().run(listings, store, prune=prune)
+    return listings.join(features)
+
+
+def district_stats(listings):
+    """Estadísticas de precio por distrito y barrio (valores de las cloropletas)"""
+    return listings.groupby(AGGREGATE_KEYS, observed=True).agg(
+        listings=('id', 'size'),
+        price_sum=('price', 'sum'),
+        price_count=('price', 'count'),
+        mean_price=('price', 'mean')
+    ).reset_index()
+
+
+class SnapshotDelta:
+    """Actualización incremental del almacén con una nueva descarga de Inside Airbnb.
+
+    Compara la descarga con los alojamientos limpios guardados por `id` y hash de
+    fila, limpia solo las filas insertadas o modificadas y recalcula únicamente
+    los agregados de los distritos y barrios afectados.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def _has_previous(self):
+        return self.store.exists('listings') and 'row_hash' in self.store.columns('listings')
+
+    def full_refresh(self, merged):
+        """Limpiar y guardar la descarga completa"""
+        listings = clean_listings(merged, self.store)
+        stats = district_stats(listings)
+
+        self.store.write('listings', listings)
+        self.store.write('district_stats', stats)
+
+        touched = stats[AGGREGATE_KEYS].drop_duplicates()
+        return listings, {
+            'inserted': len(listings),
+            'updated': 0,
+            'deleted': 0,
+            'touched': list(touched.itertuples(index=False, name=None))
+        }
+
+    def diff(self, merged, previous):
+        """Ids insertados, modificados y eliminados respecto a la versión anterior"""
+        new_hash = pd.Series(merged['row_hash'].to_numpy(), index=merged['id'])
+        old_hash = pd.Series(previous['row_hash'].to_numpy(), index=previous['id'])
+
+        inserted = new_hash.index.difference(old_hash.index)
+        deleted = old_hash.index.difference(new_hash.index)
+        common = new_hash.index.intersection(old_hash.index)
+        updated = common[new_hash[common].to_numpy() != old_hash[common].to_numpy()]
+
+        return inserted, updated, deleted
+
+    @staticmethod
+    def _touched_keys(previous, cleaned, inserted, updated, deleted):
+        """Distritos y barrios cuyos agregados hay que recalcular"""
+        old = previous.set_index('id')[AGGREGATE_COLUMNS]
+        new = cleaned.set_index('id')[AGGREGATE_COLUMNS]
+
+        # En las modificaciones solo cuentan las que cambian zona o precio
+        old_updated = old.loc[updated].astype(object)
+        new_updated = new.loc[updated].astype(object)
+        changed = ~((old_updated == new_updated) | (old_updated.isna() & new_updated.isna())).all(axis=1)
+        changed_ids = updated[changed.to_numpy()]
+
+        keys = pd.concat([
+            old.loc[deleted.union(changed_ids), AGGREGATE_KEYS].astype(str),
+            new.loc[inserted.union(changed_ids), AGGREGATE_KEYS].astype(str)
+        ])
+        return keys.drop_duplicates()
+
+    def _update_stats(self, listings, touched):
+        """Recalcular solo las filas de los agregados afectadas por el cambio"""
+        if not self.store.exists('district_stats'):
+            return district_stats(listings)
+
+        stats = self.store.read('district_stats')
+        touched_index = pd.MultiIndex.from_frame(touched)
+
+        stats_keys = pd.MultiIndex.from_frame(stats[AGGREGATE_KEYS].astype(str))
+        listing_keys = pd.MultiIndex.from_frame(listings[AGGREGATE_KEYS].astype(str))
+
+        kept = stats[~stats_keys.isin(touched_index)]
+        recomputed = district_stats(listings[listing_keys.isin(touched_index)])
+        stats = pd.concat([kept.astype({key: object for key in AGGREGATE_KEYS}), recomputed], ignore_index=True)
+        return stats.sort_values(AGGREGATE_KEYS, ignore_index=True)
+
+    def refresh(self, listings_raw, details_raw):
+        """Aplicar una nueva descarga al almacén.
+
+        Devuelve los alojamientos limpios completos y un resumen del cambio con
+        el número de filas insertadas, modificadas y eliminadas y la lista de
+        (distrito, barrio) cuyos agregados se han recalculado.
+        """
+        merged = merge_snapshot(listings_raw, details_raw)
+        merged['row_hash'] = row_hashes(merged)
+
+        if not self._has_previous():
+            return self.full_refresh(merged)
+
+        previous = self.store.read('listings')
+        inserted, updated, deleted = self.diff(merged, previous)
+
+        changed_ids = inserted.union(updated)
+        cleaned = clean_listings(merged[merged['id'].isin(changed_ids)], self.store, prune=False)
+
+        # Textos de los alojamientos eliminados o modificados que ya no se usan
+        replaced = previous[previous['id'].isin(deleted.union(updated))]
+        TextFeatureExtractor().discard(self.store, replaced, keep=cleaned)
+
+        touched = self._touched_keys(previous, cleaned, inserted, updated, deleted)
+
+        kept = previous[~previous['id'].isin(deleted.union(updated))]
+        listings = pd.concat(
+            [kept.astype({key: object for key in AGGREGATE_KEYS}), cleaned],
+            ignore_index=True
+        ).sort_values('id', ignore_index=True)
+
+        stats = self._update_stats(listings, touched)
+
+        if len(changed_ids) or len(deleted):
+            self.store.write('listings', listings)
+        if len(touched):
+            self.store.write('district_stats', stats)
+
+        return listings, {
+            'inserted': len(inserted),
+            'updated': len(updated),
+            'deleted': len(deleted),
+            'touched': list(touched.itertuples(index=False, name=None))
+        }
@@ -0,0 +1,87 @@
+import unicodedata
+from collections import deque
+
+def normalize_name(name):
+    """Nombre en mayúsculas, sin tildes y con los espacios normalizados"""
+    if not isinstance(name, str):
+        return ''
+    decomposed = unicodedata.normalize('NFKD', name.upper())
+    without_accents = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(without_accents.split())
+
+
+class AhoCorasick:
+    """Autómata de Aho-Corasick para buscar muchos patrones en una sola pasada.
+
+    Cada patrón lleva asociado un conjunto de valores; `find` devuelve la unión
+    de los valores de todos los patrones que aparecen en el texto.
+    """
+
+    def __init__(self, patterns):
+        self.transitions = [{}]
+        self.fail = [0]
+        self.values = [set()]
+
+        for pattern, values in patterns.items():
+            self._add(pattern, values)
+        self._build_fail_links()
+
+    def _add(self, pattern, values):
+        state = 0
+        for char in pattern:
+            if char not in self.transitions[state]:
+                self.transitions.append({})
+                self.fail.append(0)
+                self.values.append(set())
+                self.transitions[state][char] = len(self.transitions) - 1
+            state = self.transitions[state][char]
+        self.values[state].update(values)
+
+    def _build_fail_links(self):
+        """Enlaces de fallo por anchura; cada estado hereda los valores de su enlace"""
+        queue = deque(self.transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.transitions[state].items():
+                queue.append(child)
+
+                fallback = self.fail[state]
+                while fallback and char not in self.transitions[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.transitions[fallback].get(char, 0)
+                self.values[child] |= self.values[self.fail[child]]
+
+    def find(self, text):
+        """Valores de todos los patrones contenidos en el texto"""
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in self.transitions[state]:
+                state = self.fail[state]
+            state = self.transitions[state].get(char, 0)
+            if self.values[state]:
+                found |= self.values[state]
+        return found
+
+
+class StationIndex:
+    """Índice de nombres de estación normalizados a las líneas que los incluyen"""
+
+    def __init__(self, stations_by_line):
+        patterns = {}
+        for line, stations in stations_by_line.items():
+            for station in stations:
+                patterns.setdefault(normalize_name(station), set()).add(line)
+        self.matcher = AhoCorasick(patterns)
+
+    def lines_for(self, stop_name):
+        """Líneas cuyas estaciones aparecen en el nombre de una parada"""
+        return self.matcher.find(normalize_name(stop_name))
+
+    def match(self, stop_names):
+        """Posiciones de las paradas de cada línea, en una sola pasada por las paradas"""
+        positions_by_line = {}
+        for position, stop_name in enumerate(stop_names):
+            for line in self.lines_for(stop_name):
+                positions_by_line.setdefault(line, []).append(position)
+        return positions_by_line
@@ -0,0 +1,168 @@
+import hashlib
+import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+# Superficie indicada en la descripción, en metros o en pies cuadrados
+M2_PATTERN = r'\b(\d+(?:\.\d+)?)\s*(?:m2|m²|metros cuadrados?|mts2|metros2)\b'
+SQFT_PATTERN = r'\b(\d+(?:\.\d+)?)\s*(?:sq\s*ft|square\s*feet|ft²|sqft|feet²|sqfeet|sqf|square meters|sqm)\b'
+SQFT_TO_M2 = 0.092903
+
+# Palabras clave de servicios (en inglés y español). Para extraer un servicio
+# nuevo basta con añadir su patrón aquí.
+AMENITY_PATTERNS = {
+    'wifi': r'\bwi-?fi\b',
+    'terraza': r'\b(?:terraza|balc[oó]n|terrace|balcony)\b',
+    'ascensor': r'\b(?:ascensor|elevator|lift)\b',
+    'aire_acondicionado': r'\b(?:aire acondicionado|air conditioning|a/c)\b',
+    'calefaccion': r'\b(?:calefacci[oó]n|heating)\b',
+    'piscina': r'\b(?:piscina|swimming pool|pool)\b',
+    'parking': r'\b(?:parking|garaje|garage|aparcamiento)\b',
+}
+
+
+def patterns_digest(amenity_patterns):
+    """Huella (uint64) de los patrones de superficie y de servicios"""
+    raw = repr((M2_PATTERN, SQFT_PATTERN, SQFT_TO_M2, sorted(amenity_patterns.items())))
+    return np.uint64(int(hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16], 16))
+
+
+@lru_cache(maxsize=8)
+def _compile(amenity_patterns):
+    """Compilar los patrones una sola vez por proceso"""
+    m2 = re.compile(M2_PATTERN, flags=re.IGNORECASE)
+    sqft = re.compile(SQFT_PATTERN, flags=re.IGNORECASE)
+    amenities = [(name, re.compile(pattern, flags=re.IGNORECASE)) for name, pattern in amenity_patterns]
+    return m2, sqft, amenities
+
+
+def _extract_chunk(args):
+    """Extraer las características de un bloque de descripciones (se ejecuta en el pool)"""
+    descriptions, amenity_patterns = args
+    m2_re, sqft_re, amenities = _compile(amenity_patterns)
+
+    m2 = np.full(len(descriptions), np.nan, dtype='float64')
+    flags = {name: np.zeros(len(descriptions), dtype=bool) for name, _ in amenities}
+
+    for i, text in enumerate(descriptions):
+        if not isinstance(text, str):
+            continue
+
+        match = m2_re.search(text)
+        if match:
+            m2[i] = float(match.group(1))
+        else:
+            match = sqft_re.search(text)
+            if match:
+                m2[i] = float(match.group(1)) * SQFT_TO_M2
+
+        for name, pattern in amenities:
+            flags[name][i] = pattern.search(text) is not None
+
+    return {'m2': m2, **flags}
+
+
+class TextFeatureExtractor:
+    """Extracción incremental de características de las descripciones.
+
+    Los resultados se guardan indexados por un hash del id y la descripción de
+    cada alojamiento, de forma que en una nueva descarga solo se procesan los
+    alojamientos cuyo texto ha cambiado. El hash incluye también la huella de
+    los patrones: si se edita una expresión, se vuelve a procesar todo.
+    """
+
+    STORE_NAME = 'text_features'
+
+    def __init__(self, amenity_patterns=None, workers=None, chunksize=2000):
+        self.amenity_patterns = AMENITY_PATTERNS if amenity_patterns is None else amenity_patterns
+        self.workers = workers
+        self.chunksize = chunksize
+
+    @property
+    def columns(self):
+        return ['m2'] + list(self.amenity_patterns)
+
+    def text_keys(self, listings):
+        """Hash de (id, descripción) de cada alojamiento, combinado con la huella de los patrones"""
+        return pd.util.hash_pandas_object(
+            listings[['id', 'description']].astype({'description': 'string'}),
+            index=False
+        ).to_numpy() ^ patterns_digest(self.amenity_patterns)
+
+    def extract(self, descriptions):
+        """Extraer las características de una lista de descripciones"""
+        patterns = tuple(self.amenity_patterns.items())
+        chunks = [
+            (descriptions[start:start + self.chunksize], patterns)
+            for start in range(0, len(descriptions), self.chunksize)
+        ]
+
+        if len(chunks) <= 1:
+            # Para pocos textos no compensa arrancar el pool
+            results = [_extract_chunk(chunk) for chunk in chunks]
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                results = list(executor.map(_extract_chunk, chunks))
+
+        if not results:
+            return pd.DataFrame({col: pd.Series(dtype='float64' if col == 'm2' else bool) for col in self.columns})
+
+        return pd.DataFrame({
+            col: np.concatenate([result[col] for result in results])
+            for col in self.columns
+        })
+
+    def run(self, listings, store=None, prune=True):
+        """Características de cada alojamiento, reutilizando las ya calculadas.
+
+        Devuelve un DataFrame alineado con el índice de `listings`. Si se indica
+        un almacén, se leen de él los resultados previos y se guardan los nuevos.
+        Con `prune=False` se conservan también los textos que no están en
+        `listings` (útil cuando solo se procesa una parte de la descarga).
+        """
+        keys = self.text_keys(listings)
+
+        cached = None
+        if store is not None and store.exists(self.STORE_NAME):
+            cached = store.read(self.STORE_NAME).set_index('text_key')
+            if not set(self.columns).issubset(cached.columns):
+                # Los servicios han cambiado: hay que recalcularlo todo
+                cached = None
+
+        if cached is not None:
+            pending = ~pd.Index(keys).isin(cached.index)
+        else:
+            pending = np.ones(len(keys), dtype=bool)
+
+        descriptions = listings['description'].to_numpy()[pending].tolist()
+        new = self.extract(descriptions)
+        new.index = pd.Index(keys[pending], name='text_key')
+
+        if cached is not None:
+            features = pd.concat([cached[self.columns], new])
+        else:
+            features = new
+        features = features[~features.index.duplicated()]
+
+        if store is not None:
+            # Salvo que se pida lo contrario, solo conservamos los textos de la descarga actual
+            stored = features.reindex(pd.Index(keys, name='text_key')) if prune else features
+            store.write(self.STORE_NAME, stored.reset_index())
+
+        return features.reindex(pd.Index(keys, name='text_key')).set_index(listings.index)
+
+    def discard(self, store, listings, keep=None):
+        """Quitar del almacén los textos de `listings`, salvo los que siguen en `keep`"""
+        if not len(listings) or not store.exists(self.STORE_NAME):
+            return
+
+        keys = pd.Index(self.text_keys(listings))
+        if keep is not None:
+            keys = keys.difference(self.text_keys(keep))
+
+        stored = store.read(self.STORE_NAME)
+        stale = stored['text_key'].isin(keys)
+        if stale.any():
+            store.write(self.STORE_NAME, stored[~stale].reset_index(drop=True))